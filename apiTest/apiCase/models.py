@@ -89,6 +89,8 @@ class ApiInfo(models.Model):
         table = "api_info"
         table_description = "接口信息"
         ordering = ["-create_time"]  # 按创建时间降序排列
+        # 接口列表：按项目过滤，按创建时间降序分页
+        indexes = (("project_id", "create_time"),)
 
 
 class ApiCase(models.Model):
@@ -138,6 +140,8 @@ class ApiCase(models.Model):
         table = "api_cases"
         table_description = "接口测试用例"
         ordering = ["-create_time"]  # 按创建时间降序排列
+        # 用例列表：按项目过滤，按创建时间降序分页
+        indexes = (("project_id", "create_time"),)
 
 
 if __name__ == '__main__':
@@ -13,6 +13,7 @@ from fastapi import APIRouter, HTTPException, Depends, status
 from tortoise.expressions import Q
 
 from auth.auth import is_authenticated
+from dispatch.plan_cache import api_plan_cache
 from .schemas import (
     ApiInfoSchema, AddApiInfoForm, UpdateApiInfoForm,
     ApiCaseSchema, AddApiCaseForm, UpdateApiCaseForm, ApiInfoStatusForm, ApiInfoList, ApiInfoDebugSchema,
@@ -239,6 +240,8 @@ async def update_api_case(case_id: int, item: UpdateApiCaseForm = UpdateApiCaseF
     update_data = item.model_dump(exclude_unset=True)
     await api_case.update_from_dict(update_data)
     await api_case.save()
+    # 使已缓存的执行计划失效
+    await api_plan_cache.invalidate()
     # 返回时包含用户信息
     return await ApiCaseSchema.from_orm_with_relations(api_case)
 
@@ -259,6 +262,8 @@ async def update_api_case_status(case_id: int, item: ApiCaseStatusForm):
     # 直接更新并刷新对象
     await api_case.update_from_dict(item.model_dump(exclude_unset=True))
     await api_case.save()
+    # 使已缓存的执行计划失效
+    await api_plan_cache.invalidate()
 
     # 刷新关联关系
     await api_case.fetch_related("project", "create_user", "update_user")
@@ -276,6 +281,8 @@ async def delete_api_case(case_id: int):
             detail="接口用例不存在"
         )
     await api_case.delete()
+    # 使已缓存的执行计划失效
+    await api_plan_cache.invalidate()
 
 
 @router.post("/caseDebug", summary="接口数据调试", response_model=ApiDebugResponse)
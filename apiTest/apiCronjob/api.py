@@ -5,6 +5,7 @@ from .models import ApiCronjob
 from .schemas import CronjobForm, CronjobUpdateForm
 from wealth.project.models import Project
 from wealth.environment.models import Environment
+from wealth.environment.snapshot import snapshot_env
 from apscheduler.jobstores.redis import RedisJobStore
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.date import DateTrigger
@@ -13,12 +14,11 @@ import pytz
 from common import settings
 from auth.auth import is_authenticated
 from tortoise import transactions
-from common.mq_producer import MQProducer
+from dispatch.outbox import outbox_message, enqueue_dispatch, outbox_relay
 from wealth.device.models import Device
 
-from ..apiCase.models import ApiCase
-from ..apiRecordExecution.models import ApiTaskRunRecord, ApiSuiteRunRecord, ApiCaseRunRecord
-from ..apiSuite.models import ApiTestSuite
+from ..apiRecordExecution.models import ApiTaskRunRecord
+from ..src.run_plan import compile_task_plan, create_run_records
 from ..task.models import ApiTask
 
 # 创建路由对象
@@ -49,7 +49,7 @@ async def run_task_async(task_id, env_id, cronjob_type):
     :return:
     """
     # 获取测试套件数据
-    task = await ApiTask.get_or_none(id=task_id).prefetch_related('suites', 'project')
+    task = await ApiTask.get_or_none(id=task_id).prefetch_related('project')
     if not task:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="测试计划不存在！")
 
@@ -74,65 +74,42 @@ async def run_task_async(task_id, env_id, cronjob_type):
         "verify_ssl": True,
         "auth_type": "none",
     }
-
-    # 创建一条任务执行的记录
-    task_record = await ApiTaskRunRecord.create(task=task, username=task.username, env=env_config, project=task.project)
-    task_count = 0
-    mq = MQProducer(is_api=True)
-    # case_create_user_name = case_.create_user.username if case_ and case_.create_user else "未知用户"
-    # 获取测试计划的套件数据
-    for suite in await task.suites.all():
-        cases = []
-        # 获取遍历出来套件中的用例数据
-        suite_ = await ApiTestSuite.get_or_none(id=suite.id)
-        if not suite_:
-            continue
-
-        # 创建套件的运行记录
-        suite_record = await ApiSuiteRunRecord.create(suite=suite_, username=task.username, env=env_config,
-                                                      task_records=task_record)
-
-        for index, suite_case in enumerate(suite_.cases_order):
-            # suite_case_data = json.loads(suite_case)
-            case_ = await ApiCase.get_or_none(id=suite_case.get('id'))
-            # 创建一条执行记录
-            case_record = await ApiCaseRunRecord.create(case=case_, username=task.username,
-                                                        suite_records=suite_record,
-                                                        env=env_config)
-            cases.append({
-                "record_id": case_record.id,
-                'id': case_.id,
-                'name': case_.case_name,
-                "skip": suite_case.get('skip', False),
-                "steps": index
-            })
-
-        task_count += len(cases)
-        suite_record.all = len(cases)
-        await suite_record.save()
-
-        run_suite = {
-            'id': suite_.id,
-            'suite_record_id': suite_record.id,
-            'task_record_id': task_record.id,
-            'name': suite_.suite_name,
-            "username": task.username,
-            "variables": suite_.variables,  # 公共变量
-            "config": suite_.config,  # 公共配置
-            "reset_cache": True,  # 是否重置缓存
-            # 测试套件的公共前置操作
-            'setup_step': suite_.suite_setup_step,
-            "cases": cases,
-            "cronjob_type": cronjob_type,
-        }
-
-        mq.send_api_test_task(env_config=env_config, run_case=run_suite, device_id=device_id)
-    # 关闭MQ连接
-    mq.close()
-
-    # 修改任务中的用例总数
-    task_record.all = task_count
-    await task_record.save()
+    # 执行环境按内容保存为快照，执行记录只引用快照id
+    env_snapshot_id = await snapshot_env(env_config)
+
+    # 执行记录和发件箱消息在同一个事务中写入
+    async with transactions.in_transaction():
+        # 展开计划中的套件和用例，计划没有变化时直接使用缓存
+        suite_cases = await compile_task_plan(task)
+        # 创建一条任务执行的记录，用例总数在创建时直接写入
+        task_record = await ApiTaskRunRecord.create(task=task, username=task.username, env_snapshot_id=env_snapshot_id,
+                                                    project=task.project,
+                                                    all=sum(len(cases) for _, cases in suite_cases))
+        # 批量创建套件、用例的运行记录
+        run_records = await create_run_records(suite_cases, username=task.username, env_snapshot_id=env_snapshot_id,
+                                               task_record=task_record)
+        messages = []
+        for suite_, suite_record, cases in run_records:
+            run_suite = {
+                'id': suite_.id,
+                'suite_record_id': suite_record.id,
+                'task_record_id': task_record.id,
+                'name': suite_.suite_name,
+                "username": task.username,
+                "variables": suite_.variables,  # 公共变量
+                "config": suite_.config,  # 公共配置
+                "reset_cache": True,  # 是否重置缓存
+                # 测试套件的公共前置操作
+                'setup_step': suite_.suite_setup_step,
+                "cases": cases,
+                "cronjob_type": cronjob_type,
+            }
+
+            messages.append(outbox_message('api_test', env_config=env_config, run_case=run_suite,
+                                           device_id=device_id, entry='cron'))
+        # 写入发件箱，事务提交后由后台中转批量发布到设备
+        await enqueue_dispatch(*messages)
+    outbox_relay.wake()
 
     return {"msg": "API定时任务已经提交到对应的设备，等待执行完毕！", "task_record_id": task_record.id}
 
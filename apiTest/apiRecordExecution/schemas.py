@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 
 class RunForm(BaseModel):
@@ -14,6 +14,25 @@ class RunForm(BaseModel):
     reset_cache: bool | None = Field(default=False, description="是否重置缓存")
 
 
+class CaseResultForm(BaseModel):
+    """单条用例执行结果"""
+    record_id: int = Field(description="用例执行记录id")
+    status: Literal["success", "fail", "error", "skip", "no_run"] = Field(description="执行结果")
+    run_info: dict = Field(default_factory=dict, description="用例执行详情")
+
+
+class CaseResultBatchForm(BaseModel):
+    """批量上报的用例执行结果"""
+    results: List[CaseResultForm] = Field(description="用例执行结果列表", min_length=1, max_length=1000)
+
+
+class RecordCleanupForm(BaseModel):
+    """批量删除历史运行记录表单"""
+    project_id: int = Field(description="项目id")
+    before: datetime = Field(description="删除早于该时间的运行记录")
+    username: str | None = Field(default=None, description="操作人")
+
+
 class SuiteResultSchemas(BaseModel):
     """套件结果模型类"""
     id: int = Field(description="套件记录id")
@@ -1,17 +1,55 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Header, status
 from wealth.device.models import Device
 from wealth.environment.models import Environment
-from .schemas import RunForm, SuiteResultSchemas, TaskResultSchemas
+from wealth.environment.snapshot import snapshot_env, hydrate_env
+from .schemas import RunForm, SuiteResultSchemas, TaskResultSchemas, CaseResultBatchForm, RecordCleanupForm
 from ..apiSuite.models import ApiTestSuite
 from ..apiCase.models import ApiCase
 from ..task.models import ApiTask
+from ..src.run_plan import load_suite_cases, create_run_records, estimate_suite_durations
 from .models import ApiTaskRunRecord, ApiSuiteRunRecord, ApiCaseRunRecord
-from common.mq_producer import MQProducer
+from dispatch.outbox import outbox_message, enqueue_dispatch, outbox_relay
+from dispatch.scheduler import plan_assignment
+from dispatch.results import ResultIngestor
+from archive.archiver import RecordArchiver, restore_archived
+from archive.deletion import RecordDeleter
+from archive.models import DeletionJob
+from stats.collector import StatsCollector
 from tortoise import transactions
 from auth.auth import is_authenticated
+from common.pagination import keyset_paginate, sparse_fields
+from common.detail_cache import cached_detail, cache_detail
 
 # 创建路由对象
 router = APIRouter(dependencies=[Depends(is_authenticated)])
+# 接口用例执行结果上报
+api_results = ResultIngestor('api_test', ApiCaseRunRecord, ApiSuiteRunRecord, ApiTaskRunRecord)
+# 接口执行记录归档
+api_archiver = RecordArchiver('api_test', ApiTaskRunRecord, ApiSuiteRunRecord, ApiCaseRunRecord)
+# 接口执行记录后台删除
+api_deleter = RecordDeleter('api_test', ApiTaskRunRecord, ApiSuiteRunRecord, ApiCaseRunRecord)
+# 接口执行统计采集
+api_stats = StatsCollector('api_test', ApiTaskRunRecord, ApiSuiteRunRecord, ApiCaseRunRecord)
+# 运行记录列表默认返回的摘要字段 {返回字段名: 查询字段}，日志等大字段通过fields参数获取
+TASK_RECORD_FIELDS = {
+    "id": "id", "task_id": "task_id", "task_name": "task__name", "username": "username", "start_time": "start_time",
+    "duration": "duration", "status": "status", "run_all": "run_all", "success": "success", "fail": "fail",
+    "error": "error", "skip": "skip", "all": "all", "no_run": "no_run", "pass_rate": "pass_rate"
+}
+TASK_RECORD_HEAVY_FIELDS = {"env": "env", "task_log": "task_log"}
+# 套件运行记录列表的摘要字段
+SUITE_RECORD_FIELDS = {
+    "id": "id", "suite_id": "suite_id", "suite_name": "suite__suite_name", "duration": "duration",
+    "username": "username", "start_time": "start_time", "status": "status", "run_all": "run_all",
+    "success": "success", "fail": "fail", "error": "error", "skip": "skip", "all": "all", "no_run": "no_run"
+}
+SUITE_RECORD_HEAVY_FIELDS = {"env": "env", "suite_log": "suite_log"}
+# 用例运行记录列表的摘要字段
+CASE_RECORD_FIELDS = {
+    "id": "id", "case_id": "case_id", "case_name": "case__case_name", "username": "username",
+    "start_time": "start_time", "status": "status"
+}
+CASE_RECORD_HEAVY_FIELDS = {"run_info": "run_info", "env": "env"}
 
 
 # 执行单条用例
@@ -36,8 +74,10 @@ async def run_case(case_id: int, item: RunForm):
             "verify_ssl": True,
             "auth_type": "none",
         }
+        # 执行环境按内容保存为快照，执行记录只引用快照id
+        env_snapshot_id = await snapshot_env(env_config)
         # 创建一条执行记录
-        case_record = await ApiCaseRunRecord.create(case=case_, username=item.username, env=env_config)
+        case_record = await ApiCaseRunRecord.create(case=case_, username=item.username, env_snapshot_id=env_snapshot_id)
         run_case = {
             'id': case_.id,
             'name': case_.case_name,
@@ -57,13 +97,16 @@ async def run_case(case_id: int, item: RunForm):
         }
         # 获取执行的设备ID
         device_id = item.device_id
-        # 判断设备的状态
-        device = await Device.get_or_none(id=device_id)
-        mq = MQProducer(is_api=True)
-        if device and device.status == "在线":
-            mq.send_api_test_task(env_config=env_config, run_case=run_case, device_id=device_id)
-            mq.close()
-        return {"msg": "API用例执行任务已经提交到对应的设备，等待执行完毕！", "record_id": case_record.id}
+        # 判断设备的状态，设备不在线时消息暂存在发件箱，设备上线后自动下发
+        device = await Device.get_or_none(id=device_id) if device_id else None
+        deferred = not (device and device.status == "在线")
+        # 写入发件箱，事务提交后由后台中转发布到设备
+        await enqueue_dispatch(outbox_message('api_test', env_config=env_config, run_case=run_case,
+                                              device_id=device_id or '', entry='case', deferred=deferred))
+    outbox_relay.wake()
+    if deferred:
+        return {"msg": "设备当前不在线，API用例执行任务已进入等待队列，设备上线后自动执行！", "record_id": case_record.id, "deferred": True}
+    return {"msg": "API用例执行任务已经提交到对应的设备，等待执行完毕！", "record_id": case_record.id}
 
 
 # 运行测试套件
@@ -89,24 +132,11 @@ async def run_suite(suite_id: int, item: RunForm):
             "verify_ssl": True,
             "auth_type": "none",
         }
-        # 创建套件的运行记录
-        suite_record = await ApiSuiteRunRecord.create(suite=suite_, username=item.username, env=env_config)
-        # 获取测试套件的用例数据
-        cases = []
-        for index, suite_case in enumerate(suite_.cases_order):
-            case_ = await ApiCase.get_or_none(id=suite_case.get('id'))
-            # 创建一条执行记录
-            case_record = await ApiCaseRunRecord.create(case=case_, username=item.username, suite_records=suite_record,
-                                                        env=env_config)
-            cases.append({
-                "record_id": case_record.id,
-                'id': case_.id,
-                'name': case_.case_name,
-                "skip": suite_case.get('skip', False),
-                "steps": index
-            })
-        suite_record.all = len(cases)
-        await suite_record.save()
+        # 执行环境按内容保存为快照，执行记录只引用快照id
+        env_snapshot_id = await snapshot_env(env_config)
+        # 批量创建套件、用例的运行记录
+        [(_, suite_record, cases)] = await create_run_records(await load_suite_cases([suite_]),
+                                                               username=item.username, env_snapshot_id=env_snapshot_id)
         run_suite = {
             'id': suite_.id,
             'suite_record_id': suite_record.id,
@@ -122,13 +152,16 @@ async def run_suite(suite_id: int, item: RunForm):
         }
         # 获取执行的设备ID
         device_id = item.device_id
-        # 判断设备的状态
-        device = await Device.get_or_none(id=device_id)
-        mq = MQProducer(is_api=True)
-        if device and device.status == "在线":
-            mq.send_api_test_task(env_config=env_config, run_case=run_suite, device_id=device_id)
-            mq.close()
-        return {"msg": "API套件执行任务已经提交到对应的设备，等待执行完毕！", "suite_record_id": suite_record.id}
+        # 判断设备的状态，设备不在线时消息暂存在发件箱，设备上线后自动下发
+        device = await Device.get_or_none(id=device_id) if device_id else None
+        deferred = not (device and device.status == "在线")
+        # 写入发件箱，事务提交后由后台中转发布到设备
+        await enqueue_dispatch(outbox_message('api_test', env_config=env_config, run_case=run_suite,
+                                              device_id=device_id or '', entry='suite', deferred=deferred))
+    outbox_relay.wake()
+    if deferred:
+        return {"msg": "设备当前不在线，API套件执行任务已进入等待队列，设备上线后自动执行！", "suite_record_id": suite_record.id, "deferred": True}
+    return {"msg": "API套件执行任务已经提交到对应的设备，等待执行完毕！", "suite_record_id": suite_record.id}
 
 
 # 运行测试计划
@@ -140,8 +173,8 @@ async def run_task(task_id: int, item: RunForm):
         if not task_:
             raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="测试计划不存在！")
         # 检查测试计划中是否有套件
-        suite_count = await task_.suites.all().count()
-        if suite_count == 0:
+        suites = await task_.suites.all()
+        if not suites:
             raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                                 detail="测试计划中没有套件，请先在测试计划中添加套件！")
         # 获取测试环境
@@ -158,6 +191,8 @@ async def run_task(task_id: int, item: RunForm):
             "verify_ssl": True,
             "auth_type": "none",
         }
+        # 执行环境按内容保存为快照，执行记录只引用快照id
+        env_snapshot_id = await snapshot_env(env_config)
         # 获取设备列表
         device_ids = []
         if item.device_ids:
@@ -175,44 +210,23 @@ async def run_task(task_id: int, item: RunForm):
         if not online_device_ids:
             raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="没有在线的设备可供执行任务！")
 
-        # 创建一条任务执行的记录
-        task_record = await ApiTaskRunRecord.create(task=task_, username=item.username, env=env_config,
-                                                    project=task_.project)
-        task_count = 0
-        mq = MQProducer(is_api=True)
-        # 获取测试计划的套件数据
-        for suite in await task_.suites.all():
-            cases = []
-
-            # 获取遍历出来套件中的用例数据
-            suite_ = await ApiTestSuite.get_or_none(id=suite.id)
-            if not suite_:
-                continue
-            # 创建套件的运行记录
-            suite_record = await ApiSuiteRunRecord.create(suite=suite_, username=item.username,
-                                                          env=env_config,
-                                                          task_records=task_record)
-
-            for index, suite_case in enumerate(suite_.cases_order):
-                print(suite_case)
-                print(type(suite_case))
-                case_ = await ApiCase.get_or_none(id=suite_case.get('id'))
-                # 创建一条执行记录
-                case_record = await ApiCaseRunRecord.create(case=case_, username=item.username,
-                                                            suite_records=suite_record,
-                                                            env=env_config)
-                cases.append({
-                    "record_id": case_record.id,
-                    'id': case_.id,
-                    'name': case_.case_name,
-                    "skip": suite_case.get('skip', False),
-                    "steps": index
-                })
-
-            task_count += len(cases)
-            suite_record.all = len(cases)
-            await suite_record.save()
-
+        # 一次性查询所有套件引用的用例
+        suite_cases = await load_suite_cases(suites)
+        # 创建一条任务执行的记录，用例总数在创建时直接写入
+        task_record = await ApiTaskRunRecord.create(task=task_, username=item.username, env_snapshot_id=env_snapshot_id,
+                                                    project=task_.project,
+                                                    all=sum(len(cases) for _, cases in suite_cases))
+        # 批量创建套件、用例的运行记录
+        run_records = await create_run_records(suite_cases, username=item.username, env_snapshot_id=env_snapshot_id,
+                                               task_record=task_record)
+        # 按历史耗时把套件分配到所有在线设备，耗时最长的套件优先分配
+        durations = await estimate_suite_durations(suite_cases)
+        plan = plan_assignment({suite_record.id: durations[suite_.id] for suite_, suite_record, _ in run_records},
+                               online_device_ids)
+        suite_devices = {suite_record_id: device_id for device_id, suite_record_ids in plan['assignment'].items()
+                         for suite_record_id in suite_record_ids}
+        messages = []
+        for suite_, suite_record, cases in run_records:
             run_suite_ = {
                 'id': suite_.id,
                 'suite_record_id': suite_record.id,
@@ -228,70 +242,64 @@ async def run_task(task_id: int, item: RunForm):
                 "cronjob_type": 1,
             }
 
-            mq.send_api_test_task(env_config=env_config, run_case=run_suite_, device_id=online_device_ids[0])
-        # 关闭MQ连接
-        mq.close()
-
-        # 修改任务中的用例总数
-        task_record.all = task_count
-        await task_record.save()
+            messages.append(outbox_message('api_test', env_config=env_config, run_case=run_suite_,
+                                           device_id=suite_devices[suite_record.id], entry='plan'))
+        # 写入发件箱，事务提交后由后台中转批量发布到设备
+        await enqueue_dispatch(*messages)
+    outbox_relay.wake()
     return {"msg": f"API计划执行任务已经提交到{len(online_device_ids)}个在线设备执行，等待执行完毕！",
-            "task_record_id": task_record.id}
+            "task_record_id": task_record.id,
+            # 每台设备分配的套件执行记录id和预计耗时（秒）
+            "plan": {device_id: {"suite_record_ids": suite_record_ids, "expected_duration": plan['loads'][device_id]}
+                     for device_id, suite_record_ids in plan['assignment'].items()},
+            "expected_makespan": plan['makespan']}
+
+
+# 执行器批量上报用例执行结果
+@router.post("/results", tags=["测试运行"], summary="批量上报用例执行结果", status_code=status.HTTP_200_OK)
+async def report_results(item: CaseResultBatchForm):
+    return await api_results.ingest([result.model_dump() for result in item.results])
 
 
 # 获取测试计划的运行记录
 @router.get("/task/record", tags=["测试运行"], summary="任务运行记录", status_code=status.HTTP_200_OK)
-async def get_task_record(project_id: int, task_id: int = None, page: int = 1, size: int = 10):
+async def get_task_record(project_id: int, task_id: int = None, page: int = 1, size: int = 10,
+                          cursor: int = None, with_total: bool = False, fields: str = None):
     # 获取测试计划的运行记录
-    query = ApiTaskRunRecord.filter(project=project_id)
+    query = ApiTaskRunRecord.filter(project=project_id, hidden=False)
     # 判断是否传了任务id
     if task_id:
         query = query.filter(task=task_id)
-    # 根据id降序排序
-    query = query.order_by("-id")
-    # 获取任务执行的记录总数
-    total = await query.count()
-    # 分页获取数据
-    data = await query.offset((page - 1) * size).limit(size).prefetch_related('task')
-    result = []
-    for i in data:
-        result.append({
-            "id": i.id,
-            "task_id": i.task.id,
-            "task_name": i.task.name,
-            "username": i.username,
-            "start_time": i.start_time,
-            "duration": i.duration,
-            "status": i.status,
-            "run_all": i.run_all,
-            "success": i.success,
-            "fail": i.fail,
-            "error": i.error,
-            "skip": i.skip,
-            "all": i.all,
-            "no_run": i.no_run,
-            "env": i.env,
-            "pass_rate": i.pass_rate,
-            "task_log": i.task_log
-        })
-    return {"total": total, "data": result}
+    # 按id降序游标分页，翻页时传入上一页返回的next_cursor；默认不统计总数（total为null），
+    # 需要时传with_total=true，总数在Redis中短时间缓存
+    # 默认只查询摘要字段，日志等大字段通过fields参数获取（如 fields=env,task_log）
+    values = sparse_fields(TASK_RECORD_FIELDS, TASK_RECORD_HEAVY_FIELDS, fields)
+    data, next_cursor, total = await keyset_paginate(query, size, cursor=cursor, page=page, with_total=with_total,
+                                                     count_key=f"api_task_record:{project_id}:{task_id}",
+                                                     values=values)
+    # 已归档的记录从归档文件回填大字段
+    await restore_archived(data, ApiTaskRunRecord)
+    # 从执行环境快照回填env
+    await hydrate_env(data)
+    return {"total": total, "data": data, "next_cursor": next_cursor}
 
 
 # 删除测试计划的运行记录
 @router.delete('/task/record/{record_id}', tags=['测试运行'], summary='删除任务运行记录',
                status_code=status.HTTP_204_NO_CONTENT)
 async def delete_task_record(record_id: int):
-    record = await ApiTaskRunRecord.get_or_none(id=record_id)
-    if not record:
+    if not await ApiTaskRunRecord.filter(id=record_id, hidden=False).exists():
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="任务运行记录不存在")
-    await record.delete()
+    # 记录立即隐藏，下级的套件、用例记录由后台任务分批删除
+    await api_deleter.delete_record('task', record_id)
 
 
 # 获取测试套件的运行记录
 @router.get("/suite/record", tags=["测试运行"], summary="套件运行记录", status_code=status.HTTP_200_OK)
-async def get_suite_record(suite_id: int = None, task_records_id: int = None, page: int = 1, size: int = 10):
+async def get_suite_record(suite_id: int = None, task_records_id: int = None, page: int = 1, size: int = 10,
+                           cursor: int = None, with_total: bool = False, fields: str = None):
     # 获取测试套件的运行记录
-    query = ApiSuiteRunRecord.all()
+    query = ApiSuiteRunRecord.filter(hidden=False)
     # 判断是否传了套件id
     if suite_id:
         query = query.filter(suite=suite_id)
@@ -300,50 +308,36 @@ async def get_suite_record(suite_id: int = None, task_records_id: int = None, pa
     else:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                             detail="suite_id和task_records_id至少传递一个")
-    # 根据id降序排序
-    query = query.order_by("-id")
-    # 获取套件执行的记录总数
-    total = await query.count()
-    # 分页获取数据
-    data = await query.offset((page - 1) * size).limit(size).prefetch_related('suite')
-    result = []
-    for i in data:
-        result.append({
-            "id": i.id,
-            "suite_id": i.suite.id,
-            "suite_name": i.suite.suite_name,
-            "duration": i.duration,
-            "username": i.username,
-            "start_time": i.start_time,
-            "status": i.status,
-            "run_all": i.run_all,
-            "success": i.success,
-            "fail": i.fail,
-            "error": i.error,
-            "skip": i.skip,
-            "all": i.all,
-            "no_run": i.no_run,
-            "env": i.env,
-            "suite_log": i.suite_log
-        })
-    return {"total": total, "data": result}
+    # 按id降序游标分页，翻页时传入上一页返回的next_cursor；默认不统计总数（total为null），
+    # 需要时传with_total=true，总数在Redis中短时间缓存
+    # 默认只查询摘要字段，日志等大字段通过fields参数获取（如 fields=env,suite_log）
+    values = sparse_fields(SUITE_RECORD_FIELDS, SUITE_RECORD_HEAVY_FIELDS, fields)
+    data, next_cursor, total = await keyset_paginate(query, size, cursor=cursor, page=page, with_total=with_total,
+                                                     count_key=f"api_suite_record:{suite_id}:{task_records_id}",
+                                                     values=values)
+    # 已归档的记录从归档文件回填大字段
+    await restore_archived(data, ApiSuiteRunRecord)
+    # 从执行环境快照回填env
+    await hydrate_env(data)
+    return {"total": total, "data": data, "next_cursor": next_cursor}
 
 
 # 删除测试套件的运行记录
 @router.delete('/suite/record/{record_id}', tags=['测试运行'], summary='删除套件运行记录',
                status_code=status.HTTP_204_NO_CONTENT)
 async def delete_suite_record(record_id: int):
-    record = await ApiSuiteRunRecord.get_or_none(id=record_id)
-    if not record:
+    if not await ApiSuiteRunRecord.filter(id=record_id, hidden=False).exists():
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="套件运行记录不存在")
-    await record.delete()
+    # 记录立即隐藏，下级的用例记录由后台任务分批删除
+    await api_deleter.delete_record('suite', record_id)
 
 
 # 获取测试用例的运行记录
 @router.get("/case/record", tags=["测试运行"], summary="用例运行记录", status_code=status.HTTP_200_OK)
-async def get_case_record(case_id: int = None, suite_records_id: int = None, page: int = 1, size: int = 10):
+async def get_case_record(case_id: int = None, suite_records_id: int = None, page: int = 1, size: int = 10,
+                          cursor: int = None, with_total: bool = False, fields: str = None):
     # 获取测试用例的运行记录
-    query = ApiCaseRunRecord.all().prefetch_related('case')
+    query = ApiCaseRunRecord.filter(hidden=False)
     # 判断是否传了套件id
     if case_id:
         query = query.filter(case=case_id)
@@ -352,55 +346,78 @@ async def get_case_record(case_id: int = None, suite_records_id: int = None, pag
     else:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                             detail="case_id和suite_records_id至少传递一个！")
-    # 根据id降序排序
-    query = query.order_by("-id")
-    # 获取套件执行的记录总数
-    total = await query.count()
-    # 分页获取数据
-    data = await query.offset((page - 1) * size).limit(size).prefetch_related('case')
-    result = []
-    for i in data:
-        result.append({
-            "id": i.id,
-            "case_id": i.case.id,
-            "case_name": i.case.case_name,
-            "username": i.username,
-            "start_time": i.start_time,
-            "status": i.status,
-            "run_info": i.run_info,
-            "env": i.env,
-        })
-    return {"total": total, "data": result}
+    # 按id降序游标分页，翻页时传入上一页返回的next_cursor；默认不统计总数（total为null），
+    # 需要时传with_total=true，总数在Redis中短时间缓存
+    # 默认只查询摘要字段，日志等大字段通过fields参数获取（如 fields=env,run_info）
+    values = sparse_fields(CASE_RECORD_FIELDS, CASE_RECORD_HEAVY_FIELDS, fields)
+    data, next_cursor, total = await keyset_paginate(query, size, cursor=cursor, page=page, with_total=with_total,
+                                                     count_key=f"api_case_record:{case_id}:{suite_records_id}",
+                                                     values=values)
+    # 已归档的记录从归档文件回填大字段
+    await restore_archived(data, ApiCaseRunRecord)
+    # 从执行环境快照回填env
+    await hydrate_env(data)
+    return {"total": total, "data": data, "next_cursor": next_cursor}
 
 
 # 删除测试用例的运行记录
 @router.delete('/case/record/{record_id}', tags=['测试运行'], summary='删除用例运行记录',
                status_code=status.HTTP_204_NO_CONTENT)
 async def delete_case_record(record_id: int):
-    record = await ApiCaseRunRecord.get_or_none(id=record_id)
+    record = await ApiCaseRunRecord.get_or_none(id=record_id, hidden=False)
     if not record:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="用例运行记录不存在")
     await record.delete()
 
 
+# 删除项目中早于指定时间的运行记录
+@router.post('/record/cleanup', tags=['测试运行'], summary='批量删除历史运行记录', status_code=status.HTTP_202_ACCEPTED)
+async def cleanup_records(item: RecordCleanupForm):
+    # 创建后台删除任务，通过返回的任务id查询删除进度
+    job = await api_deleter.delete_before(item.project_id, item.before, item.username)
+    return {"job_id": job.id}
+
+
+# 查询运行记录删除任务的进度
+@router.get('/record/cleanup/{job_id}', tags=['测试运行'], summary='运行记录删除进度', status_code=status.HTTP_200_OK)
+async def get_cleanup_progress(job_id: int):
+    job = await DeletionJob.get_or_none(id=job_id, task_type='api_test')
+    if not job:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="删除任务不存在")
+    progress = min(round(job.deleted / job.total * 100, 2), 100) if job.total else (100 if job.status == "done" else 0)
+    return {"id": job.id, "scope": job.scope, "target_id": job.target_id, "before": job.before, "status": job.status,
+            "total": job.total, "deleted": job.deleted, "progress": progress, "last_error": job.last_error,
+            "create_time": job.create_time, "finish_time": job.finish_time}
+
+
 # 获取单个测试用例执行结果详情
 @router.get("/case/record/{record_id}", tags=["测试结果"], summary="用例的执行详情", status_code=status.HTTP_200_OK)
-async def get_case_record_detail(record_id: int = None):
+async def get_case_record_detail(record_id: int = None, if_none_match: str = Header(None)):
+    # 执行完成的详情不再变化，ETag一致时返回304，有缓存时直接返回缓存
+    cached = await cached_detail(ApiCaseRunRecord, "api:case", record_id, if_none_match)
+    if cached:
+        return cached
     # 获取测试用例的运行记录
-    record = await ApiCaseRunRecord.get_or_none(id=record_id)
+    record = await ApiCaseRunRecord.get_or_none(id=record_id, hidden=False)
     if not record:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="测试用例执行记录不存在！")
+    # 已归档的记录从归档文件回填大字段
+    await restore_archived([record], ApiCaseRunRecord)
+    await hydrate_env([record])
     # 获取测试用例的运行记录
-    return record
+    return await cache_detail("api:case", record, record)
 
 
 # 获取单个测试用例执行结果详情
 @router.get("/case/firstRecord/{case_id}", tags=["测试结果"], summary="用例的执行详情", status_code=status.HTTP_200_OK)
 async def get_case_record_detail_for_case(case_id: int = None):
     # 获取测试用例的运行记录
-    record = await ApiCaseRunRecord.filter(case_id=case_id).order_by("-id").first()
+    record = await ApiCaseRunRecord.filter(case_id=case_id, hidden=False).order_by("-id").first()
     if not record:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="测试用例执行记录不存在！")
+    # 已归档的记录从归档文件回填大字段
+    await restore_archived([record], ApiCaseRunRecord)
+    await hydrate_env([record])
     # 获取测试用例的运行记录
     return record
 
@@ -408,24 +425,38 @@ async def get_case_record_detail_for_case(case_id: int = None):
 # 获取单个测试套件执行结果详情
 @router.get("/suite/record/{record_id}", tags=["测试结果"], summary="套件的执行详情", status_code=status.HTTP_200_OK,
             response_model=SuiteResultSchemas)
-async def get_suite_record_detail(record_id: int):
+async def get_suite_record_detail(record_id: int, if_none_match: str = Header(None)):
+    # 执行完成的详情不再变化，ETag一致时返回304，有缓存时直接返回缓存
+    cached = await cached_detail(ApiSuiteRunRecord, "api:suite", record_id, if_none_match)
+    if cached:
+        return cached
     # 获取测试套件的运行记录
-    record = await ApiSuiteRunRecord.get_or_none(id=record_id).prefetch_related('suite')
+    record = await ApiSuiteRunRecord.get_or_none(id=record_id, hidden=False).prefetch_related('suite')
     if not record:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="测试套件执行记录不存在！")
+    # 已归档的记录从归档文件回填大字段
+    await restore_archived([record], ApiSuiteRunRecord)
+    await hydrate_env([record])
     result = SuiteResultSchemas(**record.__dict__, suite_name=record.suite.suite_name)
     # 获取测试套件的运行记录
-    return result
+    return await cache_detail("api:suite", record, result)
 
 
 # 获取单个测试计划执行结果详情
 @router.get("/task/record/{record_id}", tags=["测试结果"], summary="任务的执行详情", status_code=status.HTTP_200_OK,
             response_model=TaskResultSchemas)
-async def get_task_record_detail(record_id: int):
+async def get_task_record_detail(record_id: int, if_none_match: str = Header(None)):
+    # 执行完成的详情不再变化，ETag一致时返回304，有缓存时直接返回缓存
+    cached = await cached_detail(ApiTaskRunRecord, "api:task", record_id, if_none_match)
+    if cached:
+        return cached
     # 获取测试套件的运行记录
-    record = await ApiTaskRunRecord.get_or_none(id=record_id).prefetch_related('task')
+    record = await ApiTaskRunRecord.get_or_none(id=record_id, hidden=False).prefetch_related('task')
     if not record:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="测试计划执行记录不存在！")
+    # 已归档的记录从归档文件回填大字段
+    await restore_archived([record], ApiTaskRunRecord)
+    await hydrate_env([record])
     # 获取测试套件的运行记录
     result = TaskResultSchemas(**record.__dict__, task_name=record.task.name)
-    return result
+    return await cache_detail("api:task", record, result)
@@ -12,6 +12,7 @@ from fastapi import APIRouter, HTTPException, Depends, status
 from tortoise.expressions import Q
 from apiTest.apiSuite.models import ApiTestSuite
 from auth.auth import is_authenticated
+from dispatch.plan_cache import api_plan_cache
 from .schemas import (
     # ... existing imports
     ApiTestSuiteSchema, ApiTestSuiteList, AddApiTestSuiteBaseForm, AddApiTestSuiteForm, UpdateApiTestSuiteForm,
@@ -123,6 +124,8 @@ async def update_api_suite(suite_id: int, item: UpdateApiTestSuiteForm = UpdateA
     update_data = item.model_dump(exclude_unset=True)
     await api_suite.update_from_dict(update_data)
     await api_suite.save()
+    # 使已缓存的执行计划失效
+    await api_plan_cache.invalidate()
 
     return await ApiTestSuiteSchema.from_orm_with_relations(api_suite)
 
@@ -142,6 +145,8 @@ async def update_api_suite_status(suite_id: int, item: ApiTestSuiteStatusForm):
 
     await api_suite.update_from_dict(item.model_dump(exclude_unset=True))
     await api_suite.save()
+    # 使已缓存的执行计划失效
+    await api_plan_cache.invalidate()
     await api_suite.fetch_related("project", "create_user", "update_user")
 
     return await ApiTestSuiteSchema.from_orm_with_relations(api_suite)
@@ -157,6 +162,8 @@ async def delete_api_suite(suite_id: int):
             detail="测试套件不存在"
         )
     await api_suite.delete()
+    # 使已缓存的执行计划失效
+    await api_plan_cache.invalidate()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,137 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：bench_run_plan
+@Time ：2025/10/20 10:30
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： run_plan 的查询次数、耗时基准：在内存SQLite中构造 10/100/600 条用例的计划，
+            统计套件展开、创建执行记录、耗时估算各阶段的SQL语句数和耗时，语句数不应随用例数增长，
+            并检查回填的执行记录id与数据库中的记录一致
+    python -m apiTest.src.bench_run_plan [用例数 ...]
+执行计划缓存（Redis）不在统计范围内，这里直接测试缓存未命中时的展开
+"""
+import asyncio
+import logging
+import statistics
+import sys
+import time
+
+from tortoise import Tortoise
+
+# 每个套件的用例数
+CASES_PER_SUITE = 20
+# 默认测试的计划用例数
+CASE_COUNTS = (10, 100, 600)
+# 每个用例数重复执行的次数，耗时取中位数
+ROUNDS = 5
+
+BENCH_ORM = {
+    'connections': {'default': 'sqlite://:memory:'},
+    'apps': {
+        'models': {
+            'models': ['auth.user.models', 'wealth.project.models', 'wealth.environment.models',
+                       'apiTest.apiCase.models', 'apiTest.apiSuite.models', 'apiTest.task.models',
+                       'apiTest.apiRecordExecution.models'],
+            'default_connection': 'default',
+        },
+    },
+}
+
+
+class QueryCounter(logging.Handler):
+    """统计执行的SQL语句数，tortoise每执行一条语句（批量插入为一次）输出一条 tortoise.db_client 日志"""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord):
+        self.count += 1
+
+    def install(self):
+        db_logger = logging.getLogger("tortoise.db_client")
+        db_logger.setLevel(logging.DEBUG)
+        db_logger.propagate = False
+        db_logger.addHandler(self)
+
+
+async def build_plan(case_count: int):
+    """构造包含case_count条用例的计划，每个套件CASES_PER_SUITE条用例"""
+    from auth.user.models import User
+    from wealth.project.models import Project
+    from apiTest.apiCase.models import ApiCase, ApiInfo
+    from apiTest.apiSuite.models import ApiTestSuite
+    from apiTest.task.models import ApiTask
+
+    user = await User.create(username="bench", password="bench", nickname="bench")
+    project = await Project.create(name=f"bench_{case_count}", user=user, username="bench")
+    api = await ApiInfo.create(api_name="bench", api_url="/bench", project=project, create_user=user)
+    await ApiCase.bulk_create([ApiCase(case_name=f"case_{i}", project=project, api=api, create_user=user)
+                               for i in range(case_count)])
+    case_ids = await ApiCase.filter(project=project).order_by('id').values_list('id', flat=True)
+    task = await ApiTask.create(name=f"bench_{case_count}", project=project, username="bench")
+    for start in range(0, case_count, CASES_PER_SUITE):
+        suite = await ApiTestSuite.create(suite_name=f"suite_{start}", project=project, create_user=user,
+                                          cases_order=[{'id': case_id, 'skip': False}
+                                                       for case_id in case_ids[start:start + CASES_PER_SUITE]])
+        await task.suites.add(suite)
+    return task
+
+
+async def bench_round(task, counter: QueryCounter) -> dict:
+    """执行一次展开、创建记录、耗时估算，返回 {阶段: (SQL语句数, 耗时秒)}"""
+    from apiTest.apiRecordExecution.models import ApiTaskRunRecord
+    from apiTest.src.run_plan import create_run_records, estimate_suite_durations, load_suite_cases
+
+    task_record = await ApiTaskRunRecord.create(project_id=task.project_id, task=task, username="bench")
+    suites = await task.suites.all()
+    stages = {}
+
+    async def measure(name: str, coroutine):
+        queries, start = counter.count, time.perf_counter()
+        result = await coroutine
+        stages[name] = (counter.count - queries, time.perf_counter() - start)
+        return result
+
+    suite_cases = await measure("套件展开", load_suite_cases(suites))
+    run_records = await measure("创建执行记录", create_run_records(suite_cases, "bench", None, task_record))
+    await measure("耗时估算", estimate_suite_durations(suite_cases))
+    await check_record_ids(run_records)
+    return stages
+
+
+async def check_record_ids(run_records: list):
+    """回填的执行记录id与数据库中的记录一致（用例、所属套件记录都对应）"""
+    from apiTest.apiRecordExecution.models import ApiCaseRunRecord
+
+    expected = {case['record_id']: (case['id'], suite_record.id)
+                for _, suite_record, cases in run_records for case in cases}
+    actual = {record_id: (case_id, suite_record_id) for record_id, case_id, suite_record_id in
+              await ApiCaseRunRecord.filter(id__in=list(expected)).values_list('id', 'case_id', 'suite_records_id')}
+    if actual != expected:
+        raise AssertionError("回填的用例执行记录id与数据库中的记录不一致")
+
+
+async def run(case_counts=CASE_COUNTS):
+    """执行基准测试并输出结果"""
+    counter = QueryCounter()
+    counter.install()
+    await Tortoise.init(config=BENCH_ORM)
+    try:
+        await Tortoise.generate_schemas()
+        print(f"{'用例数':>6} {'阶段':<10} {'SQL语句数':>8} {'耗时中位数(ms)':>14}")
+        for case_count in case_counts:
+            task = await build_plan(case_count)
+            rounds = [await bench_round(task, counter) for _ in range(ROUNDS)]
+            for stage in rounds[0]:
+                queries = max(result[stage][0] for result in rounds)
+                latency = statistics.median(result[stage][1] for result in rounds) * 1000
+                print(f"{case_count:>6} {stage:<10} {queries:>8} {latency:>14.2f}")
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == '__main__':
+    asyncio.run(run([int(count) for count in sys.argv[1:]] or CASE_COUNTS))
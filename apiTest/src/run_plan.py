@@ -0,0 +1,160 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：run_plan
+@Time ：2025/10/17 9:30
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 套件批量展开为执行记录，整个计划的用例查询、记录写入都是固定次数的数据库往返
+"""
+from typing import Dict, List, Tuple
+
+from tortoise.functions import Avg, Sum
+
+from common.settings import DISPATCH_CONFIG
+from dispatch.plan_cache import api_plan_cache
+from apiTest.apiCase.models import ApiCase
+from apiTest.apiSuite.models import ApiTestSuite
+from apiTest.apiRecordExecution.models import ApiTaskRunRecord, ApiSuiteRunRecord, ApiCaseRunRecord
+from apiTest.task.models import ApiTask
+
+# 单条INSERT语句最多写入的行数，避免超过max_allowed_packet
+BULK_BATCH_SIZE = 500
+# 编译后的执行计划中保存的套件字段，下发时组装套件数据使用
+PLAN_SUITE_FIELDS = ('id', 'suite_name', 'variables', 'config', 'suite_setup_step')
+# 数据库的自增id步长 {方言: 步长}
+_AUTO_INCREMENT_STEP: Dict[str, int] = {}
+
+
+async def load_suite_cases(suites: List[ApiTestSuite]) -> List[Tuple[ApiTestSuite, list]]:
+    """
+    一次性查询所有套件引用的用例，按套件的cases_order组装待执行用例
+    :param suites: 需要执行的套件列表
+    :return: [(套件, [{'id', 'name', 'skip', 'steps'}, ...]), ...]，已删除的用例会被忽略
+    """
+    case_ids = {suite_case.get('id') for suite in suites for suite_case in suite.cases_order or []}
+    case_names = dict(await ApiCase.filter(id__in=case_ids).values_list('id', 'case_name')) if case_ids else {}
+    result = []
+    for suite in suites:
+        cases = []
+        for index, suite_case in enumerate(suite.cases_order or []):
+            case_id = suite_case.get('id')
+            if case_id not in case_names:
+                continue
+            cases.append({
+                'id': case_id,
+                'name': case_names[case_id],
+                "skip": suite_case.get('skip', False),
+                "steps": index
+            })
+        result.append((suite, cases))
+    return result
+
+
+async def compile_task_plan(task: ApiTask) -> List[Tuple[ApiTestSuite, list]]:
+    """
+    展开计划中的套件和用例，缓存命中时不查询数据库
+    :param task: 测试计划
+    :return: 与load_suite_cases相同，套件为只包含PLAN_SUITE_FIELDS的未保存实例
+    """
+    plan = await api_plan_cache.compile_task_plan(
+        task, load_suite_cases, lambda suite_: {field: getattr(suite_, field) for field in PLAN_SUITE_FIELDS})
+    return [(ApiTestSuite(**item['suite']), item['cases']) for item in plan]
+
+
+async def _auto_increment_step(db) -> int:
+    """自增id的步长（auto_increment_increment，双主等部署中可能大于1），每个进程只查询一次"""
+    if db.capabilities.dialect != "mysql":
+        return 1
+    if "mysql" not in _AUTO_INCREMENT_STEP:
+        [row] = await db.execute_query_dict("SELECT @@auto_increment_increment AS step")
+        _AUTO_INCREMENT_STEP["mysql"] = int(row['step'])
+    return _AUTO_INCREMENT_STEP["mysql"]
+
+
+async def insert_records(model, records: list) -> list:
+    """
+    多行INSERT批量写入执行记录，并按写入的返回值回填自增id，不需要再查询写入的记录
+    InnoDB为行数已知的多行INSERT一次分配连续的自增值（interleaved锁模式下也是），返回的LAST_INSERT_ID为第一行的id；
+    SQLite返回的是最后一行的rowid
+    :param model: 执行记录模型
+    :param records: 未保存的模型实例，写入后回填id
+    :return: records
+    """
+    db = model._meta.db
+    columns = [name for name in model._meta.fields_db_projection if not model._meta.fields_map[name].generated]
+    placeholder = "?" if db.capabilities.dialect == "sqlite" else "%s"
+    row = f"({', '.join([placeholder] * len(columns))})"
+    step = await _auto_increment_step(db)
+    for start in range(0, len(records), BULK_BATCH_SIZE):
+        batch = records[start:start + BULK_BATCH_SIZE]
+        sql = f"INSERT INTO `{model._meta.db_table}` " \
+              f"({', '.join(f'`{model._meta.fields_db_projection[name]}`' for name in columns)}) " \
+              f"VALUES {', '.join([row] * len(batch))}"
+        values = [model._meta.fields_map[name].to_db_value(getattr(record, name), record)
+                  for record in batch for name in columns]
+        inserted_id = await db.execute_insert(sql, values)
+        first_id = inserted_id - (len(batch) - 1) * step if db.capabilities.dialect == "sqlite" else inserted_id
+        for index, record in enumerate(batch):
+            record.id = first_id + index * step
+            record._saved_in_db = True
+    return records
+
+
+async def create_run_records(suite_cases: List[Tuple[ApiTestSuite, list]], username: str, env_snapshot_id: int,
+                             task_record: ApiTaskRunRecord = None
+                             ) -> List[Tuple[ApiTestSuite, ApiSuiteRunRecord, list]]:
+    """
+    批量创建套件、用例的执行记录，并把用例记录id回填到待执行用例中，每 BULK_BATCH_SIZE 条记录一次数据库往返
+    :param suite_cases: load_suite_cases的返回值
+    :param username: 执行人
+    :param env_snapshot_id: 执行环境快照id
+    :param task_record: 关联的计划执行记录，单独执行套件时为None
+    :return: [(套件, 套件执行记录, 回填了record_id的用例列表), ...]
+    """
+    if not suite_cases:
+        return []
+    # 创建套件的运行记录，用例总数在创建时直接写入
+    suite_records = await insert_records(ApiSuiteRunRecord, [
+        ApiSuiteRunRecord(suite_id=suite_.id, username=username, env_snapshot_id=env_snapshot_id, all=len(cases),
+                          task_records_id=task_record.id if task_record else None)
+        for suite_, cases in suite_cases
+    ])
+    # 批量创建用例的运行记录
+    case_records = await insert_records(ApiCaseRunRecord, [
+        ApiCaseRunRecord(case_id=case['id'], username=username, suite_records_id=suite_record.id,
+                         env_snapshot_id=env_snapshot_id)
+        for (_, cases), suite_record in zip(suite_cases, suite_records)
+        for case in cases
+    ])
+    result, offset = [], 0
+    for (suite_, cases), suite_record in zip(suite_cases, suite_records):
+        cases = [{"record_id": case_record.id, **case}
+                 for case, case_record in zip(cases, case_records[offset:offset + len(cases)])]
+        offset += len(cases)
+        result.append((suite_, suite_record, cases))
+    return result
+
+
+async def estimate_suite_durations(suite_cases: List[Tuple[ApiTestSuite, list]]) -> Dict[int, float]:
+    """
+    根据历史执行记录估算每个套件的耗时，用于多设备调度
+    有历史记录的套件取执行完成记录的平均耗时，没有历史的套件按用例数 × 单条用例平均耗时估算
+    :param suite_cases: load_suite_cases的返回值
+    :return: {套件id: 预计耗时（秒）}
+    """
+    suite_ids = [suite_.id for suite_, _ in suite_cases]
+    history = await ApiSuiteRunRecord.filter(suite_id__in=suite_ids, status="执行完成", duration__gt=0) \
+        .annotate(avg_duration=Avg('duration'), total_duration=Sum('duration'), total_cases=Sum('run_all')) \
+        .group_by('suite_id').values('suite_id', 'avg_duration', 'total_duration', 'total_cases')
+    avg_durations = {row['suite_id']: float(row['avg_duration']) for row in history}
+    # 单条用例的平均耗时，没有任何历史时使用默认配置
+    total_duration = sum(float(row['total_duration'] or 0) for row in history)
+    total_cases = sum(int(row['total_cases'] or 0) for row in history)
+    case_duration = total_duration / total_cases if total_cases else DISPATCH_CONFIG.get('default_case_duration', 2)
+    return {suite_.id: avg_durations.get(suite_.id, len(cases) * case_duration) for suite_, cases in suite_cases}
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,10 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：__init__.py
+@Time ：2025/10/18 16:00
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 执行记录生命周期（历史执行记录归档到压缩文件、后台删除）
+"""
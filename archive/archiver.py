@@ -0,0 +1,247 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：archiver
+@Time ：2025/10/18 16:00
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 执行记录归档：执行完成且超过保留时间/保留次数的执行记录，连同下级的套件、用例记录一起写入压缩文件，
+            数据库中只保留统计字段，执行详情、日志等大字段清空，详情接口从归档文件中读取
+
+归档文件（{dir} = ARCHIVE_CONFIG['dir']）：
+    {dir}/{任务类型}/{项目id}/{年-月}.jsonl.gz
+    每次归档一个计划（或单独执行的套件/用例）的所有记录，追加为一个独立的gzip分段，每行一条记录的JSON；
+    执行记录的archive字段保存 文件相对路径:分段起始位置，读取时只解压这一个分段
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import zlib
+from datetime import timedelta
+from functools import lru_cache
+from typing import Dict, Iterable, List
+
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+
+from common.fields import CompressedJSONField
+from common.leader import RedisLock
+from common.redis_client import redis_cli
+from common.settings import ARCHIVE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# 归档锁的有效期（秒），每归档一个单位延长一次
+LOCK_SECONDS = 300
+
+
+def archived_fields(model) -> List[str]:
+    """归档后清空的大字段"""
+    return [name for name, field in model._meta.fields_map.items() if isinstance(field, CompressedJSONField)]
+
+
+def _empty(model, name: str):
+    """大字段清空后的值（字段默认值）"""
+    default = model._meta.fields_map[name].default
+    return default() if callable(default) else default
+
+
+def _append(relative_path: str, rows: List[dict]) -> int:
+    """把一组记录追加为归档文件的一个gzip分段，返回分段的起始位置"""
+    path = os.path.join(ARCHIVE_CONFIG['dir'], relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    content = ''.join(json.dumps(row, ensure_ascii=False, default=str) + '\n' for row in rows)
+    with open(path, 'ab') as f:
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        f.write(gzip.compress(content.encode('utf-8')))
+        f.flush()
+        os.fsync(f.fileno())
+    return offset
+
+
+@lru_cache(maxsize=32)
+def _read(location: str) -> Dict[str, dict]:
+    """读取归档分段，返回 {模型名:记录id: 记录}；同一分段的套件、用例详情通常连续查看，缓存最近读取的分段"""
+    relative_path, offset = location.rsplit(':', 1)
+    decompressor = zlib.decompressobj(wbits=31)
+    chunks = []
+    with open(os.path.join(ARCHIVE_CONFIG['dir'], relative_path), 'rb') as f:
+        f.seek(int(offset))
+        while not decompressor.eof:
+            data = f.read(64 * 1024)
+            if not data:
+                break
+            chunks.append(decompressor.decompress(data))
+    rows = {}
+    for line in b''.join(chunks).decode('utf-8').splitlines():
+        row = json.loads(line)
+        rows[f"{row.pop('model')}:{row['id']}"] = row
+    return rows
+
+
+async def restore_archived(records: Iterable, model):
+    """
+    已归档的执行记录从归档文件回填大字段，未归档的记录不变
+    :param records: 执行记录或values()查询出的字典列表（字典只回填查询了的字段）
+    :param model: 执行记录模型
+    """
+    fields = archived_fields(model)
+    for record in records:
+        if isinstance(record, dict):
+            # 归档位置只用于回填，不返回给前端
+            location = record.pop('archive', None)
+        else:
+            location = getattr(record, 'archive', None)
+        if not location:
+            continue
+        try:
+            rows = await asyncio.to_thread(_read, location)
+        except (OSError, ValueError, zlib.error) as e:
+            logger.error(f"读取归档文件失败 {location}: {str(e)}")
+            continue
+        row = rows.get(f"{model.__name__}:{record['id'] if isinstance(record, dict) else record.id}")
+        if row is None:
+            continue
+        for name in fields:
+            if isinstance(record, dict):
+                if name in record:
+                    record[name] = row.get(name)
+            else:
+                setattr(record, name, row.get(name))
+    return records
+
+
+class RecordArchiver:
+    """
+    执行记录归档，以计划记录、单独执行的套件记录、单独执行的用例记录为单位，下级记录随上级一起归档
+    多个worker进程通过Redis锁保证同一时间只有一个进程在归档
+    """
+
+    def __init__(self, task_type: str, task_model, suite_model, case_model):
+        """
+        :param task_type: 任务类型 ui_test/api_test
+        :param task_model: 计划执行记录模型
+        :param suite_model: 套件执行记录模型
+        :param case_model: 用例执行记录模型
+        """
+        self.task_type = task_type
+        self.task_model = task_model
+        self.suite_model = suite_model
+        self.case_model = case_model
+        # 各级归档单位：(模型, 按次数保留的分组字段, 项目id字段, 查询条件)，已删除（隐藏）的记录不归档
+        self.levels = (
+            (task_model, 'task_id', 'project_id', {'status': '执行完成', 'hidden': False}),
+            (suite_model, 'suite_id', 'suite__project_id', {'status': '执行完成', 'task_records_id__isnull': True,
+                                                            'hidden': False}),
+            (case_model, 'case_id', 'case__project_id', {'suite_records_id__isnull': True,
+                                                         'status__not': 'running', 'hidden': False}),
+        )
+
+    async def _over_kept(self, model, owner: str, filters: dict, limit: int, exclude: List[int]) -> List[int]:
+        """
+        超过保留次数、还未归档的记录id
+        不再每轮对整张表分组统计：按id顺序每轮只扫描上次位置之后的scan_window条记录，只检查其中出现的计划/套件/用例，
+        执行次数只会因为新增执行而超过保留次数（扫描时未执行完成的记录，在下一次执行时检查）；
+        扫描位置记录在Redis中，本轮达到归档数量上限时下一轮重新扫描同一范围
+        """
+        keep = ARCHIVE_CONFIG['keep_runs']
+        progress_key = f"archive:{self.task_type}:{model._meta.db_table}:scanned"
+        scanned = int(await redis_cli.get(progress_key) or 0)
+        window = ARCHIVE_CONFIG.get('scan_window', 10000)
+        rows = await model.filter(id__gt=scanned, **filters).order_by('id').limit(window).values_list('id', owner)
+        if not rows:
+            return []
+        ids = []
+        for owner_id in dict.fromkeys(owner_id for _, owner_id in rows if owner_id is not None):
+            # 保留最近keep次，第keep+1次及更早的记录归档
+            boundary = await model.filter(**{owner: owner_id}, **filters).order_by('-id').offset(keep) \
+                .limit(1).values_list('id', flat=True)
+            if not boundary:
+                continue
+            ids += await model.filter(archive__isnull=True, **{owner: owner_id}, **filters, id__lte=boundary[0],
+                                      id__not_in=exclude + ids or [0]) \
+                .order_by('id').limit(limit - len(ids)).values_list('id', flat=True)
+            if len(ids) >= limit:
+                return ids
+        await redis_cli.set(progress_key, rows[-1][0])
+        return ids
+
+    async def _candidates(self, model, owner: str, filters: dict, limit: int) -> List[int]:
+        """超过保留时间或保留次数、还未归档的记录id"""
+        ids = []
+        if ARCHIVE_CONFIG.get('max_age_days'):
+            cutoff = timezone.now() - timedelta(days=ARCHIVE_CONFIG['max_age_days'])
+            ids = await model.filter(archive__isnull=True, start_time__lt=cutoff, **filters).order_by('id') \
+                .limit(limit).values_list('id', flat=True)
+        if ARCHIVE_CONFIG.get('keep_runs') and len(ids) < limit:
+            ids += await self._over_kept(model, owner, filters, limit - len(ids), ids)
+        return ids
+
+    async def _collect(self, model, root_id: int) -> Dict[type, List[dict]]:
+        """归档单位及其下级的所有记录"""
+        rows = {model: await model.filter(id=root_id).values()}
+        suite_ids = [root_id]
+        if model is self.task_model:
+            rows[self.suite_model] = await self.suite_model.filter(task_records_id=root_id).values()
+            suite_ids = [row['id'] for row in rows[self.suite_model]]
+        if model is not self.case_model:
+            rows[self.case_model] = await self.case_model.filter(suite_records_id__in=suite_ids or [0]).values()
+        return rows
+
+    async def _archive(self, model, project: str, root_id: int):
+        """归档一个计划（或单独执行的套件/用例）的所有记录"""
+        rows = await self._collect(model, root_id)
+        if not rows[model]:
+            return
+        root = rows[model][0]
+        project_id = await model.filter(id=root_id).values_list(project, flat=True)
+        relative_path = f"{self.task_type}/{project_id[0]}/{root['start_time']:%Y-%m}.jsonl.gz"
+        lines = [{'model': record_model.__name__, **row} for record_model, items in rows.items() for row in items]
+        # 先写文件再清空数据库中的大字段，数据库更新失败时归档文件中只会多出一个无引用的分段
+        offset = await asyncio.to_thread(_append, relative_path, lines)
+        location = f"{relative_path}:{offset}"
+        async with in_transaction():
+            for record_model, items in rows.items():
+                if not items:
+                    continue
+                cleared = {name: _empty(record_model, name) for name in archived_fields(record_model)}
+                await record_model.filter(id__in=[row['id'] for row in items], archive__isnull=True) \
+                    .update(archive=location, **cleared)
+
+    async def archive_once(self) -> int:
+        """执行一轮归档，返回归档的单位数"""
+        lock = RedisLock(f"archive:{self.task_type}:lock", LOCK_SECONDS)
+        if not await lock.acquire():
+            return 0
+        archived = 0
+        try:
+            for model, owner, project, filters in self.levels:
+                for root_id in await self._candidates(model, owner, filters, ARCHIVE_CONFIG.get('batch_size', 100)):
+                    # 锁已过期并被其他进程获取时停止，避免两个进程同时归档
+                    if not await lock.extend():
+                        logger.warning(f"{self.task_type} 执行记录归档锁已失效，停止本轮归档")
+                        return archived
+                    await self._archive(model, project, root_id)
+                    archived += 1
+        finally:
+            await lock.release()
+        if archived:
+            logger.info(f"{self.task_type} 执行记录归档 {archived} 条")
+        return archived
+
+    async def run(self):
+        """后台归档任务，在main.py的lifespan中启动"""
+        while True:
+            try:
+                # 一轮归档满批时说明还有积压，立即继续
+                if await self.archive_once() >= ARCHIVE_CONFIG.get('batch_size', 100):
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{self.task_type} 执行记录归档异常: {str(e)}", exc_info=True)
+            await asyncio.sleep(ARCHIVE_CONFIG.get('interval', 600))
@@ -0,0 +1,194 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：deletion
+@Time ：2025/10/18 21:30
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 执行记录后台删除：删除接口只隐藏记录并创建删除任务，后台任务按批删除下级的用例、套件记录，
+            避免一次请求级联删除上千条用例记录导致超时、长时间锁表
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import List
+
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+
+from common.leader import RedisLock
+from common.settings import CLEANUP_CONFIG
+from .models import DeletionJob
+
+logger = logging.getLogger(__name__)
+
+# 删除锁的有效期（秒），每删除一批延长一次
+LOCK_SECONDS = 300
+
+
+class RecordDeleter:
+    """
+    执行记录后台删除
+    多个worker进程通过Redis锁保证同一时间只有一个进程在删除，每批删除后记录进度，中断后从剩余的记录继续
+    """
+
+    def __init__(self, task_type: str, task_model, suite_model, case_model):
+        """
+        :param task_type: 任务类型 ui_test/api_test
+        :param task_model: 计划执行记录模型
+        :param suite_model: 套件执行记录模型
+        :param case_model: 用例执行记录模型
+        """
+        self.task_type = task_type
+        self.task_model = task_model
+        self.suite_model = suite_model
+        self.case_model = case_model
+        self._models = {"task": task_model, "suite": suite_model, "case": case_model}
+
+    async def delete_record(self, kind: str, record_id: int, username: str = None) -> DeletionJob:
+        """
+        隐藏计划/套件执行记录并创建删除任务，记录立即从列表、详情接口中消失
+        :param kind: 执行记录类型 task/suite
+        :param record_id: 执行记录id
+        """
+        async with in_transaction():
+            await self._hide(kind, [record_id])
+            job = await DeletionJob.create(task_type=self.task_type, scope=kind, target_id=record_id,
+                                           username=username)
+        return job
+
+    async def delete_before(self, project_id: int, before: datetime, username: str = None) -> DeletionJob:
+        """创建删除项目中早于指定时间的所有执行记录的任务，记录在后台删除时逐批隐藏"""
+        return await DeletionJob.create(task_type=self.task_type, scope="project", target_id=project_id,
+                                        before=before, username=username)
+
+    async def _hide(self, kind: str, ids: List[int]):
+        """隐藏执行记录及其下级记录：计划记录隐藏其下的套件、用例记录，套件记录隐藏其下的用例记录"""
+        await self._models[kind].filter(id__in=ids).update(hidden=True)
+        suite_ids = ids if kind == "suite" else []
+        if kind == "task":
+            await self.suite_model.filter(task_records_id__in=ids).update(hidden=True)
+            suite_ids = await self.suite_model.filter(task_records_id__in=ids).values_list('id', flat=True)
+        if suite_ids:
+            await self.case_model.filter(suite_records_id__in=suite_ids).update(hidden=True)
+
+    def _project_roots(self, job: DeletionJob):
+        """按项目删除时的各级删除单位：计划记录、单独执行的套件记录、单独执行的用例记录"""
+        return (
+            ("task", self.task_model.filter(project_id=job.target_id, start_time__lt=job.before)),
+            ("suite", self.suite_model.filter(suite__project_id=job.target_id, task_records_id__isnull=True,
+                                              start_time__lt=job.before)),
+            ("case", self.case_model.filter(case__project_id=job.target_id, suite_records_id__isnull=True,
+                                            start_time__lt=job.before)),
+        )
+
+    async def _estimate(self, job: DeletionJob) -> int:
+        """预计删除的记录数，用于计算进度"""
+        if job.scope == "project":
+            total = 0
+            for kind, query in self._project_roots(job):
+                total += await query.count()
+            total += await self.suite_model.filter(task_records__project_id=job.target_id,
+                                                   task_records__start_time__lt=job.before).count()
+            total += await self.case_model.filter(suite_records__suite__project_id=job.target_id,
+                                                  suite_records__start_time__lt=job.before).count()
+            return total
+        suite_ids = [job.target_id] if job.scope == "suite" else \
+            await self.suite_model.filter(task_records_id=job.target_id).values_list('id', flat=True)
+        cases = await self.case_model.filter(suite_records_id__in=suite_ids).count() if suite_ids else 0
+        return 1 + (len(suite_ids) if job.scope == "task" else 0) + cases
+
+    async def _delete_batch(self, kind: str, ids: List[int]) -> int:
+        """
+        删除一批计划/套件/用例记录的下级记录，每次最多删除batch_size条；下级记录删完后删除记录本身
+        :return: 本批删除的记录数
+        """
+        batch_size = CLEANUP_CONFIG.get('batch_size', 500)
+        suite_ids = ids if kind == "suite" else []
+        if kind == "task":
+            suite_ids = await self.suite_model.filter(task_records_id__in=ids).values_list('id', flat=True)
+        if suite_ids:
+            case_ids = await self.case_model.filter(suite_records_id__in=suite_ids).limit(batch_size) \
+                .values_list('id', flat=True)
+            if case_ids:
+                return await self.case_model.filter(id__in=case_ids).delete()
+        if kind == "task" and suite_ids:
+            return await self.suite_model.filter(id__in=suite_ids[:batch_size]).delete()
+        return await self._models[kind].filter(id__in=ids).delete()
+
+    async def _step(self, job: DeletionJob) -> int:
+        """执行一批删除，返回删除的记录数，0表示任务已完成"""
+        if job.scope != "project":
+            exists = await self._models[job.scope].filter(id=job.target_id).exists()
+            return await self._delete_batch(job.scope, [job.target_id]) if exists else 0
+        for kind, query in self._project_roots(job):
+            # 每次取少量删除单位，先隐藏再逐批删除，删除完成的单位不会再被查询到
+            ids = await query.order_by('id').limit(CLEANUP_CONFIG.get('roots_per_batch', 20)) \
+                .values_list('id', flat=True)
+            if ids:
+                await self._hide(kind, ids)
+                return await self._delete_batch(kind, ids)
+        return 0
+
+    def _lock_key(self) -> str:
+        return f"record_delete:{self.task_type}:lock"
+
+    async def _run_job(self, job: DeletionJob, lock: RedisLock) -> bool:
+        """执行一个删除任务直到完成，删除锁失效时停止并返回False，由持有锁的进程继续"""
+        if job.status == "pending":
+            job.status = "running"
+            job.total = await self._estimate(job)
+            await job.save(update_fields=['status', 'total'])
+        while True:
+            deleted = await self._step(job)
+            if not deleted:
+                break
+            job.deleted += deleted
+            await DeletionJob.filter(id=job.id).update(deleted=job.deleted)
+            # 删除耗时较长时延长锁的有效期，锁已过期并被其他进程获取时停止，避免两个进程同时删除
+            if not await lock.extend():
+                logger.warning(f"{self.task_type} 执行记录删除锁已失效，删除任务 {job.id} 暂停")
+                return False
+            await asyncio.sleep(CLEANUP_CONFIG.get('batch_pause', 0.1))
+        job.status = "done"
+        job.finish_time = timezone.now()
+        await job.save(update_fields=['status', 'finish_time'])
+        logger.info(f"{self.task_type} 执行记录删除任务 {job.id} 完成，共删除 {job.deleted} 条")
+        return True
+
+    async def run_once(self) -> bool:
+        """执行一个未完成的删除任务，任务完成返回True；没有任务、其他进程正在删除或删除失败时返回False"""
+        lock = RedisLock(self._lock_key(), LOCK_SECONDS)
+        if not await lock.acquire():
+            return False
+        try:
+            job = await DeletionJob.filter(task_type=self.task_type, status__in=["pending", "running"]) \
+                .order_by('id').first()
+            if not job:
+                return False
+            try:
+                return await self._run_job(job, lock)
+            except Exception as e:
+                # 已删除的记录不会回滚，下次从剩余的记录继续删除
+                job.attempts += 1
+                job.last_error = str(e)[:255]
+                if job.attempts >= CLEANUP_CONFIG.get('max_attempts', 5):
+                    job.status = "failed"
+                await job.save(update_fields=['attempts', 'last_error', 'status'])
+                logger.error(f"{self.task_type} 执行记录删除任务 {job.id} 失败: {str(e)}", exc_info=True)
+                return False
+        finally:
+            await lock.release()
+
+    async def run(self):
+        """后台删除任务，在main.py的lifespan中启动"""
+        while True:
+            try:
+                if await self.run_once():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{self.task_type} 执行记录删除异常: {str(e)}", exc_info=True)
+            await asyncio.sleep(CLEANUP_CONFIG.get('interval', 5))
@@ -0,0 +1,29 @@
+from tortoise import fields, models
+
+
+class DeletionJob(models.Model):
+    """执行记录的后台删除任务，记录先隐藏，下级记录由后台任务分批删除"""
+    id = fields.IntField(pk=True, description="任务id")
+    task_type = fields.CharField(max_length=20, description="任务类型",
+                                 choices=[("ui_test", "UI测试"), ("api_test", "API测试")])
+    scope = fields.CharField(max_length=20, description="删除范围",
+                             choices=[("task", "计划执行记录"), ("suite", "套件执行记录"),
+                                      ("project", "项目中早于指定时间的执行记录")])
+    target_id = fields.IntField(description="执行记录id或项目id")
+    before = fields.DatetimeField(description="删除早于该时间的执行记录（按项目删除时）", null=True)
+    status = fields.CharField(max_length=20, description="任务状态",
+                              choices=[("pending", "等待执行"), ("running", "删除中"), ("done", "已完成"),
+                                       ("failed", "失败")],
+                              default="pending")
+    total = fields.IntField(description="预计删除的记录数", null=True)
+    deleted = fields.IntField(description="已删除的记录数", default=0)
+    attempts = fields.IntField(description="失败次数", default=0)
+    last_error = fields.CharField(max_length=255, description="最后一次失败原因", null=True)
+    username = fields.CharField(max_length=50, description="创建人", null=True)
+    create_time = fields.DatetimeField(auto_now_add=True, description="创建时间")
+    finish_time = fields.DatetimeField(description="完成时间", null=True)
+
+    class Meta:
+        table = "deletion_job"
+        table_description = "执行记录删除任务"
+        indexes = (("task_type", "status"),)
@@ -0,0 +1,153 @@
+"""
+执行记录大字段压缩迁移脚本
+字段类型变更（env、run_info、suite_log、task_log 改为二进制列）在迁移 migrations/models/2_*_compressed_json.py 中，
+必须先执行（JSON列不能写入压缩数据）：
+    aerich upgrade
+改类型后历史数据仍是JSON文本，读取时可以直接兼容；再执行本脚本在后台把历史数据重新压缩写回：
+    python -m common.compress_migration migrate
+迁移前后分别查看表空间占用、历史数据的大字段大小和读取耗时：
+    python -m common.compress_migration stats
+InnoDB重写行后不会归还已分配的表空间，迁移完成后在低峰期执行 OPTIMIZE TABLE，数据大小（data_length）才会下降
+脚本按id分批处理，每批之间暂停，避免影响线上写入；处理进度记录在Redis中，中断后重新执行会从上次的位置继续
+"""
+import asyncio
+import logging
+import statistics
+import time
+
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from common.fields import CompressedJSONField, is_compressed, loads
+from common.redis_client import redis_cli
+from common.settings import TORTOISE_ORM, COMPRESSION_CONFIG
+
+# 每批之间暂停的秒数
+BATCH_PAUSE = 0.2
+# 读取耗时统计的采样记录数
+SAMPLE_SIZE = 200
+# 读取耗时统计重复的次数，取中位数
+READ_ROUNDS = 5
+
+logger = logging.getLogger(__name__)
+
+
+def record_models():
+    from uiTest.runner.models import TaskRunRecord, SuiteRunRecord, CaseRunRecord
+    from apiTest.apiRecordExecution.models import ApiTaskRunRecord, ApiSuiteRunRecord, ApiCaseRunRecord
+
+    return (TaskRunRecord, SuiteRunRecord, CaseRunRecord, ApiTaskRunRecord, ApiSuiteRunRecord, ApiCaseRunRecord)
+
+
+def compressed_columns(model) -> dict:
+    """模型中压缩存储的字段 {字段名: 列名}"""
+    return {name: field.source_field or name for name, field in model._meta.fields_map.items()
+            if isinstance(field, CompressedJSONField)}
+
+
+def needs_compress(raw) -> bool:
+    """未压缩且超过压缩阈值的原始值才需要重新写回"""
+    if raw is None or is_compressed(raw):
+        return False
+    size = len(raw) if isinstance(raw, (bytes, bytearray)) else len(raw.encode('utf-8'))
+    return size >= COMPRESSION_CONFIG.get('min_size', 512)
+
+
+async def recompress_model(model):
+    """按id分批把一张执行记录表中未压缩的历史数据重新压缩写回"""
+    columns = compressed_columns(model)
+    table, db = model._meta.db_table, model._meta.db
+    progress_key = f"compress_migration:{table}"
+    batch_size = COMPRESSION_CONFIG.get('batch_size', 500)
+    placeholder = "?" if db.capabilities.dialect == "sqlite" else "%s"
+    last_id = int(await redis_cli.get(progress_key) or 0)
+    migrated = 0
+    while True:
+        # 直接查询原始值，才能区分数据是否已经压缩
+        rows = await db.execute_query_dict(
+            f"SELECT id, {', '.join(columns.values())} FROM {table} "
+            f"WHERE id > {placeholder} ORDER BY id LIMIT {placeholder}",
+            [last_id, batch_size])
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        async with in_transaction():
+            for row in rows:
+                updates = {name: loads(row[column])
+                           for name, column in columns.items()
+                           if needs_compress(row[column])}
+                if updates:
+                    # 写回时由字段按压缩阈值重新编码
+                    await model.filter(id=row['id']).update(**updates)
+                    migrated += 1
+        await redis_cli.set(progress_key, last_id)
+        await asyncio.sleep(BATCH_PAUSE)
+    logger.info(f"{model.__name__} 压缩完成，共 {migrated} 条记录")
+
+
+async def model_stats(model) -> dict:
+    """
+    表空间占用、大字段存储大小和读取耗时
+    迁移改写的是历史数据，统计最早的SAMPLE_SIZE条记录：大字段的存储字节数、未压缩的记录数，
+    以及按接口的方式读取并解析这些大字段的耗时（执行READ_ROUNDS次取中位数）
+    """
+    db = model._meta.db
+    table = model._meta.db_table
+    columns = compressed_columns(model)
+    stats = {'model': model.__name__}
+    if db.capabilities.dialect == "mysql":
+        rows = await db.execute_query_dict(
+            "SELECT table_rows, data_length, index_length FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = %s", [table])
+        stats.update(rows[0] if rows else {})
+    _, rows = await db.execute_query(
+        f"SELECT id, {', '.join(columns.values())} FROM {table} ORDER BY id LIMIT {SAMPLE_SIZE}")
+    stats['sample'] = len(rows)
+    stats['payload_bytes'] = sum(len(row[column]) for row in rows for column in columns.values()
+                                 if row[column] is not None)
+    stats['uncompressed'] = sum(1 for row in rows if any(needs_compress(row[column]) for column in columns.values()))
+    elapsed = []
+    for _ in range(READ_ROUNDS):
+        start = time.perf_counter()
+        await model.all().order_by('id').limit(SAMPLE_SIZE).values('id', *columns)
+        elapsed.append((time.perf_counter() - start) * 1000)
+    stats['read_ms'] = statistics.median(elapsed)
+    logger.info(f"{model.__name__}: 记录数≈{stats.get('table_rows')} "
+                f"数据大小={(stats.get('data_length') or 0) / 1024 / 1024:.2f}MB "
+                f"索引大小={(stats.get('index_length') or 0) / 1024 / 1024:.2f}MB "
+                f"最早{stats['sample']}条：大字段大小={stats['payload_bytes'] / 1024:.1f}KB "
+                f"未压缩{stats['uncompressed']}条 读取耗时中位数={stats['read_ms']:.1f}ms")
+    return stats
+
+
+async def run(command: str):
+    """执行压缩迁移或统计"""
+
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        # 初始化数据库连接
+        await Tortoise.init(config=TORTOISE_ORM)
+
+        for model in record_models():
+            if command == "migrate":
+                await recompress_model(model)
+            else:
+                await model_stats(model)
+        if command == "migrate":
+            logger.info("执行记录大字段压缩迁移完成！")
+
+    except Exception as e:
+        logger.error(f"执行失败: {str(e)}")
+        raise
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] not in ("migrate", "stats"):
+        print("用法: python -m common.compress_migration [migrate|stats]")
+    else:
+        asyncio.run(run(sys.argv[1] if len(sys.argv) > 1 else "migrate"))
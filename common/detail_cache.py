@@ -0,0 +1,95 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：detail_cache
+@Time ：2025/10/18 22:30
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 执行完成的记录详情的条件请求和缓存：执行完成后详情不再变化，返回ETag，请求头If-None-Match一致时
+            只查询状态、统计字段直接返回304；详情序列化后在Redis中缓存，刷新页面时不再查询、解压大字段
+"""
+import hashlib
+import json
+from typing import Optional
+
+from fastapi import Response, status
+from fastapi.encoders import jsonable_encoder
+
+from common.redis_client import redis_cli
+from common.settings import DETAIL_CACHE_CONFIG
+
+# 未执行完成的状态，计划/套件记录为 等待执行/执行中，用例记录为 running
+RUNNING_STATUSES = ("running", "执行中", "等待执行")
+# 详情的返回格式变化时修改版本号，使客户端和Redis中的旧详情失效
+DETAIL_VERSION = 1
+# 执行完成时写入的字段，ETag由这些字段的值生成：计划/套件记录为状态、执行时间和各状态的用例数，
+# 用例记录的执行详情和状态在上报结果时一起写入且只写一次，状态即可标识执行结果
+COMPLETION_FIELDS = ("status", "duration", "all", "run_all", "success", "fail", "error", "skip", "pass_rate")
+
+
+def completion_fields(model) -> tuple:
+    """模型中参与生成ETag的执行完成字段"""
+    return tuple(name for name in COMPLETION_FIELDS if name in model._meta.fields_map)
+
+
+def record_etag(key: str, record_id: int, completion: dict) -> str:
+    """强ETag：由详情类型、记录id、执行完成字段的值和格式版本生成，执行结果变化时ETag随之变化"""
+    marker = json.dumps(completion, sort_keys=True, default=str)
+    digest = hashlib.sha1(f"{key}:{record_id}:{marker}:{DETAIL_VERSION}".encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否包含当前ETag，按弱比较处理（忽略 W/ 前缀）"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+
+def _headers(etag: str) -> dict:
+    # 详情需要登录才能访问，只允许浏览器缓存，每次使用前向服务端确认
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def _cache_key(key: str, record_id: int, etag: str) -> str:
+    # 缓存键带上ETag，执行结果变化后不会返回旧的缓存
+    return f"detail:{key}:{record_id}:" + etag.strip('"')
+
+
+async def cached_detail(model, key: str, record_id: int, if_none_match: str = None) -> Optional[Response]:
+    """
+    执行完成的记录详情：ETag一致时返回304，Redis中有缓存时直接返回缓存的详情
+    :param model: 执行记录模型
+    :param key: 详情类型，如 ui:suite
+    :return: 记录不存在、未执行完成或没有缓存时返回None，由接口查询详情
+    """
+    rows = await model.filter(id=record_id, hidden=False).limit(1).values(*completion_fields(model))
+    if not rows or rows[0]['status'] in RUNNING_STATUSES:
+        return None
+    etag = record_etag(key, record_id, rows[0])
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_headers(etag))
+    content = await redis_cli.get(_cache_key(key, record_id, etag))
+    if content is None:
+        return None
+    return Response(content=content, media_type="application/json", headers=_headers(etag))
+
+
+async def cache_detail(key: str, record, payload):
+    """
+    执行完成的记录详情序列化后写入Redis缓存，并带上ETag返回；未执行完成的详情原样返回
+    :param key: 详情类型，如 ui:suite
+    :param record: 执行记录
+    :param payload: 接口返回的详情
+    """
+    if record.status in RUNNING_STATUSES:
+        return payload
+    etag = record_etag(key, record.id, {name: getattr(record, name) for name in completion_fields(type(record))})
+    # 与FastAPI默认的JSONResponse序列化方式一致
+    content = json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, indent=None,
+                         separators=(",", ":")).encode("utf-8")
+    if len(content) <= DETAIL_CACHE_CONFIG.get('max_size', 1024 * 1024):
+        await redis_cli.set(_cache_key(key, record.id, etag), content, ex=DETAIL_CACHE_CONFIG.get('ttl', 3600))
+    return Response(content=content, media_type="application/json", headers=_headers(etag))
@@ -0,0 +1,75 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：fields
+@Time ：2025/10/18 14:20
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 压缩存储的JSON字段：执行详情、执行日志等大字段序列化后用zlib压缩，以二进制存储，读取时自动解压；
+            没有压缩头的数据按原JSON解析，兼容改字段类型前写入的历史数据
+"""
+import json
+import zlib
+from typing import Any, Optional, Type, Union
+
+from tortoise import fields
+from tortoise.models import Model
+
+from common.settings import COMPRESSION_CONFIG
+
+# 压缩数据的魔数头，JSON文本不可能以\x00开头，可以和未压缩的数据区分
+MAGIC = b'\x00ZJ1'
+
+
+def dumps(value: Any) -> bytes:
+    """序列化为JSON，超过压缩阈值时压缩并加上魔数头"""
+    raw = json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    if len(raw) < COMPRESSION_CONFIG.get('min_size', 512):
+        return raw
+    return MAGIC + zlib.compress(raw, COMPRESSION_CONFIG.get('level', 6))
+
+
+def loads(value: Union[bytes, str]) -> Any:
+    """解析数据库中的值：有魔数头的先解压，没有的按JSON文本解析"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value)
+        if value.startswith(MAGIC):
+            value = zlib.decompress(value[len(MAGIC):])
+        value = value.decode('utf-8')
+    return json.loads(value) if value else None
+
+
+def is_compressed(value) -> bool:
+    """数据库中的原始值是否已经是压缩格式"""
+    return isinstance(value, (bytes, bytearray)) and bytes(value).startswith(MAGIC)
+
+
+class CompressedJSONField(fields.Field):
+    """
+    压缩存储的JSON字段，用法和JSONField相同
+    数据库中为二进制列，不能作为过滤条件使用
+    """
+    field_type = (dict, list)
+    indexable = False
+    SQL_TYPE = "BLOB"
+
+    class _db_mysql:
+        SQL_TYPE = "LONGBLOB"
+
+    class _db_postgres:
+        SQL_TYPE = "BYTEA"
+
+    def to_db_value(self, value: Any, instance: "Union[Type[Model], Model]") -> Optional[bytes]:
+        self.validate(value)
+        if value is None:
+            return None
+        if isinstance(value, str):
+            # 已经序列化的JSON字符串
+            value = json.loads(value)
+        return dumps(value)
+
+    def to_python_value(self, value: Any) -> Any:
+        if value is None or isinstance(value, (dict, list)):
+            return value
+        return loads(value)
@@ -0,0 +1,142 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：leader
+@Time ：2025/10/18 23:30
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 后台服务的leader选举：gunicorn的多个worker进程通过Redis租约选出一个leader，只有leader运行定时任务调度器和设备心跳检测，
+            leader退出或失联后租约过期，由其他进程自动接管；
+            RedisLock 为归档、删除等后台任务使用的同一种租约锁
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Callable, Coroutine, List
+
+from common.redis_client import redis_cli
+from common.settings import BACKGROUND_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# 租约仍属于当前进程时才续约/释放，避免过期后误删其他进程的租约
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLock:
+    """
+    带持有者标识的Redis锁：只有持有锁的进程才能续期、释放，锁过期后被其他进程获取时不会被误续期、误删除
+    长时间运行的任务每处理一批调用一次 extend，返回False说明锁已丢失，应停止处理
+    """
+
+    def __init__(self, key: str, ttl: int):
+        """
+        :param key: 锁的Redis键
+        :param ttl: 锁的有效期（秒）
+        """
+        self.key = key
+        self.ttl = ttl
+        self.token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    async def acquire(self) -> bool:
+        return bool(await redis_cli.set(self.key, self.token, nx=True, ex=self.ttl))
+
+    async def extend(self) -> bool:
+        return bool(await redis_cli.eval(_RENEW_SCRIPT, 1, self.key, self.token, self.ttl))
+
+    async def release(self):
+        await redis_cli.eval(_RELEASE_SCRIPT, 1, self.key, self.token)
+
+
+class LeaderElection:
+    """
+    基于Redis租约的leader选举
+    所有进程的调度器都以暂停状态启动（接口仍可以通过调度器增删定时任务），成为leader后恢复调度器并启动后台任务，
+    失去leader后暂停调度器并停止后台任务
+    """
+
+    def __init__(self, name: str, schedulers: List = None, services: List[Callable[[], Coroutine]] = None):
+        """
+        :param name: 选举名称，同名的进程竞选同一个leader
+        :param schedulers: 只在leader中运行的APScheduler调度器
+        :param services: 只在leader中运行的后台任务，如 check_devices_heartbeat
+        """
+        self.key = f"leader:{name}"
+        self.token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.schedulers = schedulers or []
+        self.services = services or []
+        self.is_leader = False
+        self._tasks: List[asyncio.Task] = []
+
+    async def _campaign(self) -> bool:
+        """竞选或续约，返回当前进程是否持有租约"""
+        lease = BACKGROUND_CONFIG.get('lease', 30)
+        if self.is_leader:
+            return bool(await redis_cli.eval(_RENEW_SCRIPT, 1, self.key, self.token, lease))
+        return bool(await redis_cli.set(self.key, self.token, nx=True, ex=lease))
+
+    def _elected(self):
+        logger.info(f"进程 {self.token} 成为后台服务leader")
+        self.is_leader = True
+        for scheduler in self.schedulers:
+            scheduler.resume()
+        self._tasks = [asyncio.create_task(service()) for service in self.services]
+
+    async def _demoted(self):
+        logger.info(f"进程 {self.token} 不再是后台服务leader")
+        self.is_leader = False
+        for scheduler in self.schedulers:
+            scheduler.pause()
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def run(self):
+        """竞选主循环，在main.py的lifespan中启动；web角色的进程不参与竞选"""
+        if BACKGROUND_CONFIG.get('role', 'auto') == 'web':
+            return
+        try:
+            while True:
+                try:
+                    leader = await self._campaign()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # Redis不可用时无法确认租约，主动退出leader，避免租约过期后出现两个leader
+                    logger.error(f"后台服务leader选举异常: {str(e)}")
+                    leader = False
+                if leader and not self.is_leader:
+                    self._elected()
+                elif not leader and self.is_leader:
+                    await self._demoted()
+                elif leader:
+                    # 其他进程通过接口新增的定时任务只写入了任务存储，唤醒调度器重新计算下次执行时间
+                    for scheduler in self.schedulers:
+                        scheduler.wakeup()
+                await asyncio.sleep(BACKGROUND_CONFIG.get('renew_interval', 10))
+        finally:
+            if self.is_leader:
+                await self._demoted()
+                # 主动释放租约，其他进程下一次竞选即可接管
+                try:
+                    await redis_cli.eval(_RELEASE_SCRIPT, 1, self.key, self.token)
+                except Exception as e:
+                    logger.error(f"释放后台服务leader租约失败: {str(e)}")
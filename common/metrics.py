@@ -0,0 +1,89 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：metrics
+@Time ：2025/10/17 10:20
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 进程内的轻量指标（计数器、耗时分布），通过 /metrics 接口查看
+"""
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+
+
+class LatencyMetric:
+    """耗时指标，保留最近window次的采样用于计算分位数"""
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, seconds: float, ok: bool = True):
+        """记录一次耗时"""
+        self.count += 1
+        if not ok:
+            self.errors += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    @contextmanager
+    def time(self):
+        """统计代码块的耗时，代码块抛出异常时计为一次错误"""
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.observe(time.perf_counter() - start, ok=ok)
+
+    def percentile(self, q: float) -> float:
+        """最近采样的分位数（秒）"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total / self.count * 1000, 3) if self.count else 0,
+            "p50_ms": round(self.percentile(0.5) * 1000, 3),
+            "p95_ms": round(self.percentile(0.95) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class MetricsRegistry:
+    """指标注册表，按名称获取计数器和耗时指标"""
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.latencies: Dict[str, LatencyMetric] = {}
+
+    def incr(self, name: str, value: int = 1):
+        """计数器累加"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def latency(self, name: str) -> LatencyMetric:
+        """获取（不存在时创建）耗时指标"""
+        if name not in self.latencies:
+            self.latencies[name] = LatencyMetric()
+        return self.latencies[name]
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "latencies": {name: metric.snapshot() for name, metric in self.latencies.items()},
+        }
+
+
+metrics = MetricsRegistry()
@@ -1,134 +1,146 @@
-import pika
 import json
-import time
+import asyncio
+import logging
+import aio_pika
+from aio_pika.pool import Pool
 from .settings import MQ_CONFIG
-from pika.exceptions import AMQPConnectionError
-from typing import Dict, Any
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 
 class MQProducer:
     """
-    MQ消息生产者
-    支持UI测试和API测试两种模式
+    异步MQ消息生产者
+    每个worker进程只维护一条长连接，发布消息时从通道池中取通道，开启发布确认，不会阻塞事件循环
+    支持UI测试和API测试两种任务
 
     Attributes:
-        is_api: 是否为API测试模式
         exchange_name: API测试专用交换机名称
     """
 
-    def __init__(self, is_api=False):
+    def __init__(self):
         self.connection = None
-        self.channel = None
-        self.is_api = is_api
-        self.exchange_name = MQ_CONFIG.get('api_exchange', 'api_test_exchange') if is_api else ''
-        self.reconnect()
+        self.channel_pool = None
+        self.exchange_name = MQ_CONFIG.get('api_exchange', 'api_test_exchange')
+        # 已声明过的队列，避免每次发布都重复声明
+        self.declared_queues = set()
+        self._lock = asyncio.Lock()
 
-    def reconnect(self):
-        """
-        尝试重新连接到RabbitMQ服务器
+    async def start(self):
+        """建立长连接，连接失败时不影响服务启动，首次发布时会再次尝试"""
+        try:
+            await self._ensure_connection()
+        except Exception as e:
+            logger.error(f"MQ连接失败，将在发布消息时重试: {e}")
+
+    async def _ensure_connection(self):
+        """确保连接可用，robust连接断开后会自动重连"""
+        if self.connection is not None and not self.connection.is_closed:
+            return
+        async with self._lock:
+            if self.connection is not None and not self.connection.is_closed:
+                return
+            self.connection = await aio_pika.connect_robust(
+                host=MQ_CONFIG.get('host'), port=MQ_CONFIG.get('port'),
+                login=MQ_CONFIG.get('username'), password=MQ_CONFIG.get('password'),
+                # 设置心跳检测
+                heartbeat=MQ_CONFIG.get('heartbeat', 600),
+                timeout=MQ_CONFIG.get('connect_timeout', 10))
+            self.channel_pool = Pool(self._create_channel, max_size=MQ_CONFIG.get('channel_pool_size', 10))
+            self.declared_queues.clear()
+            logger.info("mq连接成功")
+
+    async def _create_channel(self):
+        """通道池创建通道，开启发布确认"""
+        return await self.connection.channel(publisher_confirms=True)
+
+    async def _declare_device_queue(self, device_id: str):
         """
-        while True:
-            try:
-                # 连接到RabbitMQ服务器
-                self.connection = pika.BlockingConnection(
-                    pika.ConnectionParameters(
-                        host=MQ_CONFIG.get('host'), port=MQ_CONFIG.get('port'),
-                        credentials=pika.credentials.PlainCredentials(username=MQ_CONFIG.get('username'),
-                                                                      password=MQ_CONFIG.get('password')),
-                        # 设置心跳检测
-                        heartbeat=MQ_CONFIG.get('heartbeat', 600),
-                        # 设置阻塞连接超时时间
-                        blocked_connection_timeout=MQ_CONFIG.get('blocked_connection_timeout', 300),
-                        # 尝试连接的次数
-                        connection_attempts=3,
-                        # 重试连接的延迟时间（秒）
-                        retry_delay=5)
-                )
-                # 创建一个通道
-                self.channel = self.connection.channel()
-                print("mq连接成功")
-                # 连接成功，退出循环
-                break
-            except pika.exceptions.AMQPConnectionError as e:
-                print(f"连接错误 {e}，等待5秒后重新连接...")
-                # 等待5秒后重试连接
-                time.sleep(5)
-            except Exception as e:
-                print(f"API测试MQ连接失败: {e}, 5秒后重试...")
-                time.sleep(5)
-
-    def _check_connection(self):
+        确保设备队列存在，不传入队列参数：队列由设备执行器以自己的参数声明（参数不一致时broker会拒绝声明），
+        已存在的队列不修改，不存在时与执行器一样声明为普通持久化队列；
+        普通队列按先进先出执行，交互式执行优先于批量任务由发件箱暂存批量任务实现（dispatch.outbox）
+        使用临时通道：被动声明不存在的队列时broker会关闭通道，不能影响通道池
         """
-        检查连接状态，必要时重新连接
+        try:
+            async with self.connection.channel() as channel:
+                await channel.declare_queue(device_id, passive=True)
+            return
+        except aio_pika.exceptions.ChannelNotFoundEntity:
+            pass
+        async with self.connection.channel() as channel:
+            await channel.declare_queue(device_id, durable=True)
 
-        Returns:
-            bool: 连接是否有效
+    async def _publish(self, message: dict, device_id: str, task_type: str, priority: int = 0):
+        """
+        发布消息并等待broker确认
+        :param message: 消息内容
+        :param device_id: 设备ID，作为路由键
+        :param task_type: 任务类型 ui_test/api_test
+        :param priority: 消息优先级
         """
-        if (self.connection is None or self.connection.is_closed or
-                self.channel is None or self.channel.is_closed):
-            print("MQ连接已断开，尝试重新连接...")
-            return self.reconnect()
-        return True
+        body = json.dumps(message, ensure_ascii=False).encode('utf-8')
+        with metrics.latency(f"mq.publish.{task_type}").time():
+            await self._ensure_connection()
+            async with self.channel_pool.acquire() as channel:
+                if task_type == 'api_test':
+                    # 发布消息到API测试交换机，使用设备ID作为路由键
+                    exchange = await channel.get_exchange(self.exchange_name, ensure=False)
+                else:
+                    # UI测试直接投递到设备同名队列
+                    if device_id not in self.declared_queues:
+                        await self._declare_device_queue(device_id)
+                        self.declared_queues.add(device_id)
+                    exchange = channel.default_exchange
+                await exchange.publish(
+                    aio_pika.Message(body=body,
+                                     delivery_mode=aio_pika.DeliveryMode.PERSISTENT,  # 持久化消息
+                                     content_type='application/json',
+                                     priority=priority,
+                                     headers={'task_type': task_type}),  # 明确标识任务类型
+                    routing_key=device_id,
+                    timeout=MQ_CONFIG.get('publish_timeout', 10))
 
-    def send_test_task(self, env_config, run_case, device_id):
+    async def send_test_task(self, env_config, run_case, device_id, priority: int = 0):
         """
         :param env_config: 运行用例的环境数据
         :param run_case: 运行用例的套件数据
         :param device_id: 指定执行的设备
+        :param priority: 消息优先级
         :return:
         """
-        data = {
-            'env_config': env_config,
-            'run_suite': run_case
-        }
-        message = json.dumps(data, ensure_ascii=False).encode('utf-8')
-        if self.connection is None or self.channel is None or self.connection.is_closed or self.channel.is_closed:
-            # 重新连接
-            self.reconnect()
-        # 连接到通道
-        self.channel = self.connection.channel()
-        # 声明队列device_id
-        self.channel.queue_declare(queue=device_id, durable=True)
-        # 提交消息到队列device_id中
-
-        self.channel.basic_publish(exchange='', routing_key=device_id, body=message,
-                                   properties=pika.BasicProperties(
-                                       delivery_mode=2,  # 持久化消息
-                                       content_type='application/json',
-                                       headers={'task_type': 'ui_test'}  # 明确标识任务类型
-                                   ))
-
-    def send_api_test_task(self, env_config, run_case, device_id: str):
+        await self._publish({'env_config': env_config, 'run_suite': run_case}, device_id, 'ui_test', priority)
+
+    async def send_api_test_task(self, env_config, run_case, device_id: str, priority: int = 0):
         """
         :param env_config: 运行用例的环境数据
         :param run_case: 运行用例的套件数据
         :param device_id: 指定执行的设备
+        :param priority: 消息优先级
         :return:
         """
         try:
-            if not self._check_connection():
-                raise Exception("MQ连接不可用，无法发送消息")
-
-            message = json.dumps({'env_config': env_config, 'run_suite': run_case}, ensure_ascii=False).encode('utf-8')
-            # 发布消息到API测试交换机，使用设备ID作为路由键
-            self.channel.basic_publish(
-                exchange=self.exchange_name,
-                routing_key=device_id,  # 使用设备ID进行路由
-                body=message,
-                properties=pika.BasicProperties(delivery_mode=2,  # 持久化消息
-                                                content_type='application/json',
-                                                headers={'task_type': 'api_test'}  # 标记为API测试任务
-                                                ))
-
-            print(f"API测试任务已发送到设备 {device_id}")
-
+            await self._publish({'env_config': env_config, 'run_suite': run_case}, device_id, 'api_test', priority)
+            logger.info(f"API测试任务已发送到设备 {device_id}")
         except Exception as e:
-            print(f"发送API测试任务失败: {e}")
-            self.reconnect()
+            logger.error(f"发送API测试任务失败: {e}")
             raise
 
-    def close(self):
-        """关闭mq对象"""
+    async def delete_queue(self, device_id: str):
+        """删除设备的消息队列"""
+        await self._ensure_connection()
+        async with self.channel_pool.acquire() as channel:
+            await channel.queue_delete(device_id)
+        self.declared_queues.discard(device_id)
+
+    async def close(self):
+        """关闭mq连接，服务关闭时调用"""
+        if self.channel_pool is not None:
+            await self.channel_pool.close()
         if self.connection and not self.connection.is_closed:
-            self.connection.close()
-            print("API测试MQ生产者连接已关闭")
+            await self.connection.close()
+            logger.info("MQ生产者连接已关闭")
+
+
+# 每个worker进程共用一个生产者，在main.py的lifespan中启动、关闭
+mq_producer = MQProducer()
@@ -0,0 +1,88 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：pagination
+@Time ：2025/10/18 9:30
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 执行记录列表的游标分页：按id降序，传入上一页返回的next_cursor翻页，翻到多深都只扫描一页数据；
+            总数默认不统计（COUNT需要扫描全部匹配的记录，耗时随记录数增长），需要时显式请求，并在Redis中短时间缓存
+"""
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+from tortoise.queryset import QuerySet
+
+from common.redis_client import redis_cli
+from common.settings import PAGINATION_CONFIG
+
+
+def sparse_fields(summary: Dict[str, str], heavy: Dict[str, str], fields: str = None) -> Dict[str, str]:
+    """
+    列表接口默认只查询摘要字段，日志、执行详情等大字段需要通过fields参数显式指定
+    :param summary: 摘要字段 {返回字段名: 查询字段}
+    :param heavy: 可选的大字段 {返回字段名: 查询字段}
+    :param fields: 逗号分隔的大字段名，如 env,task_log
+    :return: 传给values()的字段映射
+    """
+    selected = dict(summary)
+    for name in filter(None, (field.strip() for field in (fields or '').split(','))):
+        if name not in heavy:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail=f"不支持的字段：{name}，可选字段：{','.join(heavy)}")
+        selected[name] = heavy[name]
+    if 'env' in selected:
+        # 执行环境需要通过快照id回填
+        selected['env_snapshot_id'] = 'env_snapshot_id'
+    if len(selected) > len(summary):
+        # 已归档记录的大字段需要从归档文件回填
+        selected['archive'] = 'archive'
+    return selected
+
+
+async def cached_count(query: QuerySet, count_key: str) -> int:
+    """
+    查询总数，结果在Redis中缓存一段时间（近似值，新增的记录在缓存过期后才会计入）
+    :param query: 查询集
+    :param count_key: 缓存键，需要包含所有过滤条件
+    """
+    key = f"count:{count_key}"
+    cached = await redis_cli.get(key)
+    if cached is not None:
+        return int(cached)
+    total = await query.count()
+    await redis_cli.set(key, total, ex=PAGINATION_CONFIG.get('count_cache_ttl', 60))
+    return total
+
+
+async def keyset_paginate(query: QuerySet, size: int, cursor: int = None, page: int = 1, count_key: str = None,
+                          with_total: bool = False,
+                          values: Dict[str, str] = None) -> Tuple[list, Optional[int], Optional[int]]:
+    """
+    按id降序分页
+    :param query: 已经添加过滤条件、预加载的查询集
+    :param size: 每页数量
+    :param cursor: 上一页返回的next_cursor，传入时忽略page
+    :param page: 页码，兼容未使用游标的调用方（深分页仍然较慢）
+    :param count_key: 总数的缓存键，为空时不缓存
+    :param with_total: 是否返回总数，默认不返回，每页的查询耗时与记录总数无关
+    :param values: 只查询指定字段（sparse_fields的返回值），返回字典列表
+    :return: (当前页数据, 下一页游标（没有下一页时为None）, 总数（不需要时为None）)
+    """
+    size = max(1, min(size, PAGINATION_CONFIG.get('max_size', 1000)))
+    page_query = query.order_by("-id")
+    if cursor:
+        page_query = page_query.filter(id__lt=cursor)
+    elif page > 1:
+        page_query = page_query.offset((page - 1) * size)
+    # 多取一条判断是否还有下一页
+    page_query = page_query.limit(size + 1)
+    rows = await (page_query.values(**values) if values else page_query)
+    next_cursor = None
+    if len(rows) > size:
+        next_cursor = rows[size - 1]['id'] if values else rows[size - 1].id
+    total = None
+    if with_total:
+        total = await cached_count(query, count_key) if count_key else await query.count()
+    return rows[:size], next_cursor, total
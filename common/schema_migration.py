@@ -0,0 +1,63 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：schema_migration
+@Time ：2025/10/19 16:30
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： migrations/models 中迁移脚本使用的表结构查询：新部署的库由初始迁移按当前模型直接建表，
+            已有的库按实际表结构只执行缺少的变更，同一个迁移在两种库上都可以执行
+"""
+from typing import Iterable, List, Optional, Sequence
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+# UI、API的计划/套件/用例执行记录表
+RECORD_TABLES = ("task_record", "suite_record", "case_record",
+                 "api_task_record", "api_suite_record", "api_case_record")
+
+
+async def column_info(db: BaseDBAsyncClient, table: str, column: str) -> Optional[dict]:
+    """
+    列的类型信息，列不存在时返回None
+    :return: {DATA_TYPE: 如longblob, COLUMN_TYPE: 如varchar(255), IS_NULLABLE: YES/NO}
+    """
+    rows = await db.execute_query_dict(
+        "SELECT DATA_TYPE, COLUMN_TYPE, IS_NULLABLE FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        [table, column])
+    return rows[0] if rows else None
+
+
+async def index_exists(db: BaseDBAsyncClient, table: str, columns: Sequence[str]) -> bool:
+    """表上是否已有以columns为前缀列的索引（包括主键、唯一索引和外键自动创建的索引）"""
+    rows = await db.execute_query_dict(
+        "SELECT INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY INDEX_NAME, SEQ_IN_INDEX",
+        [table])
+    indexes = {}
+    for row in rows:
+        indexes.setdefault(row['INDEX_NAME'], []).append(row['COLUMN_NAME'])
+    return any(index[:len(columns)] == list(columns) for index in indexes.values())
+
+
+async def foreign_key_name(db: BaseDBAsyncClient, table: str, column: str) -> Optional[str]:
+    """列上外键约束的名称，没有外键时返回None（初始迁移建表时外键名由tortoise生成）"""
+    rows = await db.execute_query_dict(
+        "SELECT CONSTRAINT_NAME FROM information_schema.KEY_COLUMN_USAGE WHERE TABLE_SCHEMA = DATABASE() "
+        "AND TABLE_NAME = %s AND COLUMN_NAME = %s AND REFERENCED_TABLE_NAME IS NOT NULL",
+        [table, column])
+    return rows[0]['CONSTRAINT_NAME'] if rows else None
+
+
+def index_name(table: str, columns: Iterable[str]) -> str:
+    """迁移中创建的索引名，MySQL索引名最长64个字符"""
+    return f"idx_{table}_{'_'.join(columns)}"[:64]
+
+
+def script(statements: List[str]) -> str:
+    """拼接为aerich执行的SQL脚本，没有需要执行的变更时返回空操作"""
+    if not statements:
+        return "SELECT 1;"
+    return ";\n".join(statements) + ";"
@@ -17,6 +17,63 @@ MQ_CONFIG = {
     'password': 'guest',
     "heartbeat": 600,
     'blocked_connection_timeout': 300,
+    # 消息优先级的上限；设备队列为先进先出的普通队列，优先级由发件箱暂存批量任务实现（见DISPATCH_CONFIG['batch_inflight']）
+    'max_priority': 10,
+}
+
+# =========================任务下发的配置=======================
+DISPATCH_CONFIG = {
+    'relay_batch_size': 100,  # 发件箱中转每批发布的消息数
+    'relay_interval': 1,  # 发件箱没有新消息时的轮询间隔（秒）
+    'max_attempts': 5,  # 发布失败的最大重试次数
+    'retry_backoff': 5,  # 发布失败后第一次重试的等待时间（秒），之后每次翻倍
+    'retry_backoff_max': 300,  # 重试等待时间的上限（秒）
+    'send_lease_seconds': 60,  # 取出的消息在该时间（秒）内没有完成发布时（中转进程异常退出），重新发送
+    'sent_retention_days': 3,  # 已发送消息的保留天数
+    'default_case_duration': 2,  # 没有历史执行记录时，单条用例的预计耗时（秒），用于多设备调度
+    'work_chunk_size': 10,  # UI计划共享工作队列中每个分片的用例数，0表示按整个套件分片（与原来按套件下发一致）
+    # 分片的租约时间（秒），到期时设备仍在线则续约，设备已离线（心跳超时）时未执行完的用例重新入队
+    'work_lease_seconds': 120,
+    'work_feed_interval': 3,  # 检查设备分片是否执行完成的间隔（秒）
+    'work_queue_ttl': 2 * 24 * 3600,  # 工作队列在Redis中的保留时间（秒）
+    'result_flush_interval': 2,  # 套件/计划统计数据从Redis写回数据库的间隔（秒）
+    'counter_ttl': 2 * 24 * 3600,  # 执行中的统计数据在Redis中的保留时间（秒）
+    'plan_cache_ttl': 24 * 3600,  # 编译后的执行计划在Redis中的缓存时间（秒）
+    # 各执行入口的消息优先级（0 ~ MQ_CONFIG['max_priority']），单条用例调试 > 套件 > 计划 > 定时任务
+    'priorities': {'case': 9, 'suite': 6, 'plan': 3, 'cron': 1},
+    'interactive_priority': 6,  # 不低于该优先级的消息（用例调试、套件执行）立即发布，低于的为批量任务（计划、定时任务）
+    # 每台设备同时发布到MQ、还未执行完成的批量任务消息数，其余暂存在发件箱中，交互式执行只需等待正在执行的批量任务
+    'batch_inflight': 1,
+    'batch_inflight_timeout': 3600,  # 批量任务消息发布后超过该时间（秒）用例仍未执行完成时，不再占用设备的批量任务数
+    'defer_reroute_seconds': 30 * 60,  # 设备不在线时任务等待设备上线的时间（秒），超时改派给其他空闲设备，0表示一直等待
+    'defer_check_interval': 30,  # 检查等待超时任务的间隔（秒）
+}
+
+# =========================列表分页的配置=======================
+PAGINATION_CONFIG = {
+    'max_size': 1000,  # 每页最大数量
+    'count_cache_ttl': 60,  # 列表总数在Redis中的缓存时间（秒）
+}
+
+# =====================执行完成的记录详情缓存的配置==================
+DETAIL_CACHE_CONFIG = {
+    'ttl': 3600,  # 详情在Redis中的缓存时间（秒），套件、计划改名后最多在这段时间内返回旧名称
+    'max_size': 1024 * 1024,  # 超过该字节数的详情不缓存
+}
+
+# =========================执行统计的配置=========================
+STATS_CONFIG = {
+    'flaky_window': 20,  # 不稳定用例按最近多少次执行结果计算（最大100）
+    'flaky_min_runs': 5,  # 不稳定用例排行中用例至少的执行次数
+    'collect_interval': 5,  # 检查新执行完成的记录并计入统计的间隔（秒）
+    'collect_batch_size': 200,  # 每批计入统计的执行记录数
+}
+
+# =====================执行记录大字段压缩存储的配置==================
+COMPRESSION_CONFIG = {
+    'min_size': 512,  # JSON序列化后超过该字节数才压缩，小字段压缩后反而更大
+    'level': 6,  # zlib压缩级别 1-9
+    'batch_size': 500,  # 历史记录重新压缩时每批处理的记录数
 }
 
 # ==========================Redis的配置==========================
@@ -55,6 +112,9 @@ INSTALLED_APPS = [
     'apiTest.apiCronjob.models',  # api测试任务
     'apiTest.apiRecordExecution.models',  # api测试用例执行记录
     'userDict.models',  # 用户字典
+    'dispatch.models',  # 任务下发发件箱
+    'stats.models',  # 运行统计
+    'archive.models',  # 执行记录删除任务
 ]
 
 # TORTOISE_ORM配置
@@ -85,8 +145,33 @@ ALGORITHM = "HS256"
 # token过期时间默认1天
 TOKEN_TIMEOUT = 60 * 60 * 24 * 1
 DEVICE_PORT = 9001  # 设备端口
-# 设备心跳检测时间间隔
+# 未上报心跳的设备通过HTTP检测的时间间隔
 HEARTBEAT_CHECK_INTERVAL = 60
+# 设备主动上报心跳的配置，离线检测的最长延迟为 timeout + sweep_interval
+HEARTBEAT_CONFIG = {
+    'report_interval': 5,  # 设备上报心跳的间隔（秒），在心跳接口的返回中下发给设备
+    'timeout': 15,  # 超过该秒数没有上报心跳的设备改为离线，应大于上报间隔的2倍
+    'sweep_interval': 3,  # 扫描过期心跳的间隔（秒）
+    'probe_timeout': 2,  # 未上报心跳的设备HTTP健康检查的超时时间（秒）
+    'probe_concurrency': 100,  # 同时进行HTTP健康检查的最大设备数（连接池大小）
+}
+
+# 设备日志、画面推送给前端的配置
+DEVICE_STREAM_CONFIG = {
+    'log_queue_size': 1000,  # 每个WebSocket客户端最多缓存的日志数，超过时断开连接（日志不丢弃）
+    'default_fps': 10,  # 客户端没有指定帧率时画面的最大帧率，客户端消费过慢时只发送最新的一帧
+    'max_fps': 30,  # 客户端可以指定的最大帧率
+}
+
+# ==========================后台服务的配置========================
+BACKGROUND_CONFIG = {
+    # 进程角色，可通过环境变量BACKGROUND_ROLE设置
+    # auto：参与leader选举，由选出的一个进程运行定时任务调度器和设备心跳检测
+    # web：只处理接口请求，不参与选举（单独部署后台进程时，gunicorn的worker设置为web）
+    'role': os.environ.get('BACKGROUND_ROLE', 'auto'),
+    'lease': 30,  # leader租约时长（秒），leader异常退出后最长经过该时间由其他进程接管
+    'renew_interval': 10,  # 续约、竞选的间隔（秒），也是其他进程新增的定时任务最长的调度延迟
+}
 
 # ==========================nh-ai的配置========================
 
@@ -105,3 +190,24 @@ SERVICE_PLATFORM_CONFIG = {
 # 获取项目根目录
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 print(BASE_DIR)
+
+# =====================执行记录归档的配置==========================
+ARCHIVE_CONFIG = {
+    # 归档文件目录，按 任务类型/项目id/年-月.jsonl.gz 存放，可通过环境变量ARCHIVE_DIR设置
+    # 必须是持久化的目录，docker部署时默认为声明的数据卷 /app/record_archive/，多个容器需要挂载同一个共享存储
+    'dir': os.environ.get('ARCHIVE_DIR', os.path.join(BASE_DIR, 'record_archive')),
+    'max_age_days': 90,  # 超过该天数的执行记录归档，0表示不按时间归档
+    'keep_runs': 500,  # 每个计划/套件/用例只保留最近N次执行记录，更早的归档，0表示不按次数归档
+    'batch_size': 100,  # 每轮归档的最大执行记录数（计划、单独执行的套件/用例）
+    'scan_window': 10000,  # 按保留次数归档时每轮扫描的新增执行记录数
+    'interval': 600,  # 归档任务的执行间隔（秒）
+}
+
+# =====================执行记录后台删除的配置======================
+CLEANUP_CONFIG = {
+    'batch_size': 500,  # 每批删除的记录数
+    'roots_per_batch': 20,  # 按项目删除时每次处理的计划/套件/用例执行记录数
+    'batch_pause': 0.1,  # 每批之间暂停的秒数，避免长时间占用数据库
+    'interval': 5,  # 没有删除任务时的轮询间隔（秒）
+    'max_attempts': 5,  # 删除失败的最大重试次数
+}
@@ -0,0 +1,10 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：__init__.py
+@Time ：2025/10/17 11:00
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 测试任务下发（发件箱、消息中转）
+"""
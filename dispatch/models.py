@@ -0,0 +1,28 @@
+from tortoise import fields, models
+
+
+class DispatchOutbox(models.Model):
+    """任务下发发件箱，和执行记录在同一个事务中写入，由后台中转任务发布到MQ"""
+    id = fields.BigIntField(pk=True, description="消息id")
+    task_type = fields.CharField(max_length=20, description="任务类型",
+                                 choices=[("ui_test", "UI测试"), ("api_test", "API测试")])
+    device_id = fields.CharField(max_length=100, description="执行设备id")
+    payload = fields.JSONField(description="消息内容", default=dict)
+    priority = fields.SmallIntField(description="消息优先级，越大越先执行", default=0)
+    status = fields.CharField(max_length=20, description="发送状态",
+                              choices=[("pending", "待发送"), ("sending", "发送中"), ("deferred", "等待设备上线"),
+                                       ("inflight", "批量任务已发送，用例还未执行完成"), ("sent", "已发送"),
+                                       ("failed", "发送失败")],
+                              default="pending")
+    deadline = fields.DatetimeField(description="等待设备上线的截止时间，超时后改派给其他空闲设备", null=True)
+    next_attempt_time = fields.DatetimeField(description="待发送消息失败后的重试时间；发送中的消息为租约到期时间，"
+                                                         "到期未完成的由中转任务重新发送", null=True)
+    attempts = fields.IntField(description="发送次数", default=0)
+    last_error = fields.CharField(max_length=255, description="最后一次发送失败原因", null=True)
+    create_time = fields.DatetimeField(auto_now_add=True, description="创建时间")
+    sent_time = fields.DatetimeField(description="发送时间", null=True)
+
+    class Meta:
+        table = "dispatch_outbox"
+        table_description = "任务下发发件箱"
+        indexes = (("status", "priority", "id"),)
@@ -0,0 +1,324 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：outbox
+@Time ：2025/10/17 11:00
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 事务发件箱：接口只在数据库事务中写入待发送消息，后台中转任务在短事务中取出一批标记为发送中，
+            在事务外发布到MQ后标记为已发送，发布失败的消息按指数退避重试；
+            设备队列是先进先出的普通队列，消息优先级在发件箱中实现：计划、定时任务等批量任务每台设备同时只发布
+            batch_inflight 条（用例执行完成前为inflight状态），其余暂存在发件箱中，单条用例调试、套件执行
+            不会排在整个计划之后，只需等待设备正在执行的批量任务
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from tortoise import transactions
+from tortoise.expressions import Q
+from tortoise.functions import Count
+
+from common.metrics import metrics
+from common.mq_producer import mq_producer
+from common.settings import DISPATCH_CONFIG, MQ_CONFIG
+from apiTest.apiRecordExecution.models import ApiCaseRunRecord
+from uiTest.runner.models import CaseRunRecord
+from wealth.device.models import Device
+from .models import DispatchOutbox
+
+logger = logging.getLogger(__name__)
+
+# 各任务类型的用例执行记录模型，批量任务消息的用例都执行完成后设备才接收下一条批量任务
+CASE_RECORD_MODELS = {'ui_test': CaseRunRecord, 'api_test': ApiCaseRunRecord}
+
+
+def dispatch_priority(entry: str) -> int:
+    """执行入口对应的消息优先级，不能超过队列声明的最大优先级"""
+    priority = DISPATCH_CONFIG.get('priorities', {}).get(entry, 0)
+    return max(0, min(priority, MQ_CONFIG.get('max_priority', 10)))
+
+
+def is_batch(message: DispatchOutbox) -> bool:
+    """是否为批量任务（计划、定时任务）的消息，每台设备同时发布的批量任务数受batch_inflight限制"""
+    return message.priority < DISPATCH_CONFIG.get('interactive_priority', 6)
+
+
+def message_record_ids(message: DispatchOutbox) -> List[int]:
+    """消息中包含的用例执行记录id"""
+    return [case['record_id'] for case in message.payload.get('run_suite', {}).get('cases', [])
+            if case.get('record_id')]
+
+
+def outbox_message(task_type: str, env_config: dict, run_case: dict, device_id: str,
+                   entry: str = 'plan', deferred: bool = False) -> DispatchOutbox:
+    """
+    组装一条待发送的消息（未保存）
+    :param task_type: 任务类型 ui_test/api_test
+    :param env_config: 运行用例的环境数据
+    :param run_case: 运行用例的套件数据
+    :param device_id: 指定执行的设备，为空时由后台改派给空闲设备
+    :param entry: 执行入口 case/suite/plan/cron，决定消息优先级
+    :param deferred: 设备不在线，暂存到设备上线后再发送
+    """
+    message = DispatchOutbox(task_type=task_type, device_id=device_id, priority=dispatch_priority(entry),
+                             payload={'env_config': env_config, 'run_suite': run_case})
+    if deferred:
+        message.status = "deferred"
+        reroute_seconds = DISPATCH_CONFIG.get('defer_reroute_seconds')
+        if not device_id:
+            # 没有指定设备，下一次检查时直接改派
+            message.deadline = datetime.now()
+        elif reroute_seconds:
+            message.deadline = datetime.now() + timedelta(seconds=reroute_seconds)
+    return message
+
+
+async def release_deferred(device_id: str) -> int:
+    """
+    设备上线后调用，把等待这台设备的消息转为待发送
+    :return: 转为待发送的消息数
+    """
+    count = await DispatchOutbox.filter(status="deferred", device_id=device_id).update(status="pending")
+    if count:
+        logger.info(f"设备上线，下发等待中的任务 | 设备:{device_id} 数量:{count}")
+        metrics.incr("outbox.deferred.released", count)
+        outbox_relay.wake()
+    return count
+
+
+async def enqueue_dispatch(*messages: DispatchOutbox):
+    """写入发件箱，需要在创建执行记录的同一个事务中调用，事务回滚时消息也不会发出"""
+    if len(messages) == 1:
+        await messages[0].save()
+    elif messages:
+        await DispatchOutbox.bulk_create(list(messages))
+
+
+class OutboxRelay:
+    """发件箱中转：批量取出待发送消息，发布到MQ（发布确认）后批量标记为已发送"""
+
+    def __init__(self):
+        self._event = asyncio.Event()
+        self._last_purge = datetime.min
+        self._last_reroute = datetime.min
+        self._last_release = datetime.min
+        self._last_settle = datetime.min
+
+    def wake(self):
+        """事务提交后调用，立即唤醒中转任务，不必等到下一个轮询周期"""
+        self._event.set()
+
+    async def _publish(self, message: DispatchOutbox):
+        payload = message.payload
+        if message.task_type == 'api_test':
+            await mq_producer.send_api_test_task(env_config=payload['env_config'], run_case=payload['run_suite'],
+                                                 device_id=message.device_id, priority=message.priority)
+        else:
+            await mq_producer.send_test_task(env_config=payload['env_config'], run_case=payload['run_suite'],
+                                             device_id=message.device_id, priority=message.priority)
+
+    async def _publish_device(self, messages: List[DispatchOutbox]) -> Tuple[int, Optional[Exception]]:
+        """
+        同一个设备的消息按写入顺序依次发布，遇到第一条失败的消息就停止，后面的消息不能先于它发出
+        :return: (发布成功的消息数, 失败消息的异常，全部成功时为None)
+        """
+        for index, message in enumerate(messages):
+            try:
+                await self._publish(message)
+            except Exception as e:
+                return index, e
+        return len(messages), None
+
+    @staticmethod
+    async def _batch_inflight() -> Dict[str, int]:
+        """各设备已取出、已发布但还没有执行完成的批量任务消息数"""
+        rows = await DispatchOutbox.filter(status__in=["sending", "inflight"],
+                                           priority__lt=DISPATCH_CONFIG.get('interactive_priority', 6)) \
+            .annotate(count=Count('id')).group_by('device_id').values_list('device_id', 'count')
+        return dict(rows)
+
+    async def _claim(self, batch_size: int) -> List[DispatchOutbox]:
+        """在短事务中取出一批到期的待发送消息并标记为发送中，发布MQ在事务外进行，不长时间持有行锁"""
+        now = datetime.now()
+        limit = DISPATCH_CONFIG.get('batch_inflight', 1)
+        async with transactions.in_transaction():
+            inflight = await self._batch_inflight()
+            query = DispatchOutbox.filter(Q(next_attempt_time__isnull=True) | Q(next_attempt_time__lte=now),
+                                          status="pending")
+            full = [device_id for device_id, count in inflight.items() if count >= limit]
+            if full:
+                # 批量任务已达到上限的设备，只取交互式执行的消息
+                query = query.filter(~Q(device_id__in=full,
+                                        priority__lt=DISPATCH_CONFIG.get('interactive_priority', 6)))
+            # 多个worker同时中转时，跳过其他worker已锁定的消息；积压时优先发布交互式执行的消息
+            candidates = await query.order_by("-priority", "id").limit(batch_size).select_for_update(skip_locked=True)
+            messages, free = [], {}
+            for message in candidates:
+                if is_batch(message):
+                    slots = free.setdefault(message.device_id, limit - inflight.get(message.device_id, 0))
+                    if slots <= 0:
+                        continue
+                    free[message.device_id] = slots - 1
+                messages.append(message)
+            if messages:
+                lease = now + timedelta(seconds=DISPATCH_CONFIG.get('send_lease_seconds', 60))
+                await DispatchOutbox.filter(id__in=[message.id for message in messages]) \
+                    .update(status="sending", next_attempt_time=lease)
+        return messages
+
+    async def _fail(self, message: DispatchOutbox, error: Exception) -> Optional[datetime]:
+        """
+        记录发布失败，未超过最大次数时按指数退避等待重试
+        :return: 重试时间，已放弃时为None
+        """
+        message.attempts += 1
+        message.last_error = str(error)[:255]
+        if message.attempts >= DISPATCH_CONFIG.get('max_attempts', 5):
+            message.status, message.next_attempt_time = "failed", None
+            logger.error(f"发件箱消息发送失败，已放弃 | ID:{message.id} 错误:{error}")
+        else:
+            backoff = min(DISPATCH_CONFIG.get('retry_backoff', 5) * 2 ** (message.attempts - 1),
+                          DISPATCH_CONFIG.get('retry_backoff_max', 300))
+            message.status, message.next_attempt_time = "pending", datetime.now() + timedelta(seconds=backoff)
+        await DispatchOutbox.filter(id=message.id, status="sending").update(
+            status=message.status, attempts=message.attempts, last_error=message.last_error,
+            next_attempt_time=message.next_attempt_time)
+        return message.next_attempt_time
+
+    async def drain_once(self) -> int:
+        """
+        发布一批待发送消息
+        :return: 本批取出的消息数
+        """
+        messages = await self._claim(DISPATCH_CONFIG.get('relay_batch_size', 100))
+        if not messages:
+            return 0
+        with metrics.latency("outbox.relay.batch").time():
+            by_device = defaultdict(list)
+            for message in messages:
+                by_device[message.device_id].append(message)
+            # 不同设备之间并发发布
+            results = await asyncio.gather(*[self._publish_device(items) for items in by_device.values()])
+            sent_ids, failed = [], 0
+            for items, (sent, error) in zip(by_device.values(), results):
+                sent_ids += [message.id for message in items[:sent]]
+                if error is None:
+                    continue
+                failed += 1
+                retry_time = await self._fail(items[sent], error)
+                skipped = [message.id for message in items[sent + 1:]]
+                if skipped:
+                    # 同一设备后面的消息没有发布，不计发送次数，和失败的消息同时重试以保持顺序
+                    await DispatchOutbox.filter(id__in=skipped, status="sending") \
+                        .update(status="pending", next_attempt_time=retry_time)
+            # 批量任务的消息在用例执行完成前为inflight状态，占用设备的批量任务数
+            batch_ids = {message.id for message in messages if is_batch(message)}
+            for status, ids in (("sent", [id_ for id_ in sent_ids if id_ not in batch_ids]),
+                                ("inflight", [id_ for id_ in sent_ids if id_ in batch_ids])):
+                if ids:
+                    await DispatchOutbox.filter(id__in=ids).update(status=status, sent_time=datetime.now(),
+                                                                   next_attempt_time=None)
+        metrics.incr("outbox.sent", len(sent_ids))
+        metrics.incr("outbox.failed", failed)
+        return len(messages)
+
+    async def release_expired(self):
+        """中转进程在发布过程中异常退出时，租约到期的发送中消息重新转为待发送"""
+        now = datetime.now()
+        if now - self._last_release < timedelta(seconds=DISPATCH_CONFIG.get('defer_check_interval', 30)):
+            return
+        self._last_release = now
+        count = await DispatchOutbox.filter(status="sending", next_attempt_time__lte=now) \
+            .update(status="pending", next_attempt_time=None)
+        if count:
+            logger.warning(f"发件箱消息发送租约已过期，重新发送 | 数量:{count}")
+            metrics.incr("outbox.lease_expired", count)
+
+    async def settle_inflight(self):
+        """批量任务消息的用例都执行完成后改为已发送，设备可以接收下一条批量任务；超过超时时间的不再等待（执行器异常）"""
+        now = datetime.now()
+        if now - self._last_settle < timedelta(seconds=DISPATCH_CONFIG.get('relay_interval', 1)):
+            return
+        self._last_settle = now
+        timeout = now - timedelta(seconds=DISPATCH_CONFIG.get('batch_inflight_timeout', 3600))
+        settled = await DispatchOutbox.filter(status="inflight", sent_time__lte=timeout).update(status="sent")
+        messages = await DispatchOutbox.filter(status="inflight").only('id', 'task_type', 'payload')
+        record_ids = defaultdict(set)
+        for message in messages:
+            record_ids[message.task_type].update(message_record_ids(message))
+        running = defaultdict(set)
+        for task_type, ids in record_ids.items():
+            running[task_type] = set(await CASE_RECORD_MODELS[task_type].filter(id__in=ids, status="running")
+                                     .values_list('id', flat=True))
+        finished = [message.id for message in messages
+                    if not running[message.task_type].intersection(message_record_ids(message))]
+        if finished:
+            settled += await DispatchOutbox.filter(id__in=finished, status="inflight").update(status="sent")
+        if settled:
+            metrics.incr("outbox.inflight.settled", settled)
+            # 设备可以接收暂存的批量任务
+            self.wake()
+
+    async def purge_sent(self):
+        """清理过期的已发送消息，每小时最多执行一次"""
+        now = datetime.now()
+        if now - self._last_purge < timedelta(hours=1):
+            return
+        self._last_purge = now
+        days = DISPATCH_CONFIG.get('sent_retention_days', 3)
+        await DispatchOutbox.filter(status="sent", sent_time__lt=now - timedelta(days=days)).delete()
+
+    async def reroute_deferred(self):
+        """等待设备上线超时的消息，轮流改派给当前空闲的在线设备"""
+        now = datetime.now()
+        if now - self._last_reroute < timedelta(seconds=DISPATCH_CONFIG.get('defer_check_interval', 30)):
+            return
+        self._last_reroute = now
+        expired = await DispatchOutbox.filter(status="deferred", deadline__lte=now).order_by("-priority", "id") \
+            .limit(DISPATCH_CONFIG.get('relay_batch_size', 100)).values_list('id', flat=True)
+        if not expired:
+            return
+        device_ids = await Device.filter(status="在线").order_by('id').values_list('id', flat=True)
+        if not device_ids:
+            return
+        assignment = defaultdict(list)
+        for index, message_id in enumerate(expired):
+            assignment[device_ids[index % len(device_ids)]].append(message_id)
+        for device_id, message_ids in assignment.items():
+            # 条件中保留deferred状态，原设备恰好上线时不会重复改派
+            await DispatchOutbox.filter(id__in=message_ids, status="deferred") \
+                .update(status="pending", device_id=device_id)
+        metrics.incr("outbox.deferred.rerouted", len(expired))
+        logger.info(f"等待设备上线超时，已改派 {len(expired)} 条任务到 {len(assignment)} 台在线设备")
+        self.wake()
+
+    async def run(self):
+        """中转主循环"""
+        batch_size = DISPATCH_CONFIG.get('relay_batch_size', 100)
+        while True:
+            try:
+                count = await self.drain_once()
+                await self.settle_inflight()
+                await self.release_expired()
+                await self.reroute_deferred()
+                await self.purge_sent()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"发件箱中转异常: {str(e)}", exc_info=True)
+                count = 0
+            # 本批取满说明还有积压，继续发布；否则等待唤醒或轮询超时
+            if count >= batch_size:
+                continue
+            self._event.clear()
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout=DISPATCH_CONFIG.get('relay_interval', 1))
+            except asyncio.TimeoutError:
+                pass
+
+
+outbox_relay = OutboxRelay()
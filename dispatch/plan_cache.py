@@ -0,0 +1,83 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：plan_cache
+@Time ：2025/10/17 18:30
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 编译后的执行计划缓存：计划 -> 套件 -> 用例的展开结果缓存在Redis中，定时任务重复触发时只需创建执行记录并下发；
+            套件、用例、计划中的套件编辑后调用invalidate使所有缓存失效，触发时不需要查询数据库判断计划是否变化
+
+Redis中的数据结构（{prefix} = plan:{任务类型}）：
+    {prefix}:generation               string，套件/用例/计划中的套件编辑时递增，使所有已缓存的计划失效
+    {prefix}:{计划id}:{generation}     string，编译后的执行计划JSON
+"""
+import json
+import logging
+from typing import Awaitable, Callable, List, Tuple
+
+from common.metrics import metrics
+from common.redis_client import redis_cli
+from common.settings import DISPATCH_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class PlanCache:
+    """执行计划缓存"""
+
+    def __init__(self, task_type: str):
+        """
+        :param task_type: 任务类型 ui_test/api_test
+        """
+        self.task_type = task_type
+
+    def _key(self, name) -> str:
+        return f"plan:{self.task_type}:{name}"
+
+    async def get_or_compile(self, task_id: int, compile_plan: Callable[[], Awaitable[list]]):
+        """
+        获取编译后的执行计划，缓存未命中时编译并写入缓存，命中时不查询数据库
+        :param task_id: 计划id
+        :param compile_plan: 编译执行计划的协程函数，返回值需要可以JSON序列化
+        """
+        generation = await redis_cli.get(self._key('generation')) or b'0'
+        key = self._key(f"{task_id}:{generation.decode()}")
+        cached = await redis_cli.get(key)
+        if cached is not None:
+            metrics.incr(f"plan_cache.hit.{self.task_type}")
+            return json.loads(cached)
+        metrics.incr(f"plan_cache.miss.{self.task_type}")
+        plan = await compile_plan()
+        await redis_cli.set(key, json.dumps(plan, ensure_ascii=False, default=str),
+                            ex=DISPATCH_CONFIG.get('plan_cache_ttl', 24 * 3600))
+        return plan
+
+    async def compile_task_plan(self, task, load_suite_cases: Callable[[list], Awaitable[List[Tuple[object, list]]]],
+                                suite_data: Callable[[object], dict]) -> List[dict]:
+        """
+        展开计划中的套件和用例，UI、API计划共用，缓存未命中时才查询计划的套件和用例
+        :param task: 测试计划
+        :param load_suite_cases: 查询套件中待执行用例的协程函数，参数为套件列表，返回 [(套件, [用例数据, ...]), ...]
+        :param suite_data: 执行计划中保存的套件数据
+        :return: [{"suite": 套件数据, "cases": [用例数据, ...]}, ...]
+        """
+
+        async def compile_plan():
+            suites = await task.suites.all()
+            return [{"suite": suite_data(suite), "cases": cases} for suite, cases in await load_suite_cases(suites)]
+
+        return await self.get_or_compile(task.id, compile_plan)
+
+    async def invalidate(self):
+        """套件、用例编辑后调用，使所有已缓存的计划失效（旧缓存按过期时间自动清理）"""
+        try:
+            await redis_cli.incr(self._key('generation'))
+        except Exception as e:
+            # 缓存失效失败不影响编辑操作，已缓存的计划最多在plan_cache_ttl内使用编辑前的数据
+            logger.error(f"执行计划缓存失效失败: {str(e)}")
+
+
+api_plan_cache = PlanCache('api_test')
+ui_plan_cache = PlanCache('ui_test')
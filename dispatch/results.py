@@ -0,0 +1,183 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：results
+@Time ：2025/10/17 16:30
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 用例执行结果批量上报：用例记录批量更新，套件/计划的统计数据先累加在Redis中，定时及执行完成时写回数据库
+
+Redis中的数据结构（{prefix} = counters:{任务类型}）：
+    {prefix}:suite:{套件记录id}  hash，各状态的用例数、执行用例数、总用例数
+    {prefix}:task:{计划记录id}   hash，同上
+    {prefix}:dirty             set，有未写回数据库的统计数据的 suite:{id} / task:{id}
+"""
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+from tortoise import transactions, timezone
+
+from common.metrics import metrics
+from common.redis_client import redis_cli
+from common.settings import DISPATCH_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# 参与统计的用例状态，与执行记录表中的计数字段同名
+RESULT_STATUSES = ("success", "fail", "error", "skip", "no_run")
+
+
+class ResultIngestor:
+    """
+    执行结果上报
+    同一条用例记录只接受第一次上报（状态仍为running时），设备重试上报不会重复计数
+    """
+
+    def __init__(self, task_type: str, case_model, suite_model, task_model):
+        """
+        :param task_type: 任务类型 ui_test/api_test
+        :param case_model: 用例执行记录模型
+        :param suite_model: 套件执行记录模型
+        :param task_model: 计划执行记录模型
+        """
+        self.task_type = task_type
+        self.case_model = case_model
+        self.suite_model = suite_model
+        self.task_model = task_model
+        self._models = {"suite": suite_model, "task": task_model}
+
+    def _key(self, name: str) -> str:
+        return f"counters:{self.task_type}:{name}"
+
+    async def ingest(self, results: List[dict]) -> dict:
+        """
+        写入一批用例执行结果
+        :param results: [{'record_id', 'status', 'run_info'}, ...]
+        :return: {"accepted": 写入的结果数, "ignored": 记录不存在或已上报过的结果数}
+        """
+        reported = {item['record_id']: item for item in results}
+        with metrics.latency(f"results.ingest.{self.task_type}").time():
+            async with transactions.in_transaction():
+                # 锁定本批用例记录，并发上报同一条记录时只有一次生效
+                records = await self.case_model.filter(id__in=list(reported), status="running").select_for_update()
+                for record in records:
+                    record.status = reported[record.id]['status']
+                    record.run_info = reported[record.id].get('run_info') or {}
+                if records:
+                    await self.case_model.bulk_update(records, fields=['status', 'run_info'], batch_size=500)
+            # 运行统计、用例稳定性由 stats.collector 在记录执行完成后计入
+            if records:
+                await self._count(records)
+        metrics.incr(f"results.accepted.{self.task_type}", len(records))
+        return {"accepted": len(records), "ignored": len(reported) - len(records)}
+
+    async def _count(self, records: list):
+        """按套件、计划累加统计数据，执行完成的套件和计划立即写回数据库"""
+        suite_counts = defaultdict(Counter)
+        for record in records:
+            if record.suite_records_id:
+                suite_counts[record.suite_records_id][record.status] += 1
+        if not suite_counts:
+            return
+        suites = await self.suite_model.filter(id__in=list(suite_counts)).values('id', 'all', 'task_records_id')
+        task_ids = {suite['task_records_id'] for suite in suites if suite['task_records_id']}
+        task_all = dict(await self.task_model.filter(id__in=task_ids).values_list('id', 'all')) if task_ids else {}
+
+        # 计数键 -> (本批各状态的数量, 总用例数)
+        increments: Dict[str, tuple] = {}
+        for suite in suites:
+            counts = suite_counts[suite['id']]
+            increments[f"suite:{suite['id']}"] = (counts, suite['all'])
+            if suite['task_records_id']:
+                name = f"task:{suite['task_records_id']}"
+                task_counts = increments.get(name, (Counter(), task_all.get(suite['task_records_id'], 0)))[0]
+                task_counts.update(counts)
+                increments[name] = (task_counts, task_all.get(suite['task_records_id'], 0))
+
+        ttl = DISPATCH_CONFIG.get('counter_ttl', 2 * 24 * 3600)
+        pipe = redis_cli.pipeline(transaction=False)
+        for name, (counts, total) in increments.items():
+            pipe.hsetnx(self._key(name), 'all', total)
+            for result_status, count in counts.items():
+                pipe.hincrby(self._key(name), result_status, count)
+            pipe.hincrby(self._key(name), 'run_all', sum(counts.values()))
+            pipe.expire(self._key(name), ttl)
+        pipe.sadd(self._key('dirty'), *increments)
+        replies = await pipe.execute()
+
+        # 从管道结果中取出每个计数键累加后的run_all，达到总用例数即执行完成
+        finished, index = [], 0
+        for name, (counts, total) in increments.items():
+            index += 1 + len(counts)
+            if total and replies[index] >= total:
+                finished.append(name)
+            index += 2
+        if finished:
+            await self.flush(finished, finished=True)
+
+    async def flush(self, names: List[str], finished: bool = False):
+        """
+        把Redis中的统计数据写回数据库
+        :param names: 计数键列表，如 suite:1、task:2
+        :param finished: 是否执行完成，执行完成时同时更新运行状态、执行时间并删除计数
+        """
+        pipe = redis_cli.pipeline(transaction=False)
+        for name in names:
+            pipe.hgetall(self._key(name))
+        snapshots = await pipe.execute()
+        now = timezone.now()
+        for name, snapshot in zip(names, snapshots):
+            if not snapshot:
+                continue
+            kind, record_id = name.split(':', 1)
+            counts = {key.decode(): int(value) for key, value in snapshot.items()}
+            values = {result_status: counts.get(result_status, 0) for result_status in RESULT_STATUSES}
+            values['run_all'] = counts.get('run_all', 0)
+            # 通过率按执行用例数计算（百分比）
+            values['pass_rate'] = round(values['success'] / values['run_all'] * 100, 2) if values['run_all'] else 0
+            model = self._models[kind]
+            # 定时写回和执行完成的写回可能并发，读取较早的计数不能覆盖已写入的统计数据：
+            # 已执行完成的记录不再更新，执行用例数只增不减
+            query = model.filter(id=record_id).exclude(status="执行完成")
+            if not finished:
+                await query.filter(run_all__lte=values['run_all']).update(**values)
+                continue
+            record = await model.get_or_none(id=record_id).only('id', 'start_time')
+            if record and record.start_time:
+                values['duration'] = round((now - record.start_time).total_seconds(), 2)
+            values['status'] = "执行完成"
+            await query.update(**values)
+        if finished:
+            await redis_cli.delete(*[self._key(name) for name in names])
+            await redis_cli.srem(self._key('dirty'), *names)
+
+    async def flush_dirty(self):
+        """
+        写回所有有变化的统计数据
+        先取出待写回的计数键再读取计数：取出后新上报的结果会重新标记，下一轮写回；
+        写回失败时把取出的计数键放回，下一轮重试，不会丢失未写回的统计
+        """
+        batch_size = DISPATCH_CONFIG.get('relay_batch_size', 100)
+        while True:
+            names = await redis_cli.spop(self._key('dirty'), batch_size)
+            if not names:
+                return
+            try:
+                await self.flush([name.decode() for name in names])
+            except BaseException:
+                await redis_cli.sadd(self._key('dirty'), *names)
+                raise
+
+    async def run(self):
+        """定时写回主循环"""
+        while True:
+            try:
+                await self.flush_dirty()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"执行结果统计写回异常: {str(e)}", exc_info=True)
+            await asyncio.sleep(DISPATCH_CONFIG.get('result_flush_interval', 2))
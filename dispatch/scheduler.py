@@ -0,0 +1,36 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：scheduler
+@Time ：2025/10/17 14:00
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 按预计耗时把套件分配到多台设备（最长处理时间优先，LPT）
+"""
+import heapq
+from typing import Dict, Hashable, List
+
+
+def plan_assignment(weights: Dict[Hashable, float], device_ids: List[str]) -> dict:
+    """
+    按预计耗时从大到小依次把套件分配给当前负载最小的设备
+    :param weights: {套件标识: 预计耗时（秒）}
+    :param device_ids: 参与执行的设备id列表
+    :return: {"assignment": {设备id: [套件标识, ...]}, "loads": {设备id: 预计耗时}, "makespan": 预计总耗时}
+    """
+    assignment = {device_id: [] for device_id in device_ids}
+    loads = {device_id: 0.0 for device_id in device_ids}
+    # 堆中保存(当前负载, 设备顺序, 设备id)，负载相同时按设备顺序分配
+    heap = [(0.0, index, device_id) for index, device_id in enumerate(device_ids)]
+    heapq.heapify(heap)
+    for key, weight in sorted(weights.items(), key=lambda item: item[1], reverse=True):
+        load, index, device_id = heapq.heappop(heap)
+        assignment[device_id].append(key)
+        loads[device_id] = load + weight
+        heapq.heappush(heap, (load + weight, index, device_id))
+    return {
+        "assignment": assignment,
+        "loads": {device_id: round(load, 3) for device_id, load in loads.items()},
+        "makespan": round(max(loads.values(), default=0.0), 3),
+    }
@@ -0,0 +1,230 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：work_queue
+@Time ：2025/10/17 15:00
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 按执行记录划分的共享工作队列，设备空闲时才领取下一批用例，慢设备不再拖慢整个计划
+
+Redis中的数据结构（{prefix} = work:{任务类型}:{计划执行记录id}）：
+    {prefix}:pending   list，待执行的用例分片
+    {prefix}:inflight  hash，设备id -> 正在执行的分片及租约到期时间；租约到期时设备仍在线则续约，
+                       设备已离线时未完成的用例重新入队，分片改为已撤回（revoked），只记录撤回的用例
+    {prefix}:env       string，执行环境
+    work:{任务类型}:active  set，还有未完成分片的计划执行记录id
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from tortoise import transactions
+
+from common.redis_client import redis_cli
+from common.settings import DISPATCH_CONFIG
+from wealth.device.models import Device
+from .outbox import outbox_message, enqueue_dispatch, outbox_relay
+
+logger = logging.getLogger(__name__)
+
+
+def split_chunks(suites_data: List[dict], chunk_size: int) -> List[dict]:
+    """
+    把套件拆分为用例分片，每个分片都携带套件的前置步骤，可以在任意设备上独立执行
+    :param suites_data: 套件执行数据列表
+    :param chunk_size: 每个分片的用例数，小于等于0时不拆分套件
+    :return: 分片列表，用例多的套件排在前面
+    """
+    chunks = []
+    for suite_data in sorted(suites_data, key=lambda item: len(item['cases']), reverse=True):
+        cases = suite_data['cases']
+        size = chunk_size if chunk_size > 0 else max(len(cases), 1)
+        for start in range(0, max(len(cases), 1), size):
+            chunks.append({**suite_data, "cases": cases[start:start + size],
+                           "chunk_id": f"{suite_data['suite_record_id']}-{start // size}"})
+    return chunks
+
+
+class WorkQueue:
+    """
+    共享工作队列
+    计划开始时每台设备先推送一个分片，之后由后台任务检测分片中的用例记录是否都已执行完，
+    执行完就把下一个分片推送给这台设备；支持拉取的执行器也可以主动调用接口领取下一个分片。
+    分片超过租约时间仍未执行完时检查设备状态：设备仍在线时续约（长套件继续由这台设备执行，不会重复执行），
+    设备已离线时未完成的用例重新放回队列头部，由其他空闲设备执行。
+    """
+
+    def __init__(self, task_type: str, record_model, pull_url: str):
+        """
+        :param task_type: 任务类型 ui_test/api_test
+        :param record_model: 用例执行记录模型，用于判断分片是否执行完成
+        :param pull_url: 执行器主动领取分片的接口地址模板
+        """
+        self.task_type = task_type
+        self.record_model = record_model
+        self.pull_url = pull_url
+
+    def _key(self, task_record_id, name: str) -> str:
+        return f"work:{self.task_type}:{task_record_id}:{name}"
+
+    @property
+    def _active_key(self) -> str:
+        return f"work:{self.task_type}:active"
+
+    def plan(self, task_record_id: int, suites_data: List[dict],
+             device_ids: List[str]) -> Tuple[Dict[str, dict], List[dict]]:
+        """
+        拆分分片，并为每台设备准备第一个分片
+        :return: ({设备id: 首个分片}, 剩余待领取的分片)
+        """
+        chunks = split_chunks(suites_data, DISPATCH_CONFIG.get('work_chunk_size', 10))
+        for chunk in chunks:
+            chunk['work_queue'] = {"task_record_id": task_record_id,
+                                   "pull_url": self.pull_url.format(task_record_id=task_record_id)}
+        seeds = {device_id: chunk for device_id, chunk in zip(device_ids, chunks)}
+        return seeds, chunks[len(seeds):]
+
+    async def start(self, task_record_id: int, env_config: dict, seeds: Dict[str, dict], pending: List[dict]):
+        """
+        写入队列状态，在创建执行记录的事务提交之前调用：写入失败时事务回滚，不会出现有执行记录、没有队列的计划；
+        事务提交前后台分发读取不到用例记录，会跳过这个计划（见 _feed_task）
+        """
+        ttl = DISPATCH_CONFIG.get('work_queue_ttl', 2 * 24 * 3600)
+        pipe = redis_cli.pipeline(transaction=True)
+        pipe.set(self._key(task_record_id, 'env'), json.dumps(env_config, ensure_ascii=False), ex=ttl)
+        if pending:
+            pipe.rpush(self._key(task_record_id, 'pending'),
+                       *[json.dumps(chunk, ensure_ascii=False) for chunk in pending])
+            pipe.expire(self._key(task_record_id, 'pending'), ttl)
+        if seeds:
+            pipe.hset(self._key(task_record_id, 'inflight'),
+                      mapping={device_id: self._inflight(chunk) for device_id, chunk in seeds.items()})
+            pipe.expire(self._key(task_record_id, 'inflight'), ttl)
+        pipe.sadd(self._active_key, task_record_id)
+        await pipe.execute()
+
+    @staticmethod
+    def _inflight(chunk: dict, record_ids: List[int] = None) -> str:
+        """设备正在执行的分片，租约从现在开始计算；续约时record_ids为还未执行完的用例"""
+        if record_ids is None:
+            record_ids = [case['record_id'] for case in chunk['cases']]
+        return json.dumps({"chunk": chunk, "record_ids": record_ids,
+                           "deadline": time.time() + DISPATCH_CONFIG.get('work_lease_seconds', 120),
+                           "revoked": False}, ensure_ascii=False)
+
+    @staticmethod
+    def _revoked(meta: dict, record_ids: List[int]) -> str:
+        """
+        撤回设备的分片：未完成的用例已重新入队，这台设备不再拥有这个分片；
+        撤回的用例执行完成（由任意设备）后设备视为空闲，超过一个租约时间仍未完成时不再等待这台设备
+        """
+        return json.dumps({"chunk": {"chunk_id": meta['chunk']['chunk_id']}, "record_ids": record_ids,
+                           "deadline": time.time() + DISPATCH_CONFIG.get('work_lease_seconds', 120),
+                           "revoked": True}, ensure_ascii=False)
+
+    async def _env_config(self, task_record_id) -> dict:
+        raw = await redis_cli.get(self._key(task_record_id, 'env'))
+        return json.loads(raw) if raw else {}
+
+    async def _take(self, task_record_id, device_id: str) -> Optional[dict]:
+        """为设备领取下一个分片，队列为空时清除设备的执行中分片"""
+        raw = await redis_cli.lpop(self._key(task_record_id, 'pending'))
+        if raw is None:
+            await redis_cli.hdel(self._key(task_record_id, 'inflight'), device_id)
+            return None
+        chunk = json.loads(raw)
+        await redis_cli.hset(self._key(task_record_id, 'inflight'), device_id, self._inflight(chunk))
+        return chunk
+
+    async def next_chunk(self, task_record_id: int, device_id: str) -> Tuple[dict, Optional[dict]]:
+        """
+        执行器主动领取下一个分片（同时视为上一个分片已执行完）
+        :return: (执行环境, 分片)，没有待执行的分片时分片为None
+        """
+        async with redis_cli.lock(self._key(task_record_id, 'lock'), timeout=10, blocking_timeout=5):
+            chunk = await self._take(task_record_id, device_id)
+        return await self._env_config(task_record_id), chunk
+
+    async def _feed_task(self, task_record_id: str):
+        """检查一个计划中各设备的分片，执行完的设备推送下一个分片，超时的分片重新入队"""
+        inflight = {device_id.decode(): json.loads(raw)
+                    for device_id, raw in (await redis_cli.hgetall(self._key(task_record_id, 'inflight'))).items()}
+        if not inflight and not await redis_cli.llen(self._key(task_record_id, 'pending')):
+            # 所有分片都已领取完毕并执行完成
+            await redis_cli.delete(*[self._key(task_record_id, name) for name in ('pending', 'inflight', 'env')])
+            await redis_cli.srem(self._active_key, task_record_id)
+            return
+        now = time.time()
+        record_ids = [record_id for meta in inflight.values() for record_id in meta['record_ids']]
+        records = await self.record_model.filter(id__in=record_ids).values_list('id', 'status') if record_ids else []
+        if record_ids and not records:
+            # 队列在执行记录的事务提交前写入：记录还不可见时跳过，超过租约时间仍不存在说明事务已回滚，清除队列
+            if all(now > meta['deadline'] for meta in inflight.values()):
+                await redis_cli.delete(*[self._key(task_record_id, name) for name in ('pending', 'inflight', 'env')])
+                await redis_cli.srem(self._active_key, task_record_id)
+            return
+        running = {record_id for record_id, record_status in records if record_status == "running"}
+        expired = [device_id for device_id, meta in inflight.items()
+                   if now > meta['deadline'] and not meta.get('revoked')
+                   and any(record_id in running for record_id in meta['record_ids'])]
+        # 租约到期时设备仍在线（心跳检测未判定为离线）的继续执行，只有离线或已删除的设备才重新分配
+        alive = set(await Device.filter(id__in=expired).exclude(status="离线").values_list('id', flat=True)) \
+            if expired else set()
+        messages = []
+        for device_id, meta in inflight.items():
+            unfinished = [record_id for record_id in meta['record_ids'] if record_id in running]
+            if not unfinished:
+                chunk = await self._take(task_record_id, device_id)
+                if chunk:
+                    messages.append((device_id, chunk))
+            elif now <= meta['deadline']:
+                continue
+            elif device_id in alive:
+                await redis_cli.hset(self._key(task_record_id, 'inflight'), device_id,
+                                     self._inflight(meta['chunk'], unfinished))
+            elif not meta.get('revoked'):
+                # 设备已离线，把未完成的用例放回队列头部由其他空闲设备执行，并撤回这台设备的分片
+                cases = [case for case in meta['chunk']['cases'] if case['record_id'] in running]
+                await redis_cli.lpush(self._key(task_record_id, 'pending'),
+                                      json.dumps({**meta['chunk'], "cases": cases}, ensure_ascii=False))
+                await redis_cli.hset(self._key(task_record_id, 'inflight'), device_id,
+                                     self._revoked(meta, unfinished))
+                logger.warning(f"设备离线，分片已重新入队并撤回 | 计划记录:{task_record_id} 设备:{device_id} "
+                               f"分片:{meta['chunk']['chunk_id']}")
+            else:
+                # 撤回后仍长时间没有进展，不再等待这台设备
+                await redis_cli.hdel(self._key(task_record_id, 'inflight'), device_id)
+        if messages:
+            env_config = await self._env_config(task_record_id)
+            async with transactions.in_transaction():
+                await enqueue_dispatch(*[outbox_message(self.task_type, env_config=env_config, run_case=chunk,
+                                                        device_id=device_id, entry='plan')
+                                         for device_id, chunk in messages])
+            outbox_relay.wake()
+
+    async def feed_once(self):
+        for task_record_id in await redis_cli.smembers(self._active_key):
+            task_record_id = task_record_id.decode()
+            try:
+                lock = redis_cli.lock(self._key(task_record_id, 'lock'), timeout=30, blocking_timeout=0)
+                if not await lock.acquire():
+                    # 其他worker正在处理这个计划
+                    continue
+                try:
+                    await self._feed_task(task_record_id)
+                finally:
+                    await lock.release()
+            except Exception as e:
+                logger.error(f"工作队列分发异常 | 计划记录:{task_record_id} 错误:{str(e)}", exc_info=True)
+
+    async def run(self):
+        """后台分发主循环"""
+        while True:
+            try:
+                await self.feed_once()
+            except Exception as e:
+                logger.error(f"工作队列主循环异常: {str(e)}", exc_info=True)
+            await asyncio.sleep(DISPATCH_CONFIG.get('work_feed_interval', 3))
@@ -1,8 +1,8 @@
 #!/bin/sh
 
-# 执行数据库迁移
+# 执行数据库迁移：migrations/models 中未执行过的迁移按顺序执行，新部署的库由初始迁移建表
 aerich init -t common.settings.TORTOISE_ORM
-aerich init-db
+aerich upgrade
 if [ $? -ne 0 ];then
     echo '数据库连接失败重启'
     exit 1
@@ -6,6 +6,10 @@ import logging
 import uvicorn
 import logging.handlers
 from common import settings
+from common.metrics import metrics
+from common.leader import LeaderElection
+from common.mq_producer import mq_producer
+from dispatch.outbox import outbox_relay
 from uvicorn.config import LOGGING_CONFIG
 from contextlib import asynccontextmanager
 from starlette.responses import JSONResponse
@@ -20,13 +24,15 @@ from wealth.module.api import router as module_router
 from wealth.device.api import router as device_router
 from wealth.project.api import router as project_router
 from wealth.device.heartbeat import check_devices_heartbeat
+from wealth.device.hub import device_hub
 from wealth.environment.api import router as environment_router
 
 from uiTest.cronjob.api import scheduler
 from uiTest.task.api import router as task_router
 from uiTest.case.api import router as case_router
 from uiTest.suite.api import router as suite_router
-from uiTest.runner.api import router as runner_router
+from uiTest.runner.api import router as runner_router, ui_work_queue, ui_results, ui_archiver, ui_deleter, \
+    ui_stats
 from uiTest.cronjob.api import router as cronjob_router
 
 from apiTest.apiCronjob.api import api_scheduler
@@ -34,7 +40,8 @@ from apiTest.apiCase.url import router as api_test_router
 from apiTest.apiSuite.url import router as api_suite_router
 from apiTest.task.url import router as api_test_task_router
 from apiTest.apiCronjob.api import router as api_cronjob_router
-from apiTest.apiRecordExecution.url import router as api_runner_router
+from apiTest.apiRecordExecution.url import router as api_runner_router, api_results, api_archiver, \
+    api_deleter, api_stats
 
 from fastapi import FastAPI, Request, status
 from fastapi.staticfiles import StaticFiles
@@ -43,6 +50,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.docs import get_redoc_html, get_swagger_ui_html, get_swagger_ui_oauth2_redirect_html
 
 from tools.api import router as tools_router
+from stats.api import router as stats_router
 from userDict.url import router as user_dict_router
 
 # 修改默认日志格式
@@ -66,15 +74,21 @@ banner = """
 if not os.path.exists("logs"):
     os.makedirs("logs")
 
+# 定时任务调度器和设备心跳检测只在leader进程中运行，避免每个gunicorn worker重复执行
+background_leader = LeaderElection("background", schedulers=[scheduler, api_scheduler],
+                                   services=[check_devices_heartbeat])
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """fastapi项目日志"""
     # 项目启动时执行
     click.echo(banner)
-    # 启动调度器
-    scheduler.start()
-    api_scheduler.start()
+    # 建立MQ长连接
+    await mq_producer.start()
+    # 启动调度器（暂停状态，接口可以增删定时任务，由leader进程恢复运行）
+    scheduler.start(paused=True)
+    api_scheduler.start(paused=True)
     # 获取日志记录器
     logger = logging.getLogger("uvicorn.access")
     logging.getLogger('suds').setLevel(logging.INFO)  # 屏蔽suds日志（计料系统数据获取的垃圾日志）
@@ -86,10 +100,28 @@ async def lifespan(app: FastAPI):
     handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
     # 添加处理器到记录器
     logger.addHandler(handler)
-    # 启动心跳检测任务
-    heartbeat_task = asyncio.create_task(check_devices_heartbeat())
+    # 参与后台服务leader选举，由选出的一个进程运行定时任务调度器和心跳检测任务
+    leader_task = asyncio.create_task(background_leader.run())
+    # 启动发件箱中转任务
+    relay_task = asyncio.create_task(outbox_relay.run())
+    # 启动UI计划共享工作队列的分发任务
+    work_queue_task = asyncio.create_task(ui_work_queue.run())
+    # 启动执行结果统计数据的定时写回任务
+    result_tasks = [asyncio.create_task(ingestor.run()) for ingestor in (ui_results, api_results)]
+    # 启动历史执行记录归档任务
+    archive_tasks = [asyncio.create_task(archiver.run()) for archiver in (ui_archiver, api_archiver)]
+    # 启动执行记录后台删除任务
+    delete_tasks = [asyncio.create_task(deleter.run()) for deleter in (ui_deleter, api_deleter)]
+    # 启动执行统计采集任务（运行统计、按天汇总、用例稳定性）
+    stats_tasks = [asyncio.create_task(collector.run()) for collector in (ui_stats, api_stats)]
     yield
     # 项目结束时执行
+    # 先退出leader并释放租约，由其他进程接管调度器和心跳检测
+    leader_task.cancel()
+    try:
+        await leader_task
+    except asyncio.CancelledError:
+        pass
     # 停止调度器
     scheduler.shutdown()
     api_scheduler.shutdown()
@@ -97,11 +129,16 @@ async def lifespan(app: FastAPI):
         logger.removeHandler(handler)
         handler.close()
     # 关闭时清理
-    heartbeat_task.cancel()
-    try:
-        await heartbeat_task
-    except asyncio.CancelledError:
-        pass
+    for task in (relay_task, work_queue_task, *result_tasks, *archive_tasks, *delete_tasks, *stats_tasks):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    # 关闭设备日志、画面的订阅连接
+    await device_hub.close()
+    # 关闭MQ连接
+    await mq_producer.close()
 
 
 # 线上部署屏蔽接口文档，可以增加参数openapi_url=None
@@ -132,6 +169,12 @@ async def redoc_html():
                           redoc_js_url="/static/redoc.standalone.js")
 
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """当前worker进程的运行指标（MQ发布耗时等）"""
+    return {"pid": os.getpid(), "leader": background_leader.is_leader, **metrics.snapshot()}
+
+
 # 接口文档的静态文件路径
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -220,6 +263,7 @@ app.include_router(api_cronjob_router, prefix="/api", tags=["接口任务中心"
 app.include_router(api_runner_router, prefix="/runApi", tags=["接口执行中心"])
 app.include_router(user_dict_router, prefix="/userdict", tags=["用户字典中心"])
 app.include_router(tools_router, prefix="/tools", tags=["辅助工具"])
+app.include_router(stats_router, prefix="/stats")
 
 if __name__ == '__main__':
     uvicorn.run(app="main:app", host="0.0.0.0", port=8000, reload=False)
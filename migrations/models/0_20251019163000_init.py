@@ -0,0 +1,16 @@
+"""
+初始迁移：按当前模型创建不存在的表
+新部署的库直接创建全部表（包括aerich迁移记录表），后续迁移检查表结构后不再重复变更；
+之前通过 aerich init-db 建表的库只创建新增模块的表（执行环境快照、发件箱、运行统计等），已有的表不修改
+"""
+from tortoise import BaseDBAsyncClient
+from tortoise.utils import get_schema_sql
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return get_schema_sql(db, safe=True)
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    # 初始迁移不回滚，避免误删全部数据
+    return "SELECT 1;"
@@ -0,0 +1,32 @@
+"""
+执行记录引用执行环境快照：新增 env_snapshot_id 列和外键，env 改为可为空（新记录只保存快照id）
+"""
+from tortoise import BaseDBAsyncClient
+
+from common.schema_migration import RECORD_TABLES, column_info, foreign_key_name, script
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    statements = []
+    for table in RECORD_TABLES:
+        if not await column_info(db, table, "env_snapshot_id"):
+            statements.append(f"ALTER TABLE `{table}` ADD `env_snapshot_id` INT NULL COMMENT '执行环境快照'")
+        if not await foreign_key_name(db, table, "env_snapshot_id"):
+            statements.append(f"ALTER TABLE `{table}` ADD CONSTRAINT `fk_{table}_env_snapshot` FOREIGN KEY "
+                              f"(`env_snapshot_id`) REFERENCES `env_snapshot` (`id`) ON DELETE CASCADE")
+        env = await column_info(db, table, "env")
+        if env and env['IS_NULLABLE'] == 'NO':
+            statements.append(f"ALTER TABLE `{table}` MODIFY `env` {env['COLUMN_TYPE']} NULL")
+    return script(statements)
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    # 回滚后只保存了快照id的记录不再有执行环境，env保持可为空
+    statements = []
+    for table in RECORD_TABLES:
+        constraint = await foreign_key_name(db, table, "env_snapshot_id")
+        if constraint:
+            statements.append(f"ALTER TABLE `{table}` DROP FOREIGN KEY `{constraint}`")
+        if await column_info(db, table, "env_snapshot_id"):
+            statements.append(f"ALTER TABLE `{table}` DROP COLUMN `env_snapshot_id`")
+    return script(statements)
@@ -0,0 +1,34 @@
+"""
+执行记录大字段改为二进制列：zlib压缩后的数据不能写入JSON列，需要在执行 python -m common.compress_migration migrate 之前执行
+改类型后历史数据仍是JSON文本（按utf-8字节保存），读取时可以直接兼容
+"""
+from tortoise import BaseDBAsyncClient
+
+from common.schema_migration import column_info, script
+
+# {表名: 压缩存储的列}
+COMPRESSED_COLUMNS = {
+    "task_record": ("task_log", "env"),
+    "suite_record": ("suite_log", "env"),
+    "case_record": ("run_info", "env"),
+    "api_task_record": ("task_log", "env"),
+    "api_suite_record": ("suite_log", "env"),
+    "api_case_record": ("run_info", "env"),
+}
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    statements = []
+    for table, columns in COMPRESSED_COLUMNS.items():
+        for column in columns:
+            info = await column_info(db, table, column)
+            if info and info['DATA_TYPE'] != 'longblob':
+                # env在上一个迁移中已改为可为空
+                nullable = "NULL" if info['IS_NULLABLE'] == 'YES' else "NOT NULL"
+                statements.append(f"ALTER TABLE `{table}` MODIFY `{column}` LONGBLOB {nullable}")
+    return script(statements)
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    # 压缩后的数据不能再转换为JSON列，需要先解压写回后再手动修改列类型
+    return "SELECT 1;"
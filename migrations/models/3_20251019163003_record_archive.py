@@ -0,0 +1,22 @@
+"""
+执行记录归档：新增 archive 列，不为空时执行详情、日志等大字段已迁移到归档文件
+"""
+from tortoise import BaseDBAsyncClient
+
+from common.schema_migration import RECORD_TABLES, column_info, script
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    statements = []
+    for table in RECORD_TABLES:
+        if not await column_info(db, table, "archive"):
+            statements.append(f"ALTER TABLE `{table}` ADD `archive` VARCHAR(255) NULL COMMENT '归档位置'")
+    return script(statements)
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    statements = []
+    for table in RECORD_TABLES:
+        if await column_info(db, table, "archive"):
+            statements.append(f"ALTER TABLE `{table}` DROP COLUMN `archive`")
+    return script(statements)
@@ -0,0 +1,22 @@
+"""
+执行记录后台删除：新增 hidden 列，删除接口先隐藏记录，后台任务再分批删除
+"""
+from tortoise import BaseDBAsyncClient
+
+from common.schema_migration import RECORD_TABLES, column_info, script
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    statements = []
+    for table in RECORD_TABLES:
+        if not await column_info(db, table, "hidden"):
+            statements.append(f"ALTER TABLE `{table}` ADD `hidden` BOOL NOT NULL DEFAULT 0 COMMENT '是否已删除'")
+    return script(statements)
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    statements = []
+    for table in RECORD_TABLES:
+        if await column_info(db, table, "hidden"):
+            statements.append(f"ALTER TABLE `{table}` DROP COLUMN `hidden`")
+    return script(statements)
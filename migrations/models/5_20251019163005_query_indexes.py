@@ -0,0 +1,36 @@
+"""
+列表、状态查询的索引（模型Meta.indexes中声明），已有的库补建缺少的索引
+执行后可以通过 python -m common.index_audit --seed 检查各接口查询是否用到了索引
+"""
+from tortoise import BaseDBAsyncClient
+
+from common.schema_migration import index_exists, index_name, script
+
+# {表名: [索引列]}
+QUERY_INDEXES = {
+    "task_record": [("project_id", "hidden", "id"), ("task_id", "hidden", "id")],
+    "suite_record": [("task_records_id", "hidden", "id"), ("suite_id", "hidden", "id")],
+    "case_record": [("case_id", "hidden", "id"), ("suite_records_id", "hidden", "id")],
+    "api_task_record": [("project_id", "hidden", "id"), ("task_id", "hidden", "id")],
+    "api_suite_record": [("task_records_id", "hidden", "id"), ("suite_id", "hidden", "id")],
+    "api_case_record": [("case_id", "hidden", "id"), ("suite_records_id", "hidden", "id")],
+    "case": [("project_id", "create_time")],
+    "api_info": [("project_id", "create_time")],
+    "api_cases": [("project_id", "create_time")],
+    "device": [("status",)],
+}
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    statements = []
+    for table, indexes in QUERY_INDEXES.items():
+        for columns in indexes:
+            if not await index_exists(db, table, columns):
+                statements.append(f"ALTER TABLE `{table}` ADD INDEX `{index_name(table, columns)}` "
+                                  f"({', '.join(f'`{column}`' for column in columns)})")
+    return script(statements)
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    # 索引不影响数据，回滚时保留（组合索引可能已代替外键的索引，不能直接删除）
+    return "SELECT 1;"
@@ -0,0 +1,40 @@
+"""
+执行统计采集：执行记录新增 stats_done 列
+已有的记录标记为已计入（历史数据通过 python -m stats.migration 重建），迁移时还未执行完成的记录由后台任务在执行完成后计入
+"""
+from tortoise import BaseDBAsyncClient
+
+from common.schema_migration import RECORD_TABLES, column_info, index_exists, index_name, script
+
+# {表名: 未执行完成的状态}
+RUNNING_STATUSES = {
+    "task_record": "'执行中', '等待执行'",
+    "suite_record": "'执行中', '等待执行'",
+    "case_record": "'running'",
+    "api_task_record": "'执行中', '等待执行'",
+    "api_suite_record": "'执行中', '等待执行'",
+    "api_case_record": "'running'",
+}
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    statements = []
+    for table in RECORD_TABLES:
+        if not await column_info(db, table, "stats_done"):
+            statements += [
+                f"ALTER TABLE `{table}` ADD `stats_done` BOOL NOT NULL DEFAULT 1 COMMENT '是否已计入执行统计'",
+                f"ALTER TABLE `{table}` ALTER `stats_done` SET DEFAULT 0",
+                f"UPDATE `{table}` SET `stats_done` = 0 WHERE `status` IN ({RUNNING_STATUSES[table]})",
+            ]
+        if not await index_exists(db, table, ("stats_done", "id")):
+            statements.append(f"ALTER TABLE `{table}` ADD INDEX `{index_name(table, ('stats_done', 'id'))}` "
+                              f"(`stats_done`, `id`)")
+    return script(statements)
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    statements = []
+    for table in RECORD_TABLES:
+        if await column_info(db, table, "stats_done"):
+            statements.append(f"ALTER TABLE `{table}` DROP COLUMN `stats_done`")
+    return script(statements)
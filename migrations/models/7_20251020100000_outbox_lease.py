@@ -0,0 +1,24 @@
+"""
+发件箱中转：新增 next_attempt_time 列，消息在短事务中取出并标记为发送中，发布失败后按退避时间重试
+"""
+from tortoise import BaseDBAsyncClient
+
+from common.schema_migration import column_info, script
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    statements = []
+    if not await column_info(db, "dispatch_outbox", "next_attempt_time"):
+        statements.append("ALTER TABLE `dispatch_outbox` ADD `next_attempt_time` DATETIME(6) NULL "
+                          "COMMENT '待发送消息失败后的重试时间；发送中的消息为租约到期时间，到期未完成的由中转任务重新发送'")
+    return script(statements)
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    statements = []
+    if await column_info(db, "dispatch_outbox", "next_attempt_time"):
+        statements += [
+            "UPDATE `dispatch_outbox` SET `status` = 'pending' WHERE `status` = 'sending'",
+            "ALTER TABLE `dispatch_outbox` DROP COLUMN `next_attempt_time`",
+        ]
+    return script(statements)
@@ -0,0 +1,10 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：__init__.py
+@Time ：2025/10/18 17:30
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 执行统计（计划、套件、用例的运行统计）
+"""
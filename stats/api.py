@@ -0,0 +1,78 @@
+from datetime import date, timedelta
+
+from fastapi import APIRouter, HTTPException, Depends, status
+from auth.auth import is_authenticated
+from common.settings import STATS_CONFIG
+from uiTest.case.models import Case
+from apiTest.apiCase.models import ApiCase
+from .models import DailyRollup, CaseFlakiness
+from .rollup import ROLLUP_FIELDS, summarize
+
+# 创建路由对象
+router = APIRouter(tags=['执行统计'], dependencies=[Depends(is_authenticated)])
+
+# 趋势查询的最大天数
+MAX_TREND_DAYS = 366
+
+
+async def load_rollups(task_type: str, target_type: str, target_id: int, days: int) -> list:
+    """查询最近若干天的按天汇总数据，查询量只和天数有关，与历史执行记录的数量无关"""
+    if task_type not in ("ui_test", "api_test"):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="任务类型错误")
+    if target_type not in ("project", "task", "suite"):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="统计对象类型错误")
+    if not 1 <= days <= MAX_TREND_DAYS:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"统计天数需要在1~{MAX_TREND_DAYS}之间")
+    start = date.today() - timedelta(days=days - 1)
+    return await DailyRollup.filter(task_type=task_type, target_type=target_type, target_id=target_id,
+                                    day__gte=start).order_by('day').values('day', *ROLLUP_FIELDS)
+
+
+# 按天的执行趋势
+@router.get("/trend", summary="执行趋势", status_code=status.HTTP_200_OK)
+async def get_trend(task_type: str, target_type: str, target_id: int, days: int = 30):
+    """
+    项目/计划/套件每天的执行次数、用例结果、通过率、执行时间（平均、P50、P95）
+    :param task_type: 任务类型 ui_test/api_test
+    :param target_type: 统计对象类型 project/task/suite
+    :param target_id: 项目/计划/套件id
+    :param days: 最近天数，没有执行的日期不返回
+    """
+    rollups = await load_rollups(task_type, target_type, target_id, days)
+    return {"data": [{"day": row['day'], **summarize([row])} for row in rollups]}
+
+
+# 时间范围内的执行汇总
+@router.get("/trend/summary", summary="执行汇总", status_code=status.HTTP_200_OK)
+async def get_trend_summary(task_type: str, target_type: str, target_id: int, days: int = 30):
+    """最近若干天合计的执行次数、用例结果、通过率、执行时间（平均、P50、P95）"""
+    rollups = await load_rollups(task_type, target_type, target_id, days)
+    return summarize(rollups)
+
+
+# 不稳定用例排行
+@router.get("/flaky", summary="不稳定用例排行", status_code=status.HTTP_200_OK)
+async def get_flaky_cases(task_type: str, project_id: int, limit: int = 20, min_runs: int = None):
+    """
+    项目中同一执行环境下成功、失败频繁切换的用例，按不稳定分数降序
+    :param task_type: 任务类型 ui_test/api_test
+    :param project_id: 项目id
+    :param limit: 返回数量
+    :param min_runs: 至少的执行次数，执行次数太少的用例分数没有参考价值
+    """
+    if task_type not in ("ui_test", "api_test"):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="任务类型错误")
+    min_runs = STATS_CONFIG.get('flaky_min_runs', 5) if min_runs is None else min_runs
+    rows = await CaseFlakiness.filter(task_type=task_type, project_id=project_id, flaky_score__gt=0,
+                                      runs__gte=min_runs).order_by('-flaky_score', '-flips') \
+        .limit(max(1, min(limit, 100))).values('case_id', 'env_snapshot_id', 'outcomes', 'runs', 'flips',
+                                                'failure_streak', 'flaky_score', 'last_status', 'update_time')
+    # 一次查询回填用例名称
+    if task_type == "api_test":
+        names = dict(await ApiCase.filter(id__in=[row['case_id'] for row in rows]).values_list('id', 'case_name'))
+    else:
+        names = dict(await Case.filter(id__in=[row['case_id'] for row in rows]).values_list('id', 'name'))
+    for row in rows:
+        row['case_name'] = names.get(row['case_id'], '')
+    return {"data": rows}
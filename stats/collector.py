@@ -0,0 +1,86 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：collector
+@Time ：2025/10/19 18:00
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 执行统计的采集：执行器直接在数据库中把执行记录改为执行完成（不一定经过结果上报接口），
+            后台任务按执行记录的stats_done标记取出已执行完成、还未计入统计的记录，
+            更新运行统计、按天汇总和用例稳定性后标记为已计入，每条执行记录只计入一次
+"""
+import asyncio
+import logging
+
+from tortoise.transactions import in_transaction
+
+from common.settings import STATS_CONFIG
+from .flakiness import record_outcomes
+from .rollup import rollup_runs
+from .run_stats import record_runs
+
+logger = logging.getLogger(__name__)
+
+
+class StatsCollector:
+    """
+    执行统计采集，每个worker进程都运行，通过行锁跳过其他进程正在处理的记录
+    """
+
+    def __init__(self, task_type: str, task_model, suite_model, case_model):
+        """
+        :param task_type: 任务类型 ui_test/api_test
+        :param task_model: 计划执行记录模型
+        :param suite_model: 套件执行记录模型
+        :param case_model: 用例执行记录模型
+        """
+        self.task_type = task_type
+        # 各级执行记录：(执行记录类型, 模型, 统计对象字段, 执行完成的查询条件)
+        self.levels = (
+            ("task", task_model, "task_id", {"status": "执行完成"}),
+            ("suite", suite_model, "suite_id", {"status": "执行完成"}),
+            ("case", case_model, "case_id", {"status__not": "running"}),
+        )
+
+    async def _collect(self, kind: str, model, target: str, finished: dict) -> int:
+        """把一批执行完成的记录计入统计，返回处理的记录数"""
+        async with in_transaction():
+            records = await model.filter(stats_done=False, **finished).order_by('id') \
+                .limit(STATS_CONFIG.get('collect_batch_size', 200)).select_for_update(skip_locked=True) \
+                .only(*{'id', target, 'status', 'env_snapshot_id',
+                        *(('pass_rate', 'duration') if kind != "case" else ())})
+            if not records:
+                return 0
+            if kind == "case":
+                await record_runs(self.task_type, kind, [
+                    (record.case_id, record.id, record.status, 100 if record.status == "success" else 0, None)
+                    for record in records])
+                await record_outcomes(self.task_type, model, records)
+            else:
+                await record_runs(self.task_type, kind, [
+                    (getattr(record, target), record.id, record.status, record.pass_rate, record.duration)
+                    for record in records])
+                await rollup_runs(self.task_type, kind, model, [record.id for record in records])
+            await model.filter(id__in=[record.id for record in records]).update(stats_done=True)
+        return len(records)
+
+    async def collect_once(self) -> int:
+        """处理各级执行记录各一批，返回处理的记录数"""
+        collected = 0
+        for kind, model, target, finished in self.levels:
+            collected += await self._collect(kind, model, target, finished)
+        return collected
+
+    async def run(self):
+        """后台采集任务，在main.py的lifespan中启动"""
+        while True:
+            try:
+                # 有记录时立即处理下一批，积压处理完后按间隔轮询
+                if await self.collect_once():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{self.task_type} 执行统计采集异常: {str(e)}", exc_info=True)
+            await asyncio.sleep(STATS_CONFIG.get('collect_interval', 5))
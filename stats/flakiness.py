@@ -0,0 +1,77 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：flakiness
+@Time ：2025/10/18 20:30
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 不稳定用例识别：每个用例在每个执行环境下保存最近K次的执行结果，上报结果时增量更新切换次数、连续失败次数，
+            同一环境下成功、失败频繁切换的用例即为不稳定用例
+"""
+from typing import List
+
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+
+from common.settings import STATS_CONFIG
+from .models import CaseFlakiness
+
+# 参与统计的执行结果，跳过、未执行的用例不影响稳定性
+OUTCOMES = {"success": "P", "fail": "F", "error": "F"}
+# 更新的统计字段（bulk_update只更新列出的字段，update_time在apply_outcome中设置）
+STATE_FIELDS = ("outcomes", "runs", "flips", "failure_streak", "flaky_score", "last_status", "update_time")
+
+
+def apply_outcome(state: CaseFlakiness, status: str):
+    """把一次执行结果累加到用例的稳定性统计中"""
+    window = min(STATS_CONFIG.get('flaky_window', 20), 100)
+    outcome = OUTCOMES[status]
+    state.outcomes = (state.outcomes + outcome)[-window:]
+    state.runs += 1
+    state.flips = sum(1 for previous, current in zip(state.outcomes, state.outcomes[1:]) if previous != current)
+    state.failure_streak = state.failure_streak + 1 if outcome == "F" else 0
+    state.flaky_score = round(state.flips / (len(state.outcomes) - 1), 4) if len(state.outcomes) > 1 else 0
+    state.last_status = status
+    state.update_time = timezone.now()
+
+
+async def record_outcomes(task_type: str, case_model, records: List):
+    """
+    执行完成的用例计入稳定性统计，在统计采集的事务中调用：更新失败时异常向上抛出，
+    采集事务回滚，这批记录不会标记为已计入，下一轮重新计入
+    :param task_type: 任务类型 ui_test/api_test
+    :param case_model: 用例执行记录模型
+    :param records: 本批写入的用例执行记录
+    """
+    records = sorted((record for record in records if record.status in OUTCOMES), key=lambda record: record.id)
+    if not records:
+        return
+    async with in_transaction():
+        keys = {(record.case_id, record.env_snapshot_id or 0) for record in records}
+        existing = set(await CaseFlakiness.filter(task_type=task_type, case_id__in={key[0] for key in keys})
+                       .values_list('case_id', 'env_snapshot_id'))
+        missing = keys - existing
+        if missing:
+            # 先创建空的统计（INSERT IGNORE，并发创建同一用例的统计时只有一条生效），再和已有的统计一起加锁累加，
+            # 并发上报的结果不会丢失
+            missing_cases = {case_id for case_id, _ in missing}
+            projects = dict(await case_model.filter(id__in=[record.id for record in records
+                                                            if record.case_id in missing_cases])
+                            .values_list('case_id', 'case__project_id'))
+            await CaseFlakiness.bulk_create([
+                CaseFlakiness(task_type=task_type, case_id=case_id, project_id=projects.get(case_id, 0),
+                              env_snapshot_id=env_snapshot_id, outcomes="", runs=0, flips=0, failure_streak=0,
+                              flaky_score=0)
+                for case_id, env_snapshot_id in missing], ignore_conflicts=True)
+        # 锁定本批用例的统计，并发上报同一用例的结果时串行更新
+        states = {(state.case_id, state.env_snapshot_id): state for state in await CaseFlakiness.filter(
+            task_type=task_type, case_id__in={key[0] for key in keys}).select_for_update()}
+        changed = {}
+        for record in records:
+            key = (record.case_id, record.env_snapshot_id or 0)
+            if key in states:
+                apply_outcome(states[key], record.status)
+                changed[key] = states[key]
+        if changed:
+            await CaseFlakiness.bulk_update(list(changed.values()), fields=list(STATE_FIELDS))
@@ -0,0 +1,147 @@
+"""
+执行统计重建脚本
+表结构（run_stats、daily_rollup、case_flakiness表，执行记录的stats_done列）由 migrations/models 中的迁移创建：
+    aerich upgrade
+再执行本脚本，根据已有的执行记录重建统计数据（统计数据异常时也可以重新执行）：
+    python -m stats.migration run_stats     计划、套件、用例的运行统计
+    python -m stats.migration rollup        按天汇总的执行统计（历史数据回填）
+    python -m stats.migration flaky         用例稳定性统计（历史数据回填）
+回填期间执行完成的计划/套件可能重复计入或漏计，建议在没有执行任务、后台采集任务（stats.collector）已计入所有执行完成的记录时运行
+"""
+import asyncio
+import logging
+from tortoise import Tortoise
+from tortoise.functions import Count, Max
+from common.settings import TORTOISE_ORM
+
+# 每批写入的统计数
+BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+async def rebuild_stats(task_type: str, target_type: str, model, target: str, finished: dict):
+    """
+    重建一类统计对象的运行统计，只统计执行完成的运行，和执行完成时的实时更新保持一致
+    :param target: 执行记录中统计对象的字段，如 task_id
+    :param finished: 执行完成的查询条件
+    """
+    from stats.models import RunStats
+
+    groups = await model.filter(**finished).annotate(run_count=Count('id'), last_run_id=Max('id')) \
+        .group_by(target).values(target, 'run_count', 'last_run_id')
+    await RunStats.filter(task_type=task_type, target_type=target_type).delete()
+    for start in range(0, len(groups), BATCH_SIZE):
+        batch = groups[start:start + BATCH_SIZE]
+        fields = ['id', 'status'] + (['pass_rate', 'duration'] if target_type != 'case' else [])
+        latest = {row['id']: row for row in
+                  await model.filter(id__in=[group['last_run_id'] for group in batch]).values(*fields)}
+        stats = []
+        for group in batch:
+            run = latest.get(group['last_run_id'], {})
+            if target_type == 'case':
+                pass_rate, duration = (100 if run.get('status') == 'success' else 0), None
+            else:
+                pass_rate, duration = run.get('pass_rate'), run.get('duration')
+            stats.append(RunStats(task_type=task_type, target_type=target_type, target_id=group[target],
+                                  run_count=group['run_count'], last_run_id=group['last_run_id'],
+                                  last_status=run.get('status'), last_pass_rate=pass_rate, last_duration=duration))
+        await RunStats.bulk_create(stats)
+    logger.info(f"{task_type}:{target_type} 运行统计重建完成，共 {len(groups)} 条")
+
+
+async def rebuild_rollup(task_type: str, task_model, suite_model):
+    """按id分批扫描执行完成的计划、套件记录，重建一种任务类型的按天汇总统计"""
+    from stats.models import DailyRollup
+    from stats.rollup import accumulate, rollup_targets, run_values
+
+    rollups = {}
+    for kind, model in (('task', task_model), ('suite', suite_model)):
+        last_id = 0
+        while True:
+            runs = await run_values(kind, model.filter(status='执行完成', id__gt=last_id).order_by('id')
+                                    .limit(BATCH_SIZE))
+            if not runs:
+                break
+            last_id = runs[-1]['id']
+            for run in runs:
+                if not run['start_time']:
+                    continue
+                for target_type, target_id in rollup_targets(kind, run):
+                    key = (target_type, target_id, run['start_time'].date())
+                    rollups[key] = accumulate(rollups.get(key, {}), run)
+    await DailyRollup.filter(task_type=task_type).delete()
+    items = [DailyRollup(task_type=task_type, target_type=target_type, target_id=target_id, day=day, **values)
+             for (target_type, target_id, day), values in rollups.items()]
+    for start in range(0, len(items), BATCH_SIZE):
+        await DailyRollup.bulk_create(items[start:start + BATCH_SIZE])
+    logger.info(f"{task_type} 按天汇总统计重建完成，共 {len(items)} 条")
+
+
+async def rebuild_flakiness(task_type: str, case_model):
+    """按id顺序扫描用例执行记录，重建一种任务类型的用例稳定性统计"""
+    from stats.flakiness import OUTCOMES, apply_outcome
+    from stats.models import CaseFlakiness
+
+    states, last_id = {}, 0
+    while True:
+        rows = await case_model.filter(id__gt=last_id, status__in=list(OUTCOMES)).order_by('id').limit(BATCH_SIZE) \
+            .values('id', 'case_id', 'env_snapshot_id', 'status', project_id='case__project_id')
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        for row in rows:
+            key = (row['case_id'], row['env_snapshot_id'] or 0)
+            if key not in states:
+                states[key] = CaseFlakiness(task_type=task_type, case_id=row['case_id'], project_id=row['project_id'],
+                                            env_snapshot_id=key[1], outcomes="", runs=0, flips=0, failure_streak=0,
+                                            flaky_score=0)
+            apply_outcome(states[key], row['status'])
+    await CaseFlakiness.filter(task_type=task_type).delete()
+    items = list(states.values())
+    for start in range(0, len(items), BATCH_SIZE):
+        await CaseFlakiness.bulk_create(items[start:start + BATCH_SIZE])
+    logger.info(f"{task_type} 用例稳定性统计重建完成，共 {len(items)} 条")
+
+
+async def migrate_stats(command: str):
+    """执行统计重建"""
+
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        # 初始化数据库连接
+        await Tortoise.init(config=TORTOISE_ORM)
+
+        from uiTest.runner.models import TaskRunRecord, SuiteRunRecord, CaseRunRecord
+        from apiTest.apiRecordExecution.models import ApiTaskRunRecord, ApiSuiteRunRecord, ApiCaseRunRecord
+
+        logger.info("开始重建执行统计...")
+        for task_type, (task_model, suite_model, case_model) in (
+                ('ui_test', (TaskRunRecord, SuiteRunRecord, CaseRunRecord)),
+                ('api_test', (ApiTaskRunRecord, ApiSuiteRunRecord, ApiCaseRunRecord))):
+            if command == "rollup":
+                await rebuild_rollup(task_type, task_model, suite_model)
+                continue
+            if command == "flaky":
+                await rebuild_flakiness(task_type, case_model)
+                continue
+            await rebuild_stats(task_type, 'task', task_model, 'task_id', {'status': '执行完成'})
+            await rebuild_stats(task_type, 'suite', suite_model, 'suite_id', {'status': '执行完成'})
+            await rebuild_stats(task_type, 'case', case_model, 'case_id', {'status__not': 'running'})
+        logger.info("执行统计重建完成！")
+
+    except Exception as e:
+        logger.error(f"重建失败: {str(e)}")
+        raise
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] not in ("run_stats", "rollup", "flaky"):
+        print("用法: python -m stats.migration [run_stats|rollup|flaky]")
+    else:
+        asyncio.run(migrate_stats(sys.argv[1] if len(sys.argv) > 1 else "run_stats"))
@@ -0,0 +1,71 @@
+from tortoise import fields, models
+
+
+class RunStats(models.Model):
+    """计划、套件、用例的运行统计，执行完成时更新，列表接口直接查询，不再统计执行记录表"""
+    id = fields.BigIntField(pk=True, description="统计id")
+    task_type = fields.CharField(max_length=20, description="任务类型",
+                                 choices=[("ui_test", "UI测试"), ("api_test", "API测试")])
+    target_type = fields.CharField(max_length=20, description="统计对象类型",
+                                   choices=[("task", "计划"), ("suite", "套件"), ("case", "用例")])
+    target_id = fields.IntField(description="计划/套件/用例id")
+    run_count = fields.IntField(description="执行次数", default=0)
+    last_run_id = fields.IntField(description="最近一次执行记录id", default=0)
+    last_status = fields.CharField(max_length=20, description="最近一次执行状态", null=True)
+    last_pass_rate = fields.FloatField(description="最近一次执行通过率", null=True)
+    last_duration = fields.FloatField(description="最近一次执行时间", null=True)
+    update_time = fields.DatetimeField(auto_now=True, description="更新时间")
+
+    class Meta:
+        table = "run_stats"
+        table_description = "运行统计"
+        unique_together = (("task_type", "target_type", "target_id"),)
+
+
+class DailyRollup(models.Model):
+    """按天汇总的执行统计，计划/套件执行完成时累加，趋势图表直接查询，不再扫描执行记录表"""
+    id = fields.BigIntField(pk=True, description="统计id")
+    task_type = fields.CharField(max_length=20, description="任务类型",
+                                 choices=[("ui_test", "UI测试"), ("api_test", "API测试")])
+    target_type = fields.CharField(max_length=20, description="统计对象类型",
+                                   choices=[("project", "项目"), ("task", "计划"), ("suite", "套件")])
+    target_id = fields.IntField(description="项目/计划/套件id")
+    day = fields.DateField(description="日期（按开始执行时间）")
+    runs = fields.IntField(description="执行次数", default=0)
+    cases = fields.IntField(description="执行用例数", default=0)
+    success = fields.IntField(description="成功用例数", default=0)
+    fail = fields.IntField(description="失败用例数", default=0)
+    error = fields.IntField(description="错误用例数", default=0)
+    skip = fields.IntField(description="跳过用例数", default=0)
+    no_run = fields.IntField(description="未执行用例数", default=0)
+    duration_sum = fields.FloatField(description="执行时间合计", default=0)
+    duration_hist = fields.JSONField(description="执行时间分布（各区间的执行次数，区间见stats.rollup.DURATION_BUCKETS）",
+                                     default=list)
+
+    class Meta:
+        table = "daily_rollup"
+        table_description = "按天汇总的执行统计"
+        unique_together = (("task_type", "target_type", "target_id", "day"),)
+
+
+class CaseFlakiness(models.Model):
+    """用例在同一执行环境下的稳定性，每次上报执行结果时增量更新，不稳定用例排行直接查询"""
+    id = fields.BigIntField(pk=True, description="统计id")
+    task_type = fields.CharField(max_length=20, description="任务类型",
+                                 choices=[("ui_test", "UI测试"), ("api_test", "API测试")])
+    case_id = fields.IntField(description="用例id")
+    project_id = fields.IntField(description="项目id")
+    env_snapshot_id = fields.IntField(description="执行环境快照id，0表示没有快照的历史记录", default=0)
+    outcomes = fields.CharField(max_length=100, description="最近K次执行结果，P成功 F失败/错误，按时间顺序", default="")
+    runs = fields.IntField(description="参与统计的执行次数", default=0)
+    flips = fields.IntField(description="最近K次执行结果中成功、失败切换的次数", default=0)
+    failure_streak = fields.IntField(description="连续失败次数", default=0)
+    flaky_score = fields.FloatField(description="不稳定分数，切换次数/(最近执行次数-1)", default=0)
+    last_status = fields.CharField(max_length=20, description="最近一次执行状态", null=True)
+    update_time = fields.DatetimeField(auto_now=True, description="更新时间")
+
+    class Meta:
+        table = "case_flakiness"
+        table_description = "用例稳定性统计"
+        unique_together = (("task_type", "case_id", "env_snapshot_id"),)
+        indexes = (("task_type", "project_id", "flaky_score"),)
@@ -0,0 +1,128 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：rollup
+@Time ：2025/10/18 19:00
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 按天汇总的执行统计：计划/套件执行完成时累加到当天的项目、计划、套件汇总中，
+            执行时间按固定区间记录分布，P50/P95由分布估算，趋势查询只读取时间范围内的汇总数据
+"""
+import logging
+from bisect import bisect_left
+from typing import Iterable, List, Optional
+
+from tortoise.transactions import in_transaction
+
+from .models import DailyRollup
+
+logger = logging.getLogger(__name__)
+
+# 执行时间分布的区间上限（秒），最后一个区间为超过最大上限的执行
+DURATION_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
+# 用例状态计数字段，与执行记录表中的字段同名
+COUNT_FIELDS = ("success", "fail", "error", "skip", "no_run")
+# 汇总表中累加的字段
+ROLLUP_FIELDS = ("runs", "cases", *COUNT_FIELDS, "duration_sum", "duration_hist")
+
+
+def run_values(kind: str, query):
+    """
+    查询汇总需要的执行记录字段
+    :param kind: 执行记录类型 task/suite
+    :param query: 计划/套件执行记录的查询集
+    """
+    if kind == "task":
+        return query.values("id", "start_time", "duration", "run_all", *COUNT_FIELDS,
+                            target_id="task_id", project_id="project_id")
+    return query.values("id", "start_time", "duration", "run_all", "task_records_id", *COUNT_FIELDS,
+                        target_id="suite_id", project_id="suite__project_id")
+
+
+def rollup_targets(kind: str, run: dict):
+    """一次执行计入的汇总对象：计划/套件本身，以及项目（计划中的套件不重复计入项目）"""
+    yield kind, run["target_id"]
+    if kind == "task" or not run.get("task_records_id"):
+        yield "project", run["project_id"]
+
+
+def accumulate(values: dict, run: dict) -> dict:
+    """把一次执行累加到汇总数据中"""
+    values["runs"] = (values.get("runs") or 0) + 1
+    values["cases"] = (values.get("cases") or 0) + (run["run_all"] or 0)
+    for field in COUNT_FIELDS:
+        values[field] = (values.get(field) or 0) + (run[field] or 0)
+    duration = run["duration"] or 0
+    values["duration_sum"] = round((values.get("duration_sum") or 0) + duration, 2)
+    hist = list(values.get("duration_hist") or [])
+    hist += [0] * (len(DURATION_BUCKETS) + 1 - len(hist))
+    hist[bisect_left(DURATION_BUCKETS, duration)] += 1
+    values["duration_hist"] = hist
+    return values
+
+
+def percentile(hist: List[int], q: float) -> Optional[float]:
+    """根据执行时间分布估算分位数，区间内按线性分布插值，超过最大上限的区间返回最大上限"""
+    total = sum(hist)
+    if not total:
+        return None
+    rank, cumulative = q * total, 0
+    for index, count in enumerate(hist):
+        if count and cumulative + count >= rank:
+            lower = DURATION_BUCKETS[index - 1] if index else 0
+            if index >= len(DURATION_BUCKETS):
+                return float(lower)
+            return round(lower + (DURATION_BUCKETS[index] - lower) * (rank - cumulative) / count, 2)
+        cumulative += count
+    return float(DURATION_BUCKETS[-1])
+
+
+def summarize(rows: Iterable[dict]) -> dict:
+    """合并多天的汇总数据，计算通过率、平均执行时间和P50/P95"""
+    values = {field: 0 for field in ROLLUP_FIELDS}
+    hist = [0] * (len(DURATION_BUCKETS) + 1)
+    for row in rows:
+        for field in ROLLUP_FIELDS[:-1]:
+            values[field] += row[field] or 0
+        for index, count in enumerate(row["duration_hist"] or []):
+            hist[index] += count
+    values.pop("duration_hist")
+    values["duration_sum"] = round(values["duration_sum"], 2)
+    # 通过率按执行用例数计算（百分比），与执行记录保持一致
+    values["pass_rate"] = round(values["success"] / values["cases"] * 100, 2) if values["cases"] else 0
+    values["avg_duration"] = round(values["duration_sum"] / values["runs"], 2) if values["runs"] else 0
+    values["p50_duration"] = percentile(hist, 0.5)
+    values["p95_duration"] = percentile(hist, 0.95)
+    return values
+
+
+async def _add(task_type: str, target_type: str, target_id: int, run: dict):
+    """累加到一条汇总数据，同一天的并发更新通过行锁串行执行"""
+    keys = {"task_type": task_type, "target_type": target_type, "target_id": target_id,
+            "day": run["start_time"].date()}
+    rollup, _ = await DailyRollup.get_or_create(**keys)
+    async with in_transaction():
+        rollup = await DailyRollup.filter(id=rollup.id).select_for_update().first()
+        values = accumulate({field: getattr(rollup, field) for field in ROLLUP_FIELDS}, run)
+        await DailyRollup.filter(id=rollup.id).update(**values)
+
+
+async def rollup_runs(task_type: str, kind: str, model, record_ids: List[int]):
+    """
+    计划/套件执行完成后累加按天汇总的统计，更新失败不影响执行结果的写入，可以通过 python -m stats.migration rollup 重建
+    :param task_type: 任务类型 ui_test/api_test
+    :param kind: 执行记录类型 task/suite
+    :param model: 计划/套件执行记录模型
+    :param record_ids: 执行完成的执行记录id
+    """
+    if not record_ids:
+        return
+    try:
+        for run in await run_values(kind, model.filter(id__in=record_ids)):
+            if not run["start_time"]:
+                continue
+            for target_type, target_id in rollup_targets(kind, run):
+                await _add(task_type, target_type, target_id, run)
+    except Exception as e:
+        logger.error(f"按天汇总统计更新失败 {task_type}:{kind}: {str(e)}")
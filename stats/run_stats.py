@@ -0,0 +1,78 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：run_stats
+@Time ：2025/10/18 17:30
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 运行统计的更新和查询：用例、套件、计划执行完成后（stats.collector）累加执行次数并记录最近一次执行结果，
+            列表接口一次查询整页数据的统计
+"""
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+from tortoise import timezone
+from tortoise.functions import Max
+
+from .models import RunStats
+
+logger = logging.getLogger(__name__)
+
+# 执行次数累加；只有比当前记录更新的执行才覆盖最近一次执行结果（MySQL按顺序赋值，last_run_id需要最后更新）
+_UPSERT_SQL = (
+    "INSERT INTO run_stats (task_type, target_type, target_id, run_count, last_run_id, last_status, "
+    "last_pass_rate, last_duration, update_time) VALUES (%s, %s, %s, 1, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE run_count = run_count + 1, "
+    "last_status = IF(VALUES(last_run_id) >= last_run_id, VALUES(last_status), last_status), "
+    "last_pass_rate = IF(VALUES(last_run_id) >= last_run_id, VALUES(last_pass_rate), last_pass_rate), "
+    "last_duration = IF(VALUES(last_run_id) >= last_run_id, VALUES(last_duration), last_duration), "
+    "last_run_id = GREATEST(last_run_id, VALUES(last_run_id)), update_time = VALUES(update_time)"
+)
+
+
+async def record_runs(task_type: str, target_type: str, runs: List[Tuple]):
+    """
+    记录执行完成的运行，统计数据更新失败不影响执行结果的写入，可以通过 python -m stats.migration run_stats 重建
+    :param task_type: 任务类型 ui_test/api_test
+    :param target_type: 统计对象类型 task/suite/case
+    :param runs: [(计划/套件/用例id, 执行记录id, 执行状态, 通过率, 执行时间), ...]
+    """
+    if not runs:
+        return
+    now = timezone.now()
+    try:
+        await RunStats._meta.db.execute_many(_UPSERT_SQL, [[task_type, target_type, *run, now] for run in runs])
+    except Exception as e:
+        logger.error(f"运行统计更新失败 {task_type}:{target_type}: {str(e)}")
+
+
+async def load_run_stats(task_type: str, target_type: str, target_ids: Iterable[int],
+                         record_model=None) -> Dict[int, RunStats]:
+    """
+    一次查询多个计划/套件/用例的运行统计
+    :param record_model: 执行记录模型，传入时最近一次执行状态以最新的执行记录为准：
+                         执行中的记录、刚执行完成还未计入统计的记录不在运行统计中，列表需要显示其状态
+    :return: {计划/套件/用例id: 运行统计}，没有执行过的不在结果中
+    """
+    target_ids = list(target_ids)
+    if not target_ids:
+        return {}
+    stats = {item.target_id: item for item in await RunStats.filter(
+        task_type=task_type, target_type=target_type, target_id__in=target_ids)}
+    if record_model is None:
+        return stats
+    # 每个统计对象最新的执行记录id（只读索引），比统计中的最近一次执行更新时再查询其状态
+    target = f"{target_type}_id"
+    latest = await record_model.filter(**{f"{target}__in": target_ids}, hidden=False).group_by(target) \
+        .annotate(last_id=Max('id')).values_list(target, 'last_id')
+    newer = {last_id: target_id for target_id, last_id in latest
+             if target_id not in stats or last_id > stats[target_id].last_run_id}
+    if newer:
+        for record_id, record_status in await record_model.filter(id__in=list(newer)).values_list('id', 'status'):
+            target_id = newer[record_id]
+            item = stats.get(target_id) or RunStats(task_type=task_type, target_type=target_type,
+                                                   target_id=target_id, run_count=0, last_run_id=0)
+            item.last_status = record_status
+            stats[target_id] = item
+    return stats
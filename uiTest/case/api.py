@@ -3,10 +3,12 @@ import re
 
 from fastapi import APIRouter, HTTPException, Depends, status, Body
 from wealth.project.models import Project
+from stats.run_stats import load_run_stats
 from uiTest.runner.models import CaseRunRecord
 from auth.auth import is_authenticated
 from .schemas import CaseSchemas, AddCaseForm, UpdateCaseForm
 from .models import Case
+from dispatch.plan_cache import ui_plan_cache
 from zhipuai import ZhipuAI
 
 # 创建路由对象，并指定依赖项为is_authenticated的验证，确保用户已通过身份验证
@@ -38,6 +40,8 @@ async def update_case(case_id: int, item: UpdateCaseForm):
     # 更新用例信息
     await cases.update_from_dict(item.model_dump(exclude_unset=True))
     await cases.save()
+    # 使已缓存的执行计划失效
+    await ui_plan_cache.invalidate()
     return cases
 
 
@@ -50,6 +54,8 @@ async def delete_case(case_id: int):
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="用例不存在")
     # 删除用例
     await cases.delete()
+    # 使已缓存的执行计划失效
+    await ui_plan_cache.invalidate()
 
 
 # 获取单个用例详情的接口
@@ -86,13 +92,13 @@ async def get_case(project: int, page: int = 1, size: int = 10, search=None):
         query = query.filter(name__icontains=search)
     cases = await query.offset((page - 1) * size).limit(size).all()
     count = await query.count()
-    # 查询用例的执行记录次数
+    # 一次查询整页用例的执行次数、最近一次执行状态
+    run_stats = await load_run_stats('ui_test', 'case', [i.id for i in cases], CaseRunRecord)
     result = []
     for i in cases:
-        run_count = await CaseRunRecord.filter(case=i).count()
-        # 获取最近一次执行状态
-        run_record = await CaseRunRecord.filter(case=i).order_by("-id").first()
-        state = run_record.status if run_record else 'no_run'
+        stats = run_stats.get(i.id)
+        run_count = stats.run_count if stats else 0
+        state = stats.last_status if stats else 'no_run'
         result.append({
             "id": i.id,
             "name": i.name,
@@ -16,3 +16,5 @@ class Case(models.Model):
     class Meta:
         table = "case"
         table_description = "测试用例"
+        # 用例列表：按项目过滤，按创建时间降序分页
+        indexes = (("project_id", "create_time"),)
@@ -5,6 +5,7 @@ from .models import Cronjob
 from .schemas import CronjobForm, CronjobUpdateForm
 from wealth.project.models import Project
 from wealth.environment.models import Environment
+from wealth.environment.snapshot import snapshot_env
 from apscheduler.jobstores.redis import RedisJobStore
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.date import DateTrigger
@@ -15,8 +16,9 @@ from common import settings
 from auth.auth import is_authenticated
 from tortoise import transactions
 from uiTest.runner.models import TaskRunRecord, SuiteRunRecord, CaseRunRecord
-from uiTest.suite.models import Suite
-from common.mq_producer import MQProducer
+from uiTest.suite.models import Step
+from dispatch.outbox import outbox_message, enqueue_dispatch, outbox_relay
+from dispatch.plan_cache import ui_plan_cache
 from wealth.device.models import Device
 
 # 创建路由对象
@@ -38,6 +40,31 @@ local_timezone = pytz.timezone('Asia/Shanghai')
 scheduler = AsyncIOScheduler(jobstores=job_stores, job_defaults=job_defaults, timezone=local_timezone)
 
 
+async def load_suite_cases(suites: list) -> list:
+    """一次性查询所有套件中的用例，按执行顺序排列，返回 [(套件, [用例数据, ...]), ...]"""
+    suite_steps = {suite.id: [] for suite in suites}
+    for step in await Step.filter(suite_id__in=list(suite_steps)).order_by('sort').prefetch_related('cases'):
+        suite_steps[step.suite_id].append({
+            'id': step.cases.id,
+            'name': step.cases.name,
+            "skip": step.skip,
+            "steps": step.cases.steps,
+            "username": step.cases.username,
+        })
+    return [(suite, suite_steps[suite.id]) for suite in suites]
+
+
+async def compile_task_plan(task: Task) -> list:
+    """
+    展开计划中的套件和用例，缓存命中时不查询数据库
+    :param task: 测试计划
+    :return: [{"suite": 套件数据, "cases": [用例数据, ...]}, ...]
+    """
+    return await ui_plan_cache.compile_task_plan(
+        task, load_suite_cases, lambda suite: {'id': suite.id, 'name': suite.name, 'username': suite.username,
+                                               'setup_step': suite.suite_setup_step})
+
+
 async def run_task_async(task_id, env_id, cronjob_type):
     """
     异步提交任务到rabbitmq中
@@ -46,7 +73,7 @@ async def run_task_async(task_id, env_id, cronjob_type):
     :return:
     """
     # 获取测试套件数据
-    task = await Task.get_or_none(id=task_id).prefetch_related('suites', 'project')
+    task = await Task.get_or_none(id=task_id).prefetch_related('project')
     if not task:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="测试计划不存在！")
 
@@ -69,61 +96,58 @@ async def run_task_async(task_id, env_id, cronjob_type):
         "host": env.host,
         "global_variable": env.global_vars
     }
-
-    # 创建一条任务执行的记录
-    task_record = await TaskRunRecord.create(task=task, username=task.username, env=env_config, project=task.project)
-    task_count = 0
-    mq = MQProducer()
-
-    # 获取测试计划的套件数据
-    for suite in await task.suites.all():
-        cases = []
-        # 获取遍历出来套件中的用例数据
-        suite_ = await Suite.get_or_none(id=suite.id).prefetch_related('cases')
-        if not suite_:
-            continue
-
-        # 创建套件的运行记录
-        suite_record = await SuiteRunRecord.create(suite=suite_, username=suite_.username, env=env_config,
-                                                   task_records=task_record)
-
-        for i in await suite_.cases.all().order_by("sort"):
-            case_ = await i.cases
-            # 创建一条执行记录
-            case_record = await CaseRunRecord.create(case=case_, username=case_.username, suite_records=suite_record,
-                                                     env=env_config)
-            cases.append({
-                "record_id": case_record.id,
-                'id': case_.id,
-                'name': case_.name,
-                "skip": i.skip,
-                "steps": case_.steps
-            })
-
-        task_count += len(cases)
-        suite_record.all = len(cases)
-        await suite_record.save()
-
-        run_suite = {
-            'id': suite_.id,
-            'suite_record_id': suite_record.id,
-            'task_record_id': task_record.id,
-            'name': suite_.name,
-            "username": suite_.username,
-            # 测试套件的公共前置操作
-            'setup_step': suite_.suite_setup_step,
-            "cases": cases,
-            "cronjob_type": cronjob_type,
-        }
-
-        mq.send_test_task(env_config=env_config, run_case=run_suite, device_id=device_id)
-
-    # 关闭MQ连接
-    mq.close()
-
-    # 修改任务中的用例总数
-    task_record.all = task_count
-    await task_record.save()
+    # 执行环境按内容保存为快照，执行记录只引用快照id
+    env_snapshot_id = await snapshot_env(env_config)
+
+    # 执行记录和发件箱消息在同一个事务中写入
+    async with transactions.in_transaction():
+        # 创建一条任务执行的记录
+        task_record = await TaskRunRecord.create(task=task, username=task.username, env_snapshot_id=env_snapshot_id,
+                                                 project=task.project)
+        task_count = 0
+
+        # 展开计划中的套件和用例，计划没有变化时直接使用缓存
+        for item in await compile_task_plan(task):
+            suite_ = item['suite']
+            cases = []
+            # 创建套件的运行记录
+            suite_record = await SuiteRunRecord.create(suite_id=suite_['id'], username=suite_['username'],
+                                                       task_records=task_record, env_snapshot_id=env_snapshot_id,
+                                                       all=len(item['cases']))
+
+            for case_ in item['cases']:
+                # 创建一条执行记录
+                case_record = await CaseRunRecord.create(case_id=case_['id'], username=case_['username'],
+                                                         suite_records=suite_record, env_snapshot_id=env_snapshot_id)
+                cases.append({
+                    "record_id": case_record.id,
+                    'id': case_['id'],
+                    'name': case_['name'],
+                    "skip": case_['skip'],
+                    "steps": case_['steps']
+                })
+
+            task_count += len(cases)
+
+            run_suite = {
+                'id': suite_['id'],
+                'suite_record_id': suite_record.id,
+                'task_record_id': task_record.id,
+                'name': suite_['name'],
+                "username": suite_['username'],
+                # 测试套件的公共前置操作
+                'setup_step': suite_['setup_step'],
+                "cases": cases,
+                "cronjob_type": cronjob_type,
+            }
+
+            await enqueue_dispatch(outbox_message('ui_test', env_config=env_config, run_case=run_suite,
+                                                  device_id=device_id, entry='cron'))
+
+        # 修改任务中的用例总数
+        task_record.all = task_count
+        await task_record.save()
+    outbox_relay.wake()
 
     return {"msg": "定时任务已经提交到对应的设备，等待执行完毕！", "task_record_id": task_record.id}
 
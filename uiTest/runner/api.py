@@ -1,17 +1,56 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Header, status
 from wealth.device.models import Device
 from wealth.environment.models import Environment
-from .schemas import RunForm, SuiteResultSchemas, TaskResultSchemas
+from wealth.environment.snapshot import snapshot_env, hydrate_env
+from .schemas import RunForm, SuiteResultSchemas, TaskResultSchemas, CaseResultBatchForm, RecordCleanupForm
 from uiTest.suite.models import Suite
 from uiTest.case.models import Case
 from uiTest.task.models import Task
 from .models import TaskRunRecord, SuiteRunRecord, CaseRunRecord
-from common.mq_producer import MQProducer
+from dispatch.outbox import outbox_message, enqueue_dispatch, outbox_relay
+from dispatch.work_queue import WorkQueue
+from dispatch.results import ResultIngestor
+from archive.archiver import RecordArchiver, restore_archived
+from archive.deletion import RecordDeleter
+from archive.models import DeletionJob
+from stats.collector import StatsCollector
 from tortoise import transactions
 from auth.auth import is_authenticated
+from common.pagination import keyset_paginate, sparse_fields
+from common.detail_cache import cached_detail, cache_detail
 
 # 创建路由对象
 router = APIRouter(dependencies=[Depends(is_authenticated)])
+# UI计划的共享工作队列
+ui_work_queue = WorkQueue('ui_test', CaseRunRecord, pull_url="/run/task/record/{task_record_id}/next")
+# UI用例执行结果上报
+ui_results = ResultIngestor('ui_test', CaseRunRecord, SuiteRunRecord, TaskRunRecord)
+# UI执行记录归档
+ui_archiver = RecordArchiver('ui_test', TaskRunRecord, SuiteRunRecord, CaseRunRecord)
+# UI执行记录后台删除
+ui_deleter = RecordDeleter('ui_test', TaskRunRecord, SuiteRunRecord, CaseRunRecord)
+# UI执行统计采集
+ui_stats = StatsCollector('ui_test', TaskRunRecord, SuiteRunRecord, CaseRunRecord)
+# 运行记录列表默认返回的摘要字段 {返回字段名: 查询字段}，日志等大字段通过fields参数获取
+TASK_RECORD_FIELDS = {
+    "id": "id", "task_id": "task_id", "task_name": "task__name", "username": "username", "start_time": "start_time",
+    "duration": "duration", "status": "status", "run_all": "run_all", "success": "success", "fail": "fail",
+    "error": "error", "skip": "skip", "all": "all", "no_run": "no_run", "pass_rate": "pass_rate"
+}
+TASK_RECORD_HEAVY_FIELDS = {"env": "env", "task_log": "task_log"}
+# 套件运行记录列表的摘要字段
+SUITE_RECORD_FIELDS = {
+    "id": "id", "suite_id": "suite_id", "suite_name": "suite__name", "duration": "duration", "username": "username",
+    "start_time": "start_time", "status": "status", "run_all": "run_all", "success": "success", "fail": "fail",
+    "error": "error", "skip": "skip", "all": "all", "no_run": "no_run"
+}
+SUITE_RECORD_HEAVY_FIELDS = {"env": "env", "suite_log": "suite_log"}
+# 用例运行记录列表的摘要字段
+CASE_RECORD_FIELDS = {
+    "id": "id", "case_id": "case_id", "case_name": "case__name", "username": "username", "start_time": "start_time",
+    "status": "status"
+}
+CASE_RECORD_HEAVY_FIELDS = {"run_info": "run_info", "env": "env"}
 
 
 # 执行单条用例
@@ -35,8 +74,10 @@ async def run_case(case_id: int, item: RunForm):
             "host": env.host,
             "global_variable": env.global_vars
         }
+        # 执行环境按内容保存为快照，执行记录只引用快照id
+        env_snapshot_id = await snapshot_env(env_config)
         # 创建一条执行记录
-        case_record = await CaseRunRecord.create(case=case_, username=item.username, env=env_config)
+        case_record = await CaseRunRecord.create(case=case_, username=item.username, env_snapshot_id=env_snapshot_id)
         run_case = {
             'id': case_.id,
             'name': case_.name,
@@ -55,13 +96,16 @@ async def run_case(case_id: int, item: RunForm):
         }
         # 获取执行的设备ID
         device_id = item.device_id
-        # 判断设备的状态
-        device = await Device.get_or_none(id=device_id)
-        mq = MQProducer()
-        if device and device.status == "在线":
-            mq.send_test_task(env_config=env_config, run_case=run_case, device_id=device_id)
-            mq.close()
-        return {"msg": "用例执行任务已经提交到对应的设备，等待执行完毕！", "record_id": case_record.id}
+        # 判断设备的状态，设备不在线时消息暂存在发件箱，设备上线后自动下发
+        device = await Device.get_or_none(id=device_id) if device_id else None
+        deferred = not (device and device.status == "在线")
+        # 写入发件箱，事务提交后由后台中转发布到设备
+        await enqueue_dispatch(outbox_message('ui_test', env_config=env_config, run_case=run_case,
+                                              device_id=device_id or '', entry='case', deferred=deferred))
+    outbox_relay.wake()
+    if deferred:
+        return {"msg": "设备当前不在线，用例执行任务已进入等待队列，设备上线后自动执行！", "record_id": case_record.id, "deferred": True}
+    return {"msg": "用例执行任务已经提交到对应的设备，等待执行完毕！", "record_id": case_record.id}
 
 
 # 运行测试套件
@@ -85,15 +129,18 @@ async def run_suite(suite_id: int, item: RunForm):
             "host": env.host,
             "global_variable": env.global_vars
         }
+        # 执行环境按内容保存为快照，执行记录只引用快照id
+        env_snapshot_id = await snapshot_env(env_config)
         # 创建套件的运行记录
-        suite_record = await SuiteRunRecord.create(suite=suite_, username=item.username, env=env_config)
+        suite_record = await SuiteRunRecord.create(suite=suite_, username=item.username,
+                                                   env_snapshot_id=env_snapshot_id)
         # 获取测试套件的用例数据
         cases = []
         for i in await suite_.cases.all().order_by("sort"):
             case_ = await i.cases
             # 创建一条执行记录
             case_record = await CaseRunRecord.create(case=case_, username=item.username, suite_records=suite_record,
-                                                     env=env_config)
+                                                     env_snapshot_id=env_snapshot_id)
             cases.append({
                 "record_id": case_record.id,
                 'id': case_.id,
@@ -114,13 +161,16 @@ async def run_suite(suite_id: int, item: RunForm):
         }
         # 获取执行的设备ID
         device_id = item.device_id
-        # 判断设备的状态
-        device = await Device.get_or_none(id=device_id)
-        mq = MQProducer()
-        if device and device.status == "在线":
-            mq.send_test_task(env_config=env_config, run_case=run_suite, device_id=device_id)
-            mq.close()
-        return {"msg": "套件执行任务已经提交到对应的设备，等待执行完毕！", "suite_record_id": suite_record.id}
+        # 判断设备的状态，设备不在线时消息暂存在发件箱，设备上线后自动下发
+        device = await Device.get_or_none(id=device_id) if device_id else None
+        deferred = not (device and device.status == "在线")
+        # 写入发件箱，事务提交后由后台中转发布到设备
+        await enqueue_dispatch(outbox_message('ui_test', env_config=env_config, run_case=run_suite,
+                                              device_id=device_id or '', entry='suite', deferred=deferred))
+    outbox_relay.wake()
+    if deferred:
+        return {"msg": "设备当前不在线，套件执行任务已进入等待队列，设备上线后自动执行！", "suite_record_id": suite_record.id, "deferred": True}
+    return {"msg": "套件执行任务已经提交到对应的设备，等待执行完毕！", "suite_record_id": suite_record.id}
 
 
 # 运行测试计划
@@ -149,6 +199,8 @@ async def run_task(task_id: int, item: RunForm):
             "host": env.host,
             "global_variable": env.global_vars
         }
+        # 执行环境按内容保存为快照，执行记录只引用快照id
+        env_snapshot_id = await snapshot_env(env_config)
         # 获取设备列表
         device_ids = []
         if item.device_ids:
@@ -167,154 +219,117 @@ async def run_task(task_id: int, item: RunForm):
             raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="没有在线的设备可供执行任务！")
 
         # 创建一条任务执行的记录
-        task_record = await TaskRunRecord.create(task=task_, username=item.username, env=env_config,
+        task_record = await TaskRunRecord.create(task=task_, username=item.username, env_snapshot_id=env_snapshot_id,
                                                  project=task_.project)
         task_count = 0
-        mq = MQProducer()
-
+        suites_data = []
         # 获取测试计划的套件数据
-        suites = await task_.suites.all()
-        suite_case_counts = []
-
-        # 计算每个套件的用例数量
-        for suite in suites:
+        for suite in await task_.suites.all():
             suite_ = await Suite.get_or_none(id=suite.id).prefetch_related('cases')
-            case_count = await suite_.cases.all().count()
-            suite_case_counts.append((suite_, case_count))
-
-        # 根据设备数量分配套件
-        num_devices = len(online_device_ids)
-        suites_per_device = len(suites) // num_devices
-        remaining_suites = len(suites) % num_devices
-
-        # 分配套件给设备
-        device_assignments = {}
-        suite_index = 0
-        for i, device_id in enumerate(online_device_ids):
-            # 计算分配给当前设备的套件数量
-            num_suites_for_device = suites_per_device + (1 if i < remaining_suites else 0)
-
-            device_assignments[device_id] = []
-            for _ in range(num_suites_for_device):
-                if suite_index < len(suite_case_counts):
-                    device_assignments[device_id].append(suite_case_counts[suite_index])
-                    suite_index += 1
-
-        # 为每个设备创建任务并发送
-        for device_id, assigned_suites in device_assignments.items():
-            if not assigned_suites:
-                continue
-
-            # 为当前设备创建一个任务记录
-            device_task_count = 0
-            device_suites_data = []
-
-            for suite_, case_count in assigned_suites:
-                cases = []
-                # 创建套件的运行记录
-                suite_record = await SuiteRunRecord.create(suite=suite_, username=item.username, env=env_config,
-                                                           task_records=task_record)
-
-                # 获取套件中的用例数据
-                for i in await suite_.cases.all().order_by("sort"):
-                    case_ = await i.cases
-                    # 创建一条执行记录
-                    case_record = await CaseRunRecord.create(case=case_, username=item.username,
-                                                             suite_records=suite_record,
-                                                             env=env_config)
-                    cases.append({
-                        "record_id": case_record.id,
-                        'id': case_.id,
-                        'name': case_.name,
-                        "skip": i.skip,
-                        "steps": case_.steps
-                    })
-
-                device_task_count += len(cases)
-                suite_record.all = len(cases)
-                await suite_record.save()
-
-                suite_data = {
-                    'id': suite_.id,
-                    'suite_record_id': suite_record.id,
-                    'task_record_id': task_record.id,
-                    'name': suite_.name,
-                    "username": item.username,
-                    # 测试套件的公共前置操作
-                    'setup_step': suite_.suite_setup_step,
-                    "cases": cases
-                }
-                device_suites_data.append(suite_data)
-
-            # 发送任务到设备
-            if device_suites_data:
-                # 为每个套件分别发送任务
-                for suite_data in device_suites_data:
-                    mq.send_test_task(env_config=env_config, run_case=suite_data, device_id=device_id)
+            cases = []
+            # 创建套件的运行记录
+            suite_record = await SuiteRunRecord.create(suite=suite_, username=item.username, task_records=task_record,
+                                                       env_snapshot_id=env_snapshot_id)
+
+            # 获取套件中的用例数据
+            for i in await suite_.cases.all().order_by("sort"):
+                case_ = await i.cases
+                # 创建一条执行记录
+                case_record = await CaseRunRecord.create(case=case_, username=item.username,
+                                                         suite_records=suite_record,
+                                                         env_snapshot_id=env_snapshot_id)
+                cases.append({
+                    "record_id": case_record.id,
+                    'id': case_.id,
+                    'name': case_.name,
+                    "skip": i.skip,
+                    "steps": case_.steps
+                })
+
+            task_count += len(cases)
+            suite_record.all = len(cases)
+            await suite_record.save()
+
+            suites_data.append({
+                'id': suite_.id,
+                'suite_record_id': suite_record.id,
+                'task_record_id': task_record.id,
+                'name': suite_.name,
+                "username": item.username,
+                # 测试套件的公共前置操作
+                'setup_step': suite_.suite_setup_step,
+                "cases": cases
+            })
 
-            task_count += device_task_count
+        # 套件拆分为用例分片放入共享工作队列，每台设备先领取一个分片，执行完再领取下一个
+        seeds, pending = ui_work_queue.plan(task_record.id, suites_data, online_device_ids)
+        # 首个分片写入发件箱，事务提交后由后台中转发布到设备
+        await enqueue_dispatch(*[outbox_message('ui_test', env_config=env_config, run_case=chunk, device_id=device_id,
+                                                entry='plan') for device_id, chunk in seeds.items()])
 
-        mq.close()
         # 修改任务中的用例总数
         task_record.all = task_count
         await task_record.save()
+        # 在事务提交前写入工作队列，写入失败时执行记录和发件箱消息一起回滚，剩余的分片不会丢失
+        await ui_work_queue.start(task_record.id, env_config, seeds, pending)
+    outbox_relay.wake()
     return {"msg": f"计划执行任务已经提交到{len(online_device_ids)}个在线设备执行，等待执行完毕！",
             "task_record_id": task_record.id}
 
 
+# 执行器领取计划中的下一个用例分片
+@router.post("/task/record/{record_id}/next", tags=["测试运行"], summary="领取下一个用例分片",
+             status_code=status.HTTP_200_OK)
+async def next_task_chunk(record_id: int, device_id: str):
+    env_config, chunk = await ui_work_queue.next_chunk(record_id, device_id)
+    return {"env_config": env_config, "run_suite": chunk}
+
+
+# 执行器批量上报用例执行结果
+@router.post("/results", tags=["测试运行"], summary="批量上报用例执行结果", status_code=status.HTTP_200_OK)
+async def report_results(item: CaseResultBatchForm):
+    return await ui_results.ingest([result.model_dump() for result in item.results])
+
+
 # 获取测试计划的运行记录
 @router.get("/task/record", tags=["测试运行"], summary="任务运行记录", status_code=status.HTTP_200_OK)
-async def get_task_record(project_id: int, task_id: int = None, page: int = 1, size: int = 10):
+async def get_task_record(project_id: int, task_id: int = None, page: int = 1, size: int = 10,
+                          cursor: int = None, with_total: bool = False, fields: str = None):
     # 获取测试计划的运行记录
-    query = TaskRunRecord.filter(project=project_id)
+    query = TaskRunRecord.filter(project=project_id, hidden=False)
     # 判断是否传了任务id
     if task_id:
         query = query.filter(task=task_id)
-    # 根据id降序排序
-    query = query.order_by("-id")
-    # 获取任务执行的记录总数
-    total = await query.count()
-    # 分页获取数据
-    data = await query.offset((page - 1) * size).limit(size).prefetch_related('task')
-    result = []
-    for i in data:
-        result.append({
-            "id": i.id,
-            "task_id": i.task.id,
-            "task_name": i.task.name,
-            "username": i.username,
-            "start_time": i.start_time,
-            "duration": i.duration,
-            "status": i.status,
-            "run_all": i.run_all,
-            "success": i.success,
-            "fail": i.fail,
-            "error": i.error,
-            "skip": i.skip,
-            "all": i.all,
-            "no_run": i.no_run,
-            "env": i.env,
-            "pass_rate": i.pass_rate,
-            "task_log": i.task_log
-        })
-    return {"total": total, "data": result}
+    # 按id降序游标分页，翻页时传入上一页返回的next_cursor；默认不统计总数（total为null），
+    # 需要时传with_total=true，总数在Redis中短时间缓存
+    # 默认只查询摘要字段，日志等大字段通过fields参数获取（如 fields=env,task_log）
+    values = sparse_fields(TASK_RECORD_FIELDS, TASK_RECORD_HEAVY_FIELDS, fields)
+    data, next_cursor, total = await keyset_paginate(query, size, cursor=cursor, page=page, with_total=with_total,
+                                                     count_key=f"ui_task_record:{project_id}:{task_id}",
+                                                     values=values)
+    # 已归档的记录从归档文件回填大字段
+    await restore_archived(data, TaskRunRecord)
+    # 从执行环境快照回填env
+    await hydrate_env(data)
+    return {"total": total, "data": data, "next_cursor": next_cursor}
 
 
 # 删除测试计划的运行记录
 @router.delete('/task/record/{record_id}', tags=['测试运行'], summary='删除任务运行记录',
                status_code=status.HTTP_204_NO_CONTENT)
 async def delete_task_record(record_id: int):
-    record = await TaskRunRecord.get_or_none(id=record_id)
-    if not record:
+    if not await TaskRunRecord.filter(id=record_id, hidden=False).exists():
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="任务运行记录不存在")
-    await record.delete()
+    # 记录立即隐藏，下级的套件、用例记录由后台任务分批删除
+    await ui_deleter.delete_record('task', record_id)
 
 
 # 获取测试套件的运行记录
 @router.get("/suite/record", tags=["测试运行"], summary="套件运行记录", status_code=status.HTTP_200_OK)
-async def get_suite_record(suite_id: int = None, task_records_id: int = None, page: int = 1, size: int = 10):
+async def get_suite_record(suite_id: int = None, task_records_id: int = None, page: int = 1, size: int = 10,
+                           cursor: int = None, with_total: bool = False, fields: str = None):
     # 获取测试套件的运行记录
-    query = SuiteRunRecord.all()
+    query = SuiteRunRecord.filter(hidden=False)
     # 判断是否传了套件id
     if suite_id:
         query = query.filter(suite=suite_id)
@@ -323,50 +338,36 @@ async def get_suite_record(suite_id: int = None, task_records_id: int = None, pa
     else:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                             detail="suite_id和task_records_id至少传递一个")
-    # 根据id降序排序
-    query = query.order_by("-id")
-    # 获取套件执行的记录总数
-    total = await query.count()
-    # 分页获取数据
-    data = await query.offset((page - 1) * size).limit(size).prefetch_related('suite')
-    result = []
-    for i in data:
-        result.append({
-            "id": i.id,
-            "suite_id": i.suite.id,
-            "suite_name": i.suite.name,
-            "duration": i.duration,
-            "username": i.username,
-            "start_time": i.start_time,
-            "status": i.status,
-            "run_all": i.run_all,
-            "success": i.success,
-            "fail": i.fail,
-            "error": i.error,
-            "skip": i.skip,
-            "all": i.all,
-            "no_run": i.no_run,
-            "env": i.env,
-            "suite_log": i.suite_log
-        })
-    return {"total": total, "data": result}
+    # 按id降序游标分页，翻页时传入上一页返回的next_cursor；默认不统计总数（total为null），
+    # 需要时传with_total=true，总数在Redis中短时间缓存
+    # 默认只查询摘要字段，日志等大字段通过fields参数获取（如 fields=env,suite_log）
+    values = sparse_fields(SUITE_RECORD_FIELDS, SUITE_RECORD_HEAVY_FIELDS, fields)
+    data, next_cursor, total = await keyset_paginate(query, size, cursor=cursor, page=page, with_total=with_total,
+                                                     count_key=f"ui_suite_record:{suite_id}:{task_records_id}",
+                                                     values=values)
+    # 已归档的记录从归档文件回填大字段
+    await restore_archived(data, SuiteRunRecord)
+    # 从执行环境快照回填env
+    await hydrate_env(data)
+    return {"total": total, "data": data, "next_cursor": next_cursor}
 
 
 # 删除测试套件的运行记录
 @router.delete('/suite/record/{record_id}', tags=['测试运行'], summary='删除套件运行记录',
                status_code=status.HTTP_204_NO_CONTENT)
 async def delete_suite_record(record_id: int):
-    record = await SuiteRunRecord.get_or_none(id=record_id)
-    if not record:
+    if not await SuiteRunRecord.filter(id=record_id, hidden=False).exists():
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="套件运行记录不存在")
-    await record.delete()
+    # 记录立即隐藏，下级的用例记录由后台任务分批删除
+    await ui_deleter.delete_record('suite', record_id)
 
 
 # 获取测试用例的运行记录
 @router.get("/case/record", tags=["测试运行"], summary="用例运行记录", status_code=status.HTTP_200_OK)
-async def get_case_record(case_id: int = None, suite_records_id: int = None, page: int = 1, size: int = 10):
+async def get_case_record(case_id: int = None, suite_records_id: int = None, page: int = 1, size: int = 10,
+                          cursor: int = None, with_total: bool = False, fields: str = None):
     # 获取测试用例的运行记录
-    query = CaseRunRecord.all().prefetch_related('case')
+    query = CaseRunRecord.filter(hidden=False)
     # 判断是否传了套件id
     if case_id:
         query = query.filter(case=case_id)
@@ -375,69 +376,103 @@ async def get_case_record(case_id: int = None, suite_records_id: int = None, pag
     else:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                             detail="case_id和suite_records_id至少传递一个！")
-    # 根据id降序排序
-    query = query.order_by("-id")
-    # 获取套件执行的记录总数
-    total = await query.count()
-    # 分页获取数据
-    data = await query.offset((page - 1) * size).limit(size).prefetch_related('case')
-    result = []
-    for i in data:
-        result.append({
-            "id": i.id,
-            "case_id": i.case.id,
-            "case_name": i.case.name,
-            "username": i.username,
-            "start_time": i.start_time,
-            "status": i.status,
-            "run_info": i.run_info,
-            "env": i.env,
-        })
-    return {"total": total, "data": result}
+    # 按id降序游标分页，翻页时传入上一页返回的next_cursor；默认不统计总数（total为null），
+    # 需要时传with_total=true，总数在Redis中短时间缓存
+    # 默认只查询摘要字段，日志等大字段通过fields参数获取（如 fields=env,run_info）
+    values = sparse_fields(CASE_RECORD_FIELDS, CASE_RECORD_HEAVY_FIELDS, fields)
+    data, next_cursor, total = await keyset_paginate(query, size, cursor=cursor, page=page, with_total=with_total,
+                                                     count_key=f"ui_case_record:{case_id}:{suite_records_id}",
+                                                     values=values)
+    # 已归档的记录从归档文件回填大字段
+    await restore_archived(data, CaseRunRecord)
+    # 从执行环境快照回填env
+    await hydrate_env(data)
+    return {"total": total, "data": data, "next_cursor": next_cursor}
 
 
 # 删除测试用例的运行记录
 @router.delete('/case/record/{record_id}', tags=['测试运行'], summary='删除用例运行记录',
                status_code=status.HTTP_204_NO_CONTENT)
 async def delete_case_record(record_id: int):
-    record = await CaseRunRecord.get_or_none(id=record_id)
+    record = await CaseRunRecord.get_or_none(id=record_id, hidden=False)
     if not record:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="用例运行记录不存在")
     await record.delete()
 
 
+# 删除项目中早于指定时间的运行记录
+@router.post('/record/cleanup', tags=['测试运行'], summary='批量删除历史运行记录', status_code=status.HTTP_202_ACCEPTED)
+async def cleanup_records(item: RecordCleanupForm):
+    # 创建后台删除任务，通过返回的任务id查询删除进度
+    job = await ui_deleter.delete_before(item.project_id, item.before, item.username)
+    return {"job_id": job.id}
+
+
+# 查询运行记录删除任务的进度
+@router.get('/record/cleanup/{job_id}', tags=['测试运行'], summary='运行记录删除进度', status_code=status.HTTP_200_OK)
+async def get_cleanup_progress(job_id: int):
+    job = await DeletionJob.get_or_none(id=job_id, task_type='ui_test')
+    if not job:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="删除任务不存在")
+    progress = min(round(job.deleted / job.total * 100, 2), 100) if job.total else (100 if job.status == "done" else 0)
+    return {"id": job.id, "scope": job.scope, "target_id": job.target_id, "before": job.before, "status": job.status,
+            "total": job.total, "deleted": job.deleted, "progress": progress, "last_error": job.last_error,
+            "create_time": job.create_time, "finish_time": job.finish_time}
+
+
 # 获取单个测试用例执行结果详情
 @router.get("/case/record/{record_id}", tags=["测试结果"], summary="用例的执行详情", status_code=status.HTTP_200_OK)
-async def get_case_record_detail(record_id: int):
+async def get_case_record_detail(record_id: int, if_none_match: str = Header(None)):
+    # 执行完成的详情不再变化，ETag一致时返回304，有缓存时直接返回缓存
+    cached = await cached_detail(CaseRunRecord, "ui:case", record_id, if_none_match)
+    if cached:
+        return cached
     # 获取测试用例的运行记录
-    record = await CaseRunRecord.get_or_none(id=record_id)
+    record = await CaseRunRecord.get_or_none(id=record_id, hidden=False)
     if not record:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="测试用例执行记录不存在！")
+    # 已归档的记录从归档文件回填大字段
+    await restore_archived([record], CaseRunRecord)
+    await hydrate_env([record])
     # 获取测试用例的运行记录
-    return record
+    return await cache_detail("ui:case", record, record)
 
 
 # 获取单个测试套件执行结果详情
 @router.get("/suite/record/{record_id}", tags=["测试结果"], summary="套件的执行详情", status_code=status.HTTP_200_OK,
             response_model=SuiteResultSchemas)
-async def get_suite_record_detail(record_id: int):
+async def get_suite_record_detail(record_id: int, if_none_match: str = Header(None)):
+    # 执行完成的详情不再变化，ETag一致时返回304，有缓存时直接返回缓存
+    cached = await cached_detail(SuiteRunRecord, "ui:suite", record_id, if_none_match)
+    if cached:
+        return cached
     # 获取测试套件的运行记录
-    record = await SuiteRunRecord.get_or_none(id=record_id).prefetch_related('suite')
+    record = await SuiteRunRecord.get_or_none(id=record_id, hidden=False).prefetch_related('suite')
     if not record:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="测试套件执行记录不存在！")
+    # 已归档的记录从归档文件回填大字段
+    await restore_archived([record], SuiteRunRecord)
+    await hydrate_env([record])
     result = SuiteResultSchemas(**record.__dict__, suite_name=record.suite.name)
     # 获取测试套件的运行记录
-    return result
+    return await cache_detail("ui:suite", record, result)
 
 
 # 获取单个测试计划执行结果详情
 @router.get("/task/record/{record_id}", tags=["测试结果"], summary="任务的执行详情", status_code=status.HTTP_200_OK,
             response_model=TaskResultSchemas)
-async def get_task_record_detail(record_id: int):
+async def get_task_record_detail(record_id: int, if_none_match: str = Header(None)):
+    # 执行完成的详情不再变化，ETag一致时返回304，有缓存时直接返回缓存
+    cached = await cached_detail(TaskRunRecord, "ui:task", record_id, if_none_match)
+    if cached:
+        return cached
     # 获取测试套件的运行记录
-    record = await TaskRunRecord.get_or_none(id=record_id).prefetch_related('task')
+    record = await TaskRunRecord.get_or_none(id=record_id, hidden=False).prefetch_related('task')
     if not record:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="测试计划执行记录不存在！")
+    # 已归档的记录从归档文件回填大字段
+    await restore_archived([record], TaskRunRecord)
+    await hydrate_env([record])
     # 获取测试套件的运行记录
     result = TaskResultSchemas(**record.__dict__, task_name=record.task.name)
-    return result
+    return await cache_detail("ui:task", record, result)
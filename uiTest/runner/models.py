@@ -1,12 +1,20 @@
 from tortoise import fields, models
 
+from common.fields import CompressedJSONField
+
 
 class TaskRunRecord(models.Model):
     """测试计划运行记录表"""
     id = fields.IntField(pk=True, description="套件记录id", max_length=1000)
     project = fields.ForeignKeyField("models.Project", related_name="task_records", description="所属项目")
     task = fields.ForeignKeyField("models.Task", related_name="task_records", description="执行的任务")
-    env = fields.JSONField(description="执行环境", default=dict)
+    env = CompressedJSONField(description="执行环境（历史记录，新记录使用env_snapshot）", default=dict, null=True, blank=True)
+    env_snapshot = fields.ForeignKeyField("models.EnvSnapshot", related_name=False, null=True, default=None,
+                                          description="执行环境快照")
+    archive = fields.CharField(max_length=255, null=True, default=None,
+                               description="归档位置，不为空时执行详情、日志等大字段已迁移到归档文件")
+    hidden = fields.BooleanField(default=False, description="是否已删除（等待后台任务删除，不再返回给前端）")
+    stats_done = fields.BooleanField(default=False, description="是否已计入执行统计（执行完成后由后台任务计入）")
     start_time = fields.DatetimeField(auto_now_add=True, description="开始执行时间")
     duration = fields.FloatField(description="执行时间", default=0)
     status = fields.CharField(max_length=255, description="运行状态",
@@ -17,7 +25,7 @@ class TaskRunRecord(models.Model):
     no_run = fields.IntField(description="未执行用例数", default=0)
     success = fields.IntField(description="成功用例数", default=0)
     pass_rate = fields.FloatField(description="通过率", default=0)
-    task_log = fields.JSONField(description="任务执行日志", default=list)
+    task_log = CompressedJSONField(description="任务执行日志", default=list)
     fail = fields.IntField(description="失败用例数", default=0)
     error = fields.IntField(description="错误用例数", default=0)
     skip = fields.IntField(description="跳过用例数", default=0)
@@ -26,6 +34,8 @@ class TaskRunRecord(models.Model):
     class Meta:
         table = "task_record"
         table_description = "测试计划运行记录"
+        # 运行记录列表：按项目/计划过滤未删除的记录，按id降序分页；执行统计采集：按stats_done查询未计入统计的记录
+        indexes = (("project_id", "hidden", "id"), ("task_id", "hidden", "id"), ("stats_done", "id"))
 
 
 class SuiteRunRecord(models.Model):
@@ -46,14 +56,21 @@ class SuiteRunRecord(models.Model):
     skip = fields.IntField(description="跳过用例数", default=0)
     start_time = fields.DatetimeField(auto_now_add=True, description="开始执行时间")
     duration = fields.FloatField(description="执行时间", default=0)
-    suite_log = fields.JSONField(description="套件执行日志", default=list)
+    suite_log = CompressedJSONField(description="套件执行日志", default=list)
     pass_rate = fields.FloatField(description="通过率", default=0)
-    env = fields.JSONField(description="执行环境", default=dict, null=True, blank=True)
+    env = CompressedJSONField(description="执行环境（历史记录，新记录使用env_snapshot）", default=dict, null=True, blank=True)
+    env_snapshot = fields.ForeignKeyField("models.EnvSnapshot", related_name=False, null=True, default=None,
+                                          description="执行环境快照")
+    archive = fields.CharField(max_length=255, null=True, default=None,
+                               description="归档位置，不为空时执行详情、日志等大字段已迁移到归档文件")
+    hidden = fields.BooleanField(default=False, description="是否已删除（等待后台任务删除，不再返回给前端）")
+    stats_done = fields.BooleanField(default=False, description="是否已计入执行统计（执行完成后由后台任务计入）")
     username = fields.CharField(max_length=50, description="创建人")
 
     class Meta:
         table = "suite_record"
         table_description = "测试套件运行记录"
+        indexes = (("task_records_id", "hidden", "id"), ("suite_id", "hidden", "id"), ("stats_done", "id"))
 
 
 class CaseRunRecord(models.Model):
@@ -66,11 +83,18 @@ class CaseRunRecord(models.Model):
                               choices=[("success", "执行成功"), ("fail", "执行失败"),
                                        ("error", "执行错误"), ("skip", "跳过执行"), ("no_run", "未执行"),
                                        ("running", "执行中")], default="running")
-    run_info = fields.JSONField(description="用例执行详情", default=dict)
+    run_info = CompressedJSONField(description="用例执行详情", default=dict)
     start_time = fields.DatetimeField(auto_now_add=True, description="开始执行时间")
-    env = fields.JSONField(description="执行环境", default=dict)
+    env = CompressedJSONField(description="执行环境（历史记录，新记录使用env_snapshot）", default=dict, null=True, blank=True)
+    env_snapshot = fields.ForeignKeyField("models.EnvSnapshot", related_name=False, null=True, default=None,
+                                          description="执行环境快照")
+    archive = fields.CharField(max_length=255, null=True, default=None,
+                               description="归档位置，不为空时执行详情、日志等大字段已迁移到归档文件")
+    hidden = fields.BooleanField(default=False, description="是否已删除（等待后台任务删除，不再返回给前端）")
+    stats_done = fields.BooleanField(default=False, description="是否已计入执行统计（执行完成后由后台任务计入）")
     username = fields.CharField(max_length=50, description="创建人")
 
     class Meta:
         table = "case_record"
         table_description = "测试用例运行记录"
+        indexes = (("case_id", "hidden", "id"), ("suite_records_id", "hidden", "id"), ("stats_done", "id"))
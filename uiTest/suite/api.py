@@ -2,12 +2,14 @@ from typing import List
 from fastapi import APIRouter, HTTPException, Depends, status
 from wealth.project.models import Project
 from wealth.module.models import Module
+from stats.run_stats import load_run_stats
 from uiTest.runner.models import SuiteRunRecord
 from auth.auth import is_authenticated
 from .schemas import AddSuiteForm, SuiteSchemas, UpdateSuiteForm, AddStepForm, StepSchemas, StepListSchemas, \
     UpdateCaseSortForm
 from .models import Suite, Step
 from uiTest.case.models import Case
+from dispatch.plan_cache import ui_plan_cache
 
 # 创建路由对象
 router = APIRouter(dependencies=[Depends(is_authenticated)])
@@ -43,14 +45,15 @@ async def get_suite(project: int | None = None, modules: int | None = None, page
     if search:
         query = query.filter(name__icontains=search)
     # 进行分页
-    api_suites = await query.offset((page - 1) * size).limit(size).prefetch_related("cases")
+    api_suites = await query.offset((page - 1) * size).limit(size).prefetch_related("cases", "modules")
     total = await query.count()
+    # 一次查询整页套件的执行次数、最近一次执行状态
+    run_stats = await load_run_stats('ui_test', 'suite', [suite.id for suite in api_suites], SuiteRunRecord)
     result = []
     for suite in api_suites:
-        module = await suite.modules
-        # 获取最近一次执行状态
-        run_record = await SuiteRunRecord.filter(suite=suite.id).order_by("-id").first()
-        status = run_record.status if run_record else '等待执行'
+        module = suite.modules
+        stats = run_stats.get(suite.id)
+        status = stats.last_status if stats else '等待执行'
         # 获取套件下的用例
         result.append({
             "create_time": suite.create_time,
@@ -63,7 +66,7 @@ async def get_suite(project: int | None = None, modules: int | None = None, page
             "case_count": len(suite.cases),
             "suite_step_count": len(suite.suite_setup_step),
             "module": module.name if module else "",
-            "run_count": await SuiteRunRecord.filter(suite=suite.id).count()
+            "run_count": stats.run_count if stats else 0
         })
     return {"data": result, "total": total}
 
@@ -87,6 +90,8 @@ async def delete_suite(suite_id: int):
     if not suite:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="套件不存在")
     await suite.delete()
+    # 使已缓存的执行计划失效
+    await ui_plan_cache.invalidate()
 
 
 # 更新套件信息
@@ -104,6 +109,8 @@ async def update_suite(suite_id: int, item: UpdateSuiteForm):
     # 修改套件的信息
     await suite.update_from_dict(item.dict(exclude_unset=True))
     await suite.save()
+    # 使已缓存的执行计划失效
+    await ui_plan_cache.invalidate()
     return suite
 
 
@@ -121,6 +128,8 @@ async def add_step(suite_id: int, item: AddStepForm):
     # sort = await Step.filter(suite=suite).count()
     # 往测试套件中添加用例
     suite = await Step.create(suite=suite, cases=case_, sort=item.sort)
+    # 使已缓存的执行计划失效
+    await ui_plan_cache.invalidate()
     return suite
 
 
@@ -133,6 +142,8 @@ async def delete_step(case_id: int, suite_id: int):
     if not step:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="操作的套件用例不存在")
     await step.delete()
+    # 使已缓存的执行计划失效
+    await ui_plan_cache.invalidate()
 
 
 # 获取套件中的所有用例
@@ -167,6 +178,8 @@ async def update_step(case_id: int, suite_id: int):
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="操作的套件用例不存在")
     step.skip = not step.skip
     await step.save()
+    # 使已缓存的执行计划失效
+    await ui_plan_cache.invalidate()
     return step
 
 
@@ -179,4 +192,6 @@ async def update_sort(suite_id: int, item: List[UpdateCaseSortForm]):
         step = await Step.get(id=i.id, suite_id=suite_id)
         step.sort = i.sort
         await step.save()
+    # 使已缓存的执行计划失效
+    await ui_plan_cache.invalidate()
     return await Step.filter(suite_id=suite_id).order_by('sort')
@@ -1,10 +1,12 @@
 from fastapi import APIRouter, HTTPException, Depends, status
 from wealth.project.models import Project
+from stats.run_stats import load_run_stats
 from uiTest.runner.models import TaskRunRecord
 from uiTest.suite.models import Suite
 from .schemas import AddTaskForm, TaskSchemas, UpdateTaskForm, AddSuiteToTaskForm, TaskDetailSchemas
 from .models import Task
 from auth.auth import is_authenticated
+from dispatch.plan_cache import ui_plan_cache
 
 router = APIRouter(tags=['测试计划'], dependencies=[Depends(is_authenticated)])
 
@@ -47,12 +49,12 @@ async def get_task(page: int = 1, size: int = 10, search=None, task_type: int =
     else:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="传入的任务类型错误")
 
+    # 一次查询整页任务的运行统计
+    run_stats = await load_run_stats('ui_test', 'task', [task.id for task in paginated_tasks], TaskRunRecord)
     result = []
     # 处理所有任务
     for task in paginated_tasks:
-        # 更准确的任务类型判断
-        run_record = await TaskRunRecord.filter(task=task.id).order_by("-id").first()
-        run_count = await TaskRunRecord.filter(task=task.id).count()
+        stats = run_stats.get(task.id)
 
         # 获取套件数量
         suites_count = len(task.suites) if hasattr(task, 'suites') and task.suites else 0
@@ -61,12 +63,12 @@ async def get_task(page: int = 1, size: int = 10, search=None, task_type: int =
             "id": task.id,
             "name": task.name,
             "username": task.username,
-            "status": run_record.status if run_record else '等待执行',
+            "status": stats.last_status if stats else '等待执行',
             "task_type": task.task_type,
             "create_time": task.create_time,
             "update_time": task.update_time,
             "suites_count": suites_count,
-            "run_count": run_count
+            "run_count": stats.run_count if stats else 0
         })
 
     return {
@@ -125,6 +127,8 @@ async def add_step(task_id: int, item: AddSuiteToTaskForm):
 
         # 往多对多的关联字段中添加数据
         await task.suites.add(suite)
+        # 使已缓存的执行计划失效
+        await ui_plan_cache.invalidate()
         return task
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
@@ -147,6 +151,8 @@ async def delete_step(task_id: int, suite_id: int, task_type: int = None):
 
         # 往多对多的关联字段中添加数据
         await task.suites.remove(suite)
+        # 使已缓存的执行计划失效
+        await ui_plan_cache.invalidate()
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
 
@@ -6,9 +6,11 @@ from auth.auth import is_authenticated
 from .schemas import DeviceSchemas
 from .models import Device
 from common import settings
-from redis.asyncio import Redis
 import json
-from common.mq_producer import MQProducer
+from common.mq_producer import mq_producer
+from dispatch.outbox import release_deferred
+from .heartbeat import record_heartbeat, forget_heartbeat
+from .hub import device_hub, DeviceViewer, ScreenFrame
 
 # 创建路由对象
 router = APIRouter(tags=["设备管理"])
@@ -21,6 +23,8 @@ async def register_device(item: DeviceSchemas):
     if device:
         device.status = "在线"
         await device.save()
+        # 下发设备离线期间暂存的任务
+        await release_deferred(device.id)
         return device
     try:
         device = await Device.create(**item.model_dump())
@@ -29,6 +33,15 @@ async def register_device(item: DeviceSchemas):
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
 
 
+# 设备上报心跳
+@router.post("/device/{device_id}/heartbeat", summary="设备上报心跳", status_code=status.HTTP_200_OK)
+async def report_heartbeat(device_id: str):
+    if not await record_heartbeat(device_id):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="设备不存在，请先注册设备")
+    # 返回心跳上报间隔，由服务端统一调整
+    return {"interval": settings.HEARTBEAT_CONFIG.get('report_interval', 5)}
+
+
 # 获取设备列表
 @router.get("/device", summary="设备列表", status_code=status.HTTP_200_OK)
 async def get_device_list(status: str = None, user_info: dict = Depends(is_authenticated)):
@@ -55,41 +68,73 @@ async def delete_device(device_id: str, user_info: dict = Depends(is_authenticat
     device = await Device.get_or_none(id=device_id)
     if not device:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="设备不存在")
-    # 创建MQ生产者实例
-    mq = MQProducer()
     try:
         # 删除消息队列device_id
-        mq.channel.queue_delete(device_id)
+        await mq_producer.delete_queue(device_id)
         logging.info(f"成功删除消息队列: {device_id}")
     except Exception as e:
         logging.error(f"删除消息队列失败: {str(e)}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="设备队列清理失败！")
-    finally:
-        # 关闭MQ生产者实例
-        mq.close()
     # 删除设备
     await device.delete()
+    await forget_heartbeat(device_id)
 
 
-# websocket接口
+async def _send_messages(websocket: WebSocket, viewer: DeviceViewer):
+    """日志按顺序全部发送；画面只发送最新的一帧，两帧之间的间隔不小于 1/max_fps 秒"""
+    loop = asyncio.get_running_loop()
+    next_frame = 0.0
+    while True:
+        if viewer.overflow:
+            logging.warning("客户端接收日志过慢，断开连接")
+            break
+        while viewer.logs:
+            await websocket.send_text(json.dumps({"type": "log", "data": viewer.logs.popleft()}))
+        if viewer.frame is not None and loop.time() >= next_frame:
+            frame, viewer.frame = viewer.frame, None
+            try:
+                await (websocket.send_bytes(frame.binary) if viewer.binary else websocket.send_text(frame.text))
+            except ValueError:
+                # 不是base64图片数据时按文本消息发送
+                await websocket.send_text(frame.text)
+            next_frame = loop.time() + 1 / viewer.max_fps
+        # 有画面等待发送时，到下一帧的发送时间再唤醒
+        await viewer.wait(max(next_frame - loop.time(), 0) if viewer.frame is not None else None)
+
+
+async def _receive_control(websocket: WebSocket, viewer: DeviceViewer):
+    """接收客户端的控制消息（如 {"max_fps": 5} 调整帧率），客户端断开时返回"""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            break
+        try:
+            # json.loads会把NaN、Infinity解析为浮点数，由set_max_fps拒绝
+            control = json.loads(message.get("text") or "{}")
+            if isinstance(control, dict) and control.get("max_fps"):
+                viewer.set_max_fps(control["max_fps"])
+        except (ValueError, TypeError):
+            pass
+
+
+# websocket接口，binary=true时画面以二进制消息（图片字节）发送，max_fps为客户端能接收的最大帧率
 @router.websocket("/ws/{device_id}")
-async def websocket_subscribe(websocket: WebSocket, device_id: str):
+async def websocket_subscribe(websocket: WebSocket, device_id: str, binary: bool = False, max_fps: float = None):
+    try:
+        viewer = DeviceViewer(binary=binary, max_fps=max_fps)
+    except ValueError:
+        # 帧率参数为NaN、无穷大时拒绝连接
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
     await websocket.accept()
     logging.info(f"WebSocket连接已接受: {device_id}")
-    redis_cli = Redis(host=settings.REDIS_CONFIG['host'],
-                      port=settings.REDIS_CONFIG['port'],
-                      db=settings.REDIS_CONFIG['db'],
-                      password=settings.REDIS_CONFIG['password'],
-                      decode_responses=True
-                      )
-    # 初始化一个订阅器
-    pubsub = redis_cli.pubsub()
+    subscribed = False
     try:
-        # 订阅事件频道
-        await pubsub.subscribe(f"{device_id}:log", f"{device_id}:screen")
-        logging.info(f"已订阅频道：{device_id}:log 和 {device_id}:screen")
+        # 同一进程中查看同一台设备的客户端共用一个订阅
+        await device_hub.subscribe(device_id, viewer)
+        subscribed = True
         # 发送历史日志
-        history_logs = await redis_cli.lrange(f"{device_id}:history_logs", 0, -1)
+        history_logs = await device_hub.redis.lrange(f"{device_id}:history_logs", 0, -1)
         for log in history_logs:
             if websocket.client_state != WebSocketState.CONNECTED:
                 break
@@ -98,59 +143,30 @@ async def websocket_subscribe(websocket: WebSocket, device_id: str):
                 "data": log
             }
             await websocket.send_text(json.dumps(message))
-            logging.info(f"发送历史日志到客户端：{log}")
         # 发送缓存画面
-        msg_data = {
-            "type": "log",
-            "data": await redis_cli.get(f'{device_id}:cached_image')
-        }
-        await websocket.send_text(json.dumps(msg_data))
-        # 循环接收订阅的消息
-        async for message in pubsub.listen():
-            # 连接断开时立即退出循环
-            if websocket.client_state != WebSocketState.CONNECTED:
-                break
-            if message['type'] == 'message':
-                try:
-                    if message['channel'] == f"{device_id}:log":
-                        msg_data = {
-                            "type": "log",
-                            "data": message['data']
-                        }
-                    elif message['channel'] == f"{device_id}:screen":
-                        msg_data = {
-                            "type": "screen",
-                            "data": message['data']
-                        }
-                    # 发送前最终状态确认
-                    if websocket.client_state == WebSocketState.CONNECTED:
-                        await websocket.send_text(json.dumps(msg_data))
-                        logging.info(f"发送数据到客户端: {msg_data['type']} ({len(message['data'])} 字节)")
-                except RuntimeError as e:
-                    if "WebSocket is not connected" in str(e):
-                        break
-                    logging.error(f"发送失败: {str(e)}")
-                except Exception as e:
-                    logging.error(f"处理消息时出错: {str(e)}")
-                    break
-            await asyncio.sleep(0.01)
+        cached_image = await device_hub.redis.get(f'{device_id}:cached_image')
+        if binary:
+            if cached_image:
+                await websocket.send_bytes(ScreenFrame(cached_image).binary)
+        else:
+            await websocket.send_text(json.dumps({"type": "log", "data": cached_image}))
+        # 循环发送订阅的消息，直到客户端断开或发送失败
+        tasks = [asyncio.create_task(_send_messages(websocket, viewer)),
+                 asyncio.create_task(_receive_control(websocket, viewer))]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            if task.exception():
+                raise task.exception()
     except WebSocketDisconnect:
         logging.info(f"客户端正常断开: {device_id}")
     except Exception as e:
         logging.error(f"WebSocket处理过程中出错: {str(e)}")
     finally:
-        try:
-            # 连接关闭检查
-            if pubsub and pubsub.subscribed:
-                # 取消订阅
-                await pubsub.unsubscribe()
-                # 等待取消订阅完成
-                await asyncio.sleep(0.1)
-                logging.info(f"已取消订阅频道: {device_id}:log 和 {device_id}:screen")
-        except Exception as e:
-            logging.error(f"取消订阅时出错: {e}")
-        if redis_cli:
-            await redis_cli.close()
+        if subscribed:
+            await device_hub.unsubscribe(device_id, viewer)
         if not websocket.client_state == WebSocketState.DISCONNECTED:
             try:
                 await websocket.close()
@@ -1,95 +1,222 @@
 """
-设备心跳主动监测，检测间隔：60秒（settings.HEARTBEAT_CHECK_INTERVAL）
+设备心跳检测
+1. 主动上报：设备定时调用 POST /device/{device_id}/heartbeat，心跳时间记录在Redis有序集合 devices:hb 中，
+   每隔 HEARTBEAT_CONFIG['sweep_interval'] 秒按分数范围只取出新过期的设备，批量改为离线
+2. 主动监测：没有上报过心跳的旧版本设备，每隔 HEARTBEAT_CHECK_INTERVAL 秒通过HTTP健康检查
 """
 import asyncio
 import json
+import time
 
 import aiohttp
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional
 from .models import Device
 from common import settings
+from common.metrics import metrics
 from common.redis_client import redis_cli
+from dispatch.outbox import release_deferred
 import logging
 
 logger = logging.getLogger(__name__)
 
-async def check_device_connection(device_id: str, device_ip: str) -> bool:
-    """增强型设备连接检测"""
-    # 方式1：HTTP健康检查（主检测方式）
-    try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=2)) as session:
-            async with session.get(f"http://{device_ip}:{settings.DEVICE_PORT}/health") as resp:
-                if resp.status == 200:
-                    return True
-    except:
-        pass
-
-    # 方式2：Redis心跳包检测（备用方案）
-    last_heartbeat = await redis_cli.get(f"device:{device_id}:last_heartbeat")
-    if last_heartbeat and datetime.now() - datetime.fromisoformat(last_heartbeat) < timedelta(seconds=30):
+# 设备心跳时间的有序集合 {设备id: 最近一次心跳的时间戳}
+HEARTBEAT_KEY = "devices:hb"
+# 记录心跳并返回上一次的心跳时间，一次往返判断设备是否从离线恢复
+_HEARTBEAT_SCRIPT = """
+local previous = redis.call('zscore', KEYS[1], ARGV[1])
+redis.call('zadd', KEYS[1], ARGV[2], ARGV[1])
+return previous
+"""
+# 在线、执行任务中的状态，收到心跳时不需要修改
+ALIVE_STATUSES = ["在线", "忙碌", "执行中"]
+# 旧版本设备通过Redis心跳包检测时的有效时间（秒）
+LEGACY_HEARTBEAT_SECONDS = 30
+
+
+class DeviceProber:
+    """设备HTTP健康检查，所有设备共用一个连接池，并限制同时检测的设备数"""
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore = asyncio.Semaphore(settings.HEARTBEAT_CONFIG.get('probe_concurrency', 100))
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            concurrency = settings.HEARTBEAT_CONFIG.get('probe_concurrency', 100)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=concurrency),
+                timeout=aiohttp.ClientTimeout(total=settings.HEARTBEAT_CONFIG.get('probe_timeout', 2)))
+        return self._session
+
+    async def probe(self, device_ip: str) -> bool:
+        """HTTP健康检查，返回设备是否存活"""
+        async with self._semaphore:
+            start = time.perf_counter()
+            alive = False
+            try:
+                async with self._get_session().get(f"http://{device_ip}:{settings.DEVICE_PORT}/health") as resp:
+                    alive = resp.status == 200
+            except Exception:
+                pass
+            metrics.latency("heartbeat.probe").observe(time.perf_counter() - start, ok=alive)
+            return alive
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+async def _publish_status(device_ids: List[str], new_status: str):
+    """状态变更时发布通知，多台设备一次往返发布"""
+    message = json.dumps({"status": new_status, "timestamp": datetime.now().isoformat()})
+    async with redis_cli.pipeline(transaction=False) as pipe:
+        for device_id in device_ids:
+            pipe.publish(f"device:{device_id}:status", message)
+        await pipe.execute()
+    for device_id in device_ids:
+        logger.info(f"设备状态同步 | ID:{device_id} 状态变更为:{new_status}")
+
+
+async def mark_online(device_ids: List[str]):
+    """设备恢复在线：只有当状态不是"在线"或"忙碌"时才改为"在线"，并下发设备离线期间暂存的任务"""
+    changed = await Device.filter(id__in=device_ids).exclude(status__in=ALIVE_STATUSES).values_list('id', flat=True)
+    if not changed:
+        return
+    await Device.filter(id__in=changed).exclude(status__in=ALIVE_STATUSES).update(status="在线")
+    metrics.incr("heartbeat.online", len(changed))
+    await _publish_status(changed, "在线")
+    for device_id in changed:
+        await release_deferred(device_id)
+
+
+async def mark_offline(device_ids: List[str]) -> List[str]:
+    """
+    设备批量改为离线
+    :return: 状态发生变化的设备id
+    """
+    changed = await Device.filter(id__in=device_ids).exclude(status="离线").values_list('id', flat=True)
+    if changed:
+        await Device.filter(id__in=changed).update(status="离线")
+        metrics.incr("heartbeat.offline", len(changed))
+        await _publish_status(changed, "离线")
+    return changed
+
+
+async def record_heartbeat(device_id: str) -> bool:
+    """
+    记录设备上报的心跳，正常情况下只有一次Redis操作；首次上报或心跳已过期时把设备改为在线
+    :return: 设备不存在时返回False
+    """
+    now = time.time()
+    previous = await redis_cli.eval(_HEARTBEAT_SCRIPT, 1, HEARTBEAT_KEY, device_id, now)
+    if previous is not None and float(previous) >= now - settings.HEARTBEAT_CONFIG.get('timeout', 15):
         return True
-
-    return False
-
-
-async def sync_device_status(device, is_alive: bool):
-    """原子化状态同步操作"""
-    if is_alive:
-        # 心跳连接成功
-        if device.status not in ["在线", "忙碌", "执行中"]:
-            # 只有当状态不是"在线"或"忙碌"时才改为"在线"
-            new_status = "在线"
-            device.status = new_status
-            await device.save(update_fields=['status'])
-
-            # 状态变更时发布通知
-            await redis_cli.publish(
-                f"device:{device.id}:status",
-                json.dumps({"status": new_status, "timestamp": datetime.now().isoformat()})
-            )
-            logger.info(f"设备状态同步 | ID:{device.id} 状态变更为:{new_status}")
-    else:
-        # 心跳连接失败，改为离线
-        if device.status != "离线":
-            new_status = "离线"
-            device.status = new_status
-            await device.save(update_fields=['status'])
-
-            # 状态变更时发布通知
-            await redis_cli.publish(
-                f"device:{device.id}:status",
-                json.dumps({"status": new_status, "timestamp": datetime.now().isoformat()})
-            )
-            logger.info(f"设备状态同步 | ID:{device.id} 状态变更为:{new_status}")
-
-
-async def check_devices_heartbeat():
-    """分布式设备心跳检测服务"""
+    if not await Device.exists(id=device_id):
+        await redis_cli.zrem(HEARTBEAT_KEY, device_id)
+        return False
+    await mark_online([device_id])
+    return True
+
+
+async def forget_heartbeat(device_id: str):
+    """删除设备时移除心跳记录"""
+    await redis_cli.zrem(HEARTBEAT_KEY, device_id)
+
+
+async def sweep_expired_devices(since: str = '-inf') -> str:
+    """
+    把心跳时间在 (since, 当前时间-超时时间] 范围内的设备批量改为离线，每次只处理上次扫描后新过期的设备
+    :param since: 上一次扫描的截止时间
+    :return: 本次扫描的截止时间，作为下一次扫描的since
+    """
+    deadline = time.time() - settings.HEARTBEAT_CONFIG.get('timeout', 15)
+    lower = since if since == '-inf' else f"({since}"
+    expired = [device_id.decode() for device_id in await redis_cli.zrangebyscore(HEARTBEAT_KEY, lower, deadline)]
+    if expired:
+        offline = await mark_offline(expired)
+        if offline:
+            # 扫描期间又上报了心跳的设备恢复为在线
+            async with redis_cli.pipeline(transaction=False) as pipe:
+                for device_id in offline:
+                    pipe.zscore(HEARTBEAT_KEY, device_id)
+                scores = await pipe.execute()
+            revived = [device_id for device_id, score in zip(offline, scores) if score is not None and score > deadline]
+            if revived:
+                await mark_online(revived)
+    return str(deadline)
+
+
+def _legacy_heartbeat_alive(value: Optional[bytes]) -> bool:
+    """旧版本设备写入的Redis心跳包是否有效"""
+    if not value:
+        return False
+    last_heartbeat = datetime.fromisoformat(value.decode())
+    return datetime.now() - last_heartbeat < timedelta(seconds=LEGACY_HEARTBEAT_SECONDS)
+
+
+async def poll_legacy_devices(prober: DeviceProber):
+    """通过HTTP检测没有上报过心跳的设备，HTTP检测失败的再检查设备写入的Redis心跳包，状态变化按目标状态批量更新"""
+    devices = await Device.all().only('id', 'ip', 'status')
+    if not devices:
+        return
+    # 一次往返查询所有设备的心跳记录和旧版本心跳包
+    async with redis_cli.pipeline(transaction=False) as pipe:
+        for device in devices:
+            pipe.zscore(HEARTBEAT_KEY, device.id)
+        pipe.mget([f"device:{device.id}:last_heartbeat" for device in devices])
+        *scores, fallbacks = await pipe.execute()
+    legacy = [(device, fallback) for device, score, fallback in zip(devices, scores, fallbacks) if score is None]
+    # 并行检测所有设备
+    probed = await asyncio.gather(*(prober.probe(device.ip) for device, _ in legacy))
+    alive: Dict[str, bool] = {}
+    for (device, fallback), ok in zip(legacy, probed):
+        try:
+            alive[device.id] = ok or _legacy_heartbeat_alive(fallback)
+        except ValueError:
+            alive[device.id] = ok
+    statuses = {device.id: device.status for device, _ in legacy}
+    online = [device_id for device_id, ok in alive.items() if ok and statuses[device_id] not in ALIVE_STATUSES]
+    offline = [device_id for device_id, ok in alive.items() if not ok and statuses[device_id] != "离线"]
+    if online:
+        await mark_online(online)
+    if offline:
+        await mark_offline(offline)
+
+
+async def _poll_legacy_loop(prober: DeviceProber):
+    """旧版本设备的HTTP检测循环，检测耗时较长（最多为检测超时时间），不阻塞过期心跳的扫描"""
     while True:
         try:
-            # 确保获取设备时包含所有字段
-            devices = await Device.all().only('id', 'ip', 'status')
-
-            # 并行检测所有设备
-            tasks = []
-            for device in devices:
-                task = asyncio.create_task(
-                    _process_single_device(device),
-                    name=f"heartbeat_check_{device.id}"
-                )
-                tasks.append(task)
-
-            await asyncio.gather(*tasks, return_exceptions=True)
-
+            with metrics.latency("heartbeat.poll").time():
+                await poll_legacy_devices(prober)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.error(f"心跳检测主循环异常: {str(e)}", exc_info=True)
+            logger.error(f"旧版本设备心跳检测异常: {str(e)}", exc_info=True)
+        await asyncio.sleep(settings.HEARTBEAT_CHECK_INTERVAL)
 
-        await asyncio.sleep(settings.HEARTBEAT_CHECK_INTERVAL)  # 检测间隔
 
-async def _process_single_device(device):
-    """处理单个设备的状态检测"""
+async def check_devices_heartbeat():
+    """分布式设备心跳检测服务，只在后台服务leader进程中运行"""
+    since = '-inf'
+    prober = DeviceProber()
+    poll_task = asyncio.create_task(_poll_legacy_loop(prober))
     try:
-        is_alive = await check_device_connection(device.id, device.ip)
-        await sync_device_status(device, is_alive)
-    except Exception as e:
-        logger.error(f"设备检测异常 | ID:{device.id} 错误:{str(e)}", exc_info=True)
\ No newline at end of file
+        while True:
+            try:
+                with metrics.latency("heartbeat.sweep").time():
+                    since = await sweep_expired_devices(since)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"心跳检测主循环异常: {str(e)}", exc_info=True)
+
+            await asyncio.sleep(settings.HEARTBEAT_CONFIG.get('sweep_interval', 3))  # 检测间隔
+    finally:
+        poll_task.cancel()
+        try:
+            await poll_task
+        except asyncio.CancelledError:
+            pass
+        await prober.close()
@@ -0,0 +1,200 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：hub
+@Time ：2025/10/19 10:30
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 设备日志、画面的订阅中心：每个进程只用一个Redis订阅连接，每台设备的频道只订阅一次，
+            收到的消息分发给本进程中查看这台设备的所有WebSocket客户端，最后一个客户端断开后取消订阅；
+            日志不丢弃，画面只保留最新的一帧，按客户端协商的帧率发送
+"""
+import asyncio
+import base64
+import json
+import logging
+import math
+from collections import deque
+from typing import Deque, Dict, Optional, Set, Tuple
+
+from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
+
+from common import settings
+from common.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ScreenFrame:
+    """一帧设备画面，解码和序列化的结果由查看这台设备的所有客户端共用"""
+    __slots__ = ('data', '_binary', '_text')
+
+    def __init__(self, data: str):
+        """:param data: 设备发布的base64图片数据，可以带 data:image/...;base64, 前缀"""
+        self.data = data
+        self._binary: Optional[bytes] = None
+        self._text: Optional[str] = None
+
+    @property
+    def binary(self) -> bytes:
+        """二进制模式发送的图片字节"""
+        if self._binary is None:
+            self._binary = base64.b64decode(self.data.split(',', 1)[1] if self.data.startswith('data:') else self.data)
+        return self._binary
+
+    @property
+    def text(self) -> str:
+        """文本模式发送的JSON消息，与原有格式一致"""
+        if self._text is None:
+            self._text = json.dumps({"type": "screen", "data": self.data})
+        return self._text
+
+
+class DeviceViewer:
+    """
+    一个WebSocket客户端待发送的消息：日志按顺序全部发送，画面只保留最新的一帧并按客户端的最大帧率发送
+    """
+
+    def __init__(self, binary: bool = False, max_fps: float = None):
+        """
+        :param binary: 画面是否以二进制消息发送
+        :param max_fps: 客户端要求的最大帧率，不超过服务端配置的上限
+        """
+        self.binary = binary
+        self.max_fps = settings.DEVICE_STREAM_CONFIG.get('default_fps', 10)
+        self.logs: Deque[str] = deque()
+        self.frame: Optional[ScreenFrame] = None
+        # 客户端长时间不消费日志时断开连接，不丢弃日志
+        self.overflow = False
+        self._event = asyncio.Event()
+        if max_fps:
+            self.set_max_fps(max_fps)
+
+    def set_max_fps(self, max_fps: float):
+        """设置客户端的最大帧率，限制在 0.1 ~ 服务端配置的上限之间；NaN、无穷大无法限制范围，直接拒绝"""
+        max_fps = float(max_fps)
+        if not math.isfinite(max_fps):
+            raise ValueError(f"帧率必须是有限的数值: {max_fps}")
+        self.max_fps = min(max(max_fps, 0.1), settings.DEVICE_STREAM_CONFIG.get('max_fps', 30))
+
+    def push_log(self, data: str):
+        if len(self.logs) >= settings.DEVICE_STREAM_CONFIG.get('log_queue_size', 1000):
+            self.overflow = True
+        else:
+            self.logs.append(data)
+        self._event.set()
+
+    def push_frame(self, frame: ScreenFrame):
+        if self.frame is not None:
+            # 上一帧还没有发送，直接用最新的一帧替换
+            metrics.incr("device_stream.frames_dropped")
+        self.frame = frame
+        self._event.set()
+
+    async def wait(self, timeout: float = None):
+        """等待新的日志或画面，timeout秒后返回"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+
+
+class DeviceStreamHub:
+    """设备日志、画面的订阅中心，消息分发给各客户端的DeviceViewer"""
+
+    def __init__(self):
+        self._redis: Optional[Redis] = None
+        self._pubsub: Optional[PubSub] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._clients: Dict[str, Set[DeviceViewer]] = {}
+        self._lock = asyncio.Lock()
+
+    @property
+    def redis(self) -> Redis:
+        """订阅中心使用的Redis客户端（返回字符串），也用于查询历史日志、缓存画面"""
+        if self._redis is None:
+            self._redis = Redis(host=settings.REDIS_CONFIG['host'],
+                                port=settings.REDIS_CONFIG['port'],
+                                db=settings.REDIS_CONFIG['db'],
+                                password=settings.REDIS_CONFIG['password'],
+                                decode_responses=True
+                                )
+        return self._redis
+
+    @staticmethod
+    def channels(device_id: str) -> Tuple[str, str]:
+        return f"{device_id}:log", f"{device_id}:screen"
+
+    async def subscribe(self, device_id: str, viewer: DeviceViewer):
+        """客户端开始查看设备，第一个客户端时订阅设备的频道"""
+        async with self._lock:
+            if device_id not in self._clients:
+                if self._pubsub is None:
+                    self._pubsub = self.redis.pubsub()
+                await self._pubsub.subscribe(*self.channels(device_id))
+                logger.info(f"已订阅频道：{device_id}:log 和 {device_id}:screen")
+                self._clients[device_id] = set()
+            self._clients[device_id].add(viewer)
+            # 没有订阅时读取任务会退出，重新订阅后再启动
+            if self._reader is None or self._reader.done():
+                self._reader = asyncio.create_task(self._read())
+
+    async def unsubscribe(self, device_id: str, viewer: DeviceViewer):
+        """客户端停止查看设备，最后一个客户端离开时取消订阅设备的频道"""
+        async with self._lock:
+            clients = self._clients.get(device_id)
+            if clients is None:
+                return
+            clients.discard(viewer)
+            if clients:
+                return
+            del self._clients[device_id]
+            try:
+                await self._pubsub.unsubscribe(*self.channels(device_id))
+                logger.info(f"已取消订阅频道: {device_id}:log 和 {device_id}:screen")
+            except Exception as e:
+                logger.error(f"取消订阅时出错: {e}")
+
+    def _dispatch(self, channel: str, data: str):
+        """把一条消息分发给查看这台设备的所有客户端"""
+        device_id, _, kind = channel.rpartition(':')
+        viewers = self._clients.get(device_id, ())
+        if kind == "screen":
+            frame = ScreenFrame(data)
+            for viewer in viewers:
+                viewer.push_frame(frame)
+        else:
+            for viewer in viewers:
+                viewer.push_log(data)
+
+    async def _read(self):
+        """读取订阅的消息并分发，所有频道都取消订阅后退出"""
+        while self._pubsub.subscribed:
+            try:
+                async for message in self._pubsub.listen():
+                    if message['type'] == 'message':
+                        self._dispatch(message['channel'], message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"设备订阅消息读取异常: {str(e)}", exc_info=True)
+                await asyncio.sleep(1)
+
+    async def close(self):
+        """进程退出时关闭订阅连接"""
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        if self._redis is not None:
+            await self._redis.aclose()
+
+
+device_hub = DeviceStreamHub()
@@ -21,3 +21,5 @@ class Device(models.Model):
     class Meta:
         table = "device"
         table_description = "执行设备"
+        # 按状态查询空闲/在线设备
+        indexes = (("status",),)
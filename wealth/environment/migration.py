@@ -0,0 +1,73 @@
+"""
+执行环境快照数据迁移脚本
+表结构变更（env_snapshot表、执行记录表的env_snapshot_id字段）先通过aerich生成并执行：
+    aerich migrate --name env_snapshot && aerich upgrade
+再执行本脚本，把历史执行记录中的env转存为快照并清空原字段：
+    python -m wealth.environment.migration
+"""
+import asyncio
+import logging
+from tortoise import Tortoise
+from common.settings import TORTOISE_ORM
+
+# 每批处理的记录数
+BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+async def migrate_model(model):
+    """按id分批把一张执行记录表的env转存为快照"""
+    from wealth.environment.snapshot import snapshot_env, env_digest
+
+    last_id, migrated = 0, 0
+    # 同一次迁移中相同内容的执行环境只查询一次快照
+    snapshot_ids = {}
+    while True:
+        rows = await model.filter(id__gt=last_id, env_snapshot_id__isnull=True).order_by('id').limit(BATCH_SIZE) \
+            .values('id', 'env')
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        groups = {}
+        for row in rows:
+            if not row['env']:
+                continue
+            digest = env_digest(row['env'])
+            if digest not in snapshot_ids:
+                snapshot_ids[digest] = await snapshot_env(row['env'])
+            groups.setdefault(snapshot_ids[digest], []).append(row['id'])
+        # 同一个快照的记录一条UPDATE语句写回
+        for snapshot_id, ids in groups.items():
+            await model.filter(id__in=ids).update(env_snapshot_id=snapshot_id, env={})
+            migrated += len(ids)
+    logger.info(f"{model.__name__} 迁移完成，共 {migrated} 条记录")
+
+
+async def migrate_env_snapshot():
+    """执行执行环境快照迁移"""
+
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        # 初始化数据库连接
+        await Tortoise.init(config=TORTOISE_ORM)
+
+        from uiTest.runner.models import TaskRunRecord, SuiteRunRecord, CaseRunRecord
+        from apiTest.apiRecordExecution.models import ApiTaskRunRecord, ApiSuiteRunRecord, ApiCaseRunRecord
+
+        logger.info("开始执行环境快照迁移...")
+        for model in (TaskRunRecord, SuiteRunRecord, CaseRunRecord,
+                      ApiTaskRunRecord, ApiSuiteRunRecord, ApiCaseRunRecord):
+            await migrate_model(model)
+        logger.info("执行环境快照迁移完成！")
+
+    except Exception as e:
+        logger.error(f"迁移失败: {str(e)}")
+        raise
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate_env_snapshot())
@@ -18,3 +18,15 @@ class Environment(models.Model):
     class Meta:
         table = "environment"
         table_description = "测试环境"
+
+
+class EnvSnapshot(models.Model):
+    """执行环境快照，按内容哈希去重，执行记录只保存快照id"""
+    id = fields.IntField(pk=True, description="快照id")
+    digest = fields.CharField(max_length=64, unique=True, description="执行环境内容的sha256")
+    env = fields.JSONField(description="执行环境", default=dict)
+    create_time = fields.DatetimeField(auto_now_add=True, description="创建时间")
+
+    class Meta:
+        table = "env_snapshot"
+        table_description = "执行环境快照"
@@ -0,0 +1,83 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+"""
+@Project ：ui_test_backend
+@File ：snapshot
+@Time ：2025/10/17 17:30
+@Author ：11031840
+@Motto: 理解しあうのはとても大事なことです。理解とは误解の総体に过ぎないと言う人もいますし
+@describe： 执行环境快照：相同内容的执行环境只保存一份，执行记录通过env_snapshot_id引用
+"""
+import hashlib
+import json
+from typing import Iterable
+
+from tortoise import timezone
+
+from .models import EnvSnapshot
+
+# 快照内容不可变，进程内缓存 快照id->执行环境
+_CACHE_SIZE = 256
+_snapshot_envs = {}
+# 相同内容的快照已存在时返回已有的id：并发创建时等待另一个事务提交后读取最新的记录，
+# 不受调用方事务的可重复读快照影响（事务中先查询过时，之后普通查询读不到其他事务新提交的快照）
+_UPSERT_SQL = ("INSERT INTO env_snapshot (digest, env, create_time) VALUES (%s, %s, %s) "
+               "ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)")
+
+
+def _remember(cache: dict, key, value):
+    if len(cache) >= _CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+    cache[key] = value
+
+
+def env_digest(env_config: dict) -> str:
+    """执行环境内容的摘要，键顺序不影响结果"""
+    content = json.dumps(env_config, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+async def snapshot_env(env_config: dict) -> int:
+    """
+    获取执行环境对应的快照id，不存在时创建
+    可能在调用方的事务中执行，事务回滚时快照也会回滚，所以这里不缓存快照id
+    :param env_config: 执行环境
+    :return: 快照id
+    """
+    digest = env_digest(env_config)
+    snapshot_id = await EnvSnapshot.filter(digest=digest).first().values_list('id', flat=True)
+    if snapshot_id:
+        return snapshot_id
+    env = json.dumps(env_config, ensure_ascii=False, default=str)
+    return await EnvSnapshot._meta.db.execute_insert(_UPSERT_SQL, [digest, env, timezone.now()])
+
+
+async def hydrate_env(records: Iterable):
+    """
+    把快照中的执行环境回填到执行记录的env，历史记录（没有快照id）保持原有的env
+    :param records: 执行记录或values()查询出的字典列表，一次查询加载所有缺失的快照
+    """
+    pending = []
+    for record in records:
+        if isinstance(record, dict):
+            # 快照id只用于回填，不返回给前端
+            snapshot_id = record.pop('env_snapshot_id', None)
+        else:
+            snapshot_id = getattr(record, 'env_snapshot_id', None)
+        if snapshot_id:
+            pending.append((record, snapshot_id))
+    snapshot_ids = {snapshot_id for _, snapshot_id in pending}
+    envs = {snapshot_id: _snapshot_envs[snapshot_id] for snapshot_id in snapshot_ids if snapshot_id in _snapshot_envs}
+    missing = snapshot_ids - set(envs)
+    if missing:
+        for snapshot_id, env in await EnvSnapshot.filter(id__in=missing).values_list('id', 'env'):
+            envs[snapshot_id] = env
+            _remember(_snapshot_envs, snapshot_id, env)
+    for record, snapshot_id in pending:
+        if snapshot_id not in envs:
+            continue
+        if isinstance(record, dict):
+            record['env'] = envs[snapshot_id]
+        else:
+            record.env = envs[snapshot_id]
+    return records